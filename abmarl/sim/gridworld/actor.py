@@ -6,7 +6,6 @@ from gym.spaces import Box, Discrete
 
 from abmarl.sim.gridworld.base import GridWorldBaseComponent
 from abmarl.sim.gridworld.agent import MovingAgent, AttackingAgent
-import abmarl.sim.gridworld.utils as gu
 
 
 class ActorBaseComponent(GridWorldBaseComponent, ABC):
@@ -54,15 +53,40 @@ class ActorBaseComponent(GridWorldBaseComponent, ABC):
 class MoveActor(ActorBaseComponent):
     """
     Agents can move to unoccupied nearby squares.
+
+    Args:
+        move_resolution: How process_moves resolves the moves of multiple agents.
+            Either "sequential" or "simultaneous". Default "sequential".
     """
-    def __init__(self, **kwargs):
+    def __init__(self, move_resolution='sequential', **kwargs):
         super().__init__(**kwargs)
+        self.move_resolution = move_resolution
         for agent in self.agents.values():
             if isinstance(agent, self.supported_agent_type):
                 agent.action_space[self.key] = Box(
                     -agent.move_range, agent.move_range, (2,), int
                 )
 
+    @property
+    def move_resolution(self):
+        """
+        How process_moves resolves the moves of multiple agents.
+
+        With "sequential", the moves are processed one agent at a time in order,
+        exactly as if process_action was called for each agent. With "simultaneous",
+        every move is checked against the grid at the start of the step, so a
+        cell that another agent is leaving is still occupied. If multiple agents
+        move to the same cell and any two of them cannot overlap, then all of those
+        moves are rejected.
+        """
+        return self._move_resolution
+
+    @move_resolution.setter
+    def move_resolution(self, value):
+        assert value in ['sequential', 'simultaneous'], \
+            "Move resolution must be either 'sequential' or 'simultaneous'."
+        self._move_resolution = value
+
     @property
     def key(self):
         """
@@ -111,6 +135,88 @@ class MoveActor(ActorBaseComponent):
             else:
                 return False
 
+    def process_moves(self, agents, moves, **kwargs):
+        """
+        Move multiple agents at once.
+
+        The new positions are computed and checked against the grid's bounds for
+        all the agents together, and the moves are then resolved according to
+        the move resolution.
+
+        Args:
+            agents: List of N MovingAgents.
+            moves: N x 2 array of the agents' moves.
+
+        Returns:
+            Boolean array of size N that is True where the move is successful.
+        """
+        for agent in agents:
+            assert isinstance(agent, self.supported_agent_type), \
+                f"{agent.id} is not supported by this Actor."
+        moves = np.asarray(moves, dtype=int).reshape(len(agents), 2)
+        positions = np.array([agent.position for agent in agents], dtype=int).reshape(-1, 2)
+        new_positions = positions + moves
+        success = (new_positions >= 0).all(axis=1) & \
+            (new_positions < (self.rows, self.cols)).all(axis=1)
+        staying = success & (moves == 0).all(axis=1)
+        moving = np.flatnonzero(success & ~staying)
+
+        if self.move_resolution == 'sequential':
+            for i in moving:
+                if self.grid.query(agents[i], new_positions[i]):
+                    self.grid.remove(agents[i], positions[i])
+                    self.grid.place(agents[i], new_positions[i])
+                else:
+                    success[i] = False
+            return success
+
+        # Simultaneous: check the moves against the grid at the start of the step.
+        for i in moving:
+            success[i] = self.grid.query(agents[i], new_positions[i])
+        moving = moving[success[moving]]
+        # Reject the moves to the same cell unless all those agents can overlap.
+        cells = new_positions[moving, 0] * self.cols + new_positions[moving, 1]
+        _, inverse, counts = np.unique(cells, return_inverse=True, return_counts=True)
+        shared = counts[inverse] > 1
+        if shared.any():
+            overlap_matrix = self.grid.overlap_matrix
+            for group in np.unique(inverse[shared]):
+                members = moving[inverse == group]
+                encodings = np.array([agents[i].encoding for i in members])
+                pairs = overlap_matrix[encodings[:, None], encodings[None, :]]
+                if not pairs[~np.eye(len(members), dtype=bool)].all():
+                    success[members] = False
+            moving = moving[success[moving]]
+
+        # Commit the moves: every mover leaves its cell before any mover arrives.
+        for i in moving:
+            self.grid.remove(agents[i], positions[i])
+        for i in moving:
+            self.grid.place(agents[i], new_positions[i])
+        return success
+
+    def process_actions(self, action_dict, **kwargs):
+        """
+        Process the moves of all the agents at once.
+
+        Args:
+            action_dict: Dictionary that maps agent ids to their action dictionaries
+                in this step, like the one given to the simulation's step.
+
+        Returns:
+            Dictionary that maps each MovingAgent's id in the action dictionary
+            to the successfulness of its move.
+        """
+        agents = [
+            self.agents[agent_id] for agent_id in action_dict
+            if isinstance(self.agents[agent_id], self.supported_agent_type)
+        ]
+        if not agents:
+            return {}
+        moves = np.array([action_dict[agent.id][self.key] for agent in agents])
+        success = self.process_moves(agents, moves, **kwargs)
+        return {agent.id: bool(result) for agent, result in zip(agents, success)}
+
 
 class AttackActor(ActorBaseComponent):
     """
@@ -143,6 +249,20 @@ class AttackActor(ActorBaseComponent):
                 assert type(i) is int, \
                     "All elements in the attack mapping values must be integers."
         self._attack_mapping = value
+        self._attack_matrix = None
+        self._compile_attack_matrix(0)
+
+    @property
+    def attack_matrix(self):
+        """
+        Read-only boolean matrix compiled from the attack mapping.
+
+        ``attack_matrix[i, j]`` is True if an agent with encoding ``i`` can attack
+        an agent with encoding ``j``. Row and column 0 are unused.
+        """
+        view = self._attack_matrix.view()
+        view.flags.writeable = False
+        return view
 
     @property
     def key(self):
@@ -175,31 +295,19 @@ class AttackActor(ActorBaseComponent):
         possibly resulting in its death.
         """
         def determine_attack(agent):
-            # Generate local grid and an attack mask.
-            local_grid, mask = gu.create_grid_and_mask(
-                agent, self.grid, agent.attack_range, self.agents
-            )
-
-            # Randomly scan the local grid for attackable agents.
+            if agent.encoding not in self.attack_mapping:
+                # This type of agent cannot attack anything
+                return None
+            # Randomly roll the attack on each attackable neighbor.
             attackable_agents = []
-            for r in range(2 * agent.attack_range + 1):
-                for c in range(2 * agent.attack_range + 1):
-                    if mask[r, c]: # We can see this cell
-                        candidate_agents = local_grid[r, c]
-                        if candidate_agents is not None:
-                            for other in candidate_agents.values():
-                                if other.id == agent.id: # Cannot attack yourself
-                                    continue
-                                elif not other.active: # Cannot attack inactive agents
-                                    continue
-                                elif other.encoding not in self.attack_mapping[agent.encoding]:
-                                    # Cannot attack this type of agent
-                                    continue
-                                elif np.random.uniform() > agent.attack_accuracy:
-                                    # Failed attack
-                                    continue
-                                else:
-                                    attackable_agents.append(other)
+            for other_id in self.grid.neighbors(
+                agent, agent.attack_range, encodings=self.attack_mapping[agent.encoding]
+            ):
+                if np.random.uniform() > agent.attack_accuracy:
+                    # Failed attack
+                    continue
+                else:
+                    attackable_agents.append(self.agents[other_id])
             return np.random.choice(attackable_agents) if attackable_agents else None
 
         if isinstance(attacking_agent, self.supported_agent_type):
@@ -211,3 +319,129 @@ class AttackActor(ActorBaseComponent):
                     if not attacked_agent.active:
                         self.grid.remove(attacked_agent, attacked_agent.position)
                 return attacked_agent
+
+    def process_actions(self, action_dict, **kwargs):
+        """
+        Process the attacks of all the agents at once.
+
+        The attacks are resolved simultaneously: every attacking agent chooses
+        from the agents that are attackable at the start of the step, so an agent
+        that dies in this step can still attack and be attacked by others in this
+        step. Inactive agents do not attack. The candidates are checked the same
+        way as in process_action, and the accuracy rolls for all the candidates
+        are drawn together. Each attacking agent attacks one of its successfully
+        rolled candidates at random. Finally, the health of each attacked agent
+        is depleted by the total strength of its attackers, and the agents that
+        die are removed from the grid.
+
+        Args:
+            action_dict: Dictionary that maps agent ids to their action dictionaries
+                in this step, like the one given to the simulation's step.
+
+        Returns:
+            Dictionary that maps each agent id in the action dictionary to the agent
+            it attacked, or None if it did not attack an agent.
+        """
+        attacked_agents = {agent_id: None for agent_id in action_dict}
+        attacking_agents = []
+        for agent_id, action in action_dict.items():
+            agent = self.agents[agent_id]
+            if isinstance(agent, self.supported_agent_type) and agent.active and action[self.key]:
+                attacking_agents.append(agent)
+        if not attacking_agents:
+            return attacked_agents
+
+        # Gather the candidates for all the attacking agents.
+        attacker_ndx, candidates = self._gather_candidates(attacking_agents)
+        if not candidates:
+            return attacked_agents
+
+        # Roll the accuracy for every candidate at once.
+        accuracy = np.array([agent.attack_accuracy for agent in attacking_agents])
+        hits = np.random.uniform(size=len(candidates)) <= accuracy[attacker_ndx]
+
+        # Each attacking agent chooses one of its hits at random. The candidates
+        # are grouped by attacking agent, so the hits are too.
+        hit_ndx = np.flatnonzero(hits)
+        hit_counts = np.bincount(attacker_ndx[hit_ndx], minlength=len(attacking_agents))
+        hit_offsets = np.cumsum(hit_counts) - hit_counts
+        choices = (np.random.uniform(size=len(attacking_agents)) * hit_counts).astype(int)
+        successful = np.flatnonzero(hit_counts)
+        chosen = hit_ndx[hit_offsets[successful] + choices[successful]]
+
+        # Apply the damage to each attacked agent once.
+        damage = {}
+        for i, candidate_ndx in zip(successful, chosen):
+            attacked_agent = candidates[candidate_ndx]
+            attacked_agents[attacking_agents[i].id] = attacked_agent
+            damage[attacked_agent.id] = \
+                damage.get(attacked_agent.id, 0) + attacking_agents[i].attack_strength
+        for agent_id, strength in damage.items():
+            attacked_agent = self.agents[agent_id]
+            attacked_agent.health = attacked_agent.health - strength
+            if not attacked_agent.active:
+                self.grid.remove(attacked_agent, attacked_agent.position)
+        return attacked_agents
+
+    def _gather_candidates(self, attacking_agents):
+        """
+        Gather the agents that each attacking agent can attack.
+
+        The cells with attackable encodings are found from the grid's encoding
+        counts and the attack matrix, with the attacking agents grouped by attack
+        range so that their windows are gathered together. Only those cells are
+        searched for candidates.
+
+        Args:
+            attacking_agents: List of the attacking agents.
+
+        Returns:
+            Tuple of an array with the index of the attacking agent for each candidate
+            and the list of candidates, grouped by attacking agent.
+        """
+        self._compile_attack_matrix(self.grid.encoding_counts.shape[-1])
+        # Agents whose encoding is not in the attack mapping cannot attack anything.
+        candidate_cells = [()] * len(attacking_agents)
+        can_attack = np.array(
+            [agent.encoding in self.attack_mapping for agent in attacking_agents], dtype=bool
+        )
+        attack_ranges = np.array([agent.attack_range for agent in attacking_agents])
+        for attack_range in np.unique(attack_ranges[can_attack]):
+            group = np.flatnonzero(can_attack & (attack_ranges == attack_range))
+            positions = np.array([attacking_agents[i].position for i in group])
+            counts = self.grid.encoding_counts_windows(positions, attack_range)
+            attackable = self._attack_matrix[
+                [attacking_agents[i].encoding for i in group], 1:counts.shape[-1] + 1
+            ]
+            cells = np.einsum('nrce,ne->nrc', counts, attackable) > 0
+            cells &= np.stack([
+                self.grid.visibility.get_mask(attacking_agents[i], attack_range) for i in group
+            ]).astype(bool)
+            for n, i in enumerate(group):
+                candidate_cells[i] = np.argwhere(cells[n]) + positions[n] - attack_range
+
+        attacker_ndx, candidates = [], []
+        for i, agent in enumerate(attacking_agents):
+            for r, c in candidate_cells[i]:
+                for other in self.grid[r, c].values():
+                    if other.id != agent.id and other.active and \
+                            self._attack_matrix[agent.encoding, other.encoding]:
+                        attacker_ndx.append(i)
+                        candidates.append(other)
+        return np.array(attacker_ndx, dtype=int), candidates
+
+    def _compile_attack_matrix(self, number_of_encodings):
+        """
+        Compile the attack matrix to support encodings up to number_of_encodings.
+        """
+        size = max([
+            number_of_encodings,
+            *self.attack_mapping.keys(),
+            *[i for v in self.attack_mapping.values() for i in v]
+        ], default=0) + 1
+        if self._attack_matrix is not None and self._attack_matrix.shape[0] >= size:
+            return
+        self._attack_matrix = np.zeros((size, size), dtype=bool)
+        for encoding, others in self.attack_mapping.items():
+            for other in others:
+                self._attack_matrix[encoding, other] = True
@@ -1,19 +1,309 @@
+from contextlib import contextmanager
+import warnings
 
 import numpy as np
 
 from abmarl.sim import PrincipleAgent, ActingAgent, ObservingAgent
 
 
+class AgentStore:
+    """
+    Stores the state of GridWorldAgents in contiguous arrays.
+
+    Each agent gets a dense index into the arrays, and the agent is bound to the
+    store so that writing its position, encoding, blocking, and health also writes
+    its row in the arrays. The agents keep their own values too, so reading the
+    properties costs the same as for unbound agents. Components can then work on
+    whole columns at once, such as the health of every agent.
+
+    Agents that were bound to a different store are moved to this one with their
+    current state.
+
+    The store also keeps live counts of the active agents overall and per encoding.
+    The counts are updated whenever an agent's activity or encoding changes, so
+    components can ask how many agents are active without looping over them.
+
+    The validation level controls how the agents' property setters check their
+    values while the simulation steps; see ``validation``.
+
+    Args:
+        agents: Dictionary of the GridWorldAgents to store.
+        grid: Optional Grid that owns the store. The Grid recounts a placed agent
+            when its encoding or blocking changes.
+    """
+    def __init__(self, agents, grid=None):
+        self._ids = list(agents)
+        self._index = {agent_id: i for i, agent_id in enumerate(self._ids)}
+        number_of_agents = len(self._ids)
+        self._positions = np.zeros((number_of_agents, 2), dtype=int)
+        self._positioned = np.zeros(number_of_agents, dtype=bool)
+        self._encodings = np.zeros(number_of_agents, dtype=int)
+        self._blocking = np.zeros(number_of_agents, dtype=bool)
+        self._health = np.full(number_of_agents, np.nan)
+        self._has_health = np.zeros(number_of_agents, dtype=bool)
+        self._active_flags = np.ones(number_of_agents, dtype=bool)
+        self._complete = True
+        self._grid = grid
+        self._validation = 'full'
+        self._trusted = False
+        self._stepping = False
+        self._stepped = False
+        self._resets = 0
+        for i, agent in enumerate(agents.values()):
+            agent._bind(self, i)
+        self._recount()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def ids(self):
+        """
+        The ids of the stored agents, ordered by their index.
+        """
+        return list(self._ids)
+
+    def index(self, agent_id):
+        """
+        The index of an agent in the arrays.
+        """
+        return self._index[agent_id]
+
+    @property
+    def positions(self):
+        """
+        Read-only N x 2 array of the agents' positions.
+
+        Rows of agents without a position are meaningless; see ``positioned``.
+        """
+        return self._read_only(self._positions)
+
+    @property
+    def positioned(self):
+        """
+        Read-only boolean array that is True where the agent has a position.
+        """
+        return self._read_only(self._positioned)
+
+    @property
+    def encodings(self):
+        """
+        Read-only array of the agents' encodings.
+        """
+        return self._read_only(self._encodings)
+
+    @property
+    def blocking(self):
+        """
+        Read-only boolean array of the agents' blocking.
+        """
+        return self._read_only(self._blocking)
+
+    @property
+    def health(self):
+        """
+        Read-only array of the agents' healths.
+
+        Agents that are not HealthAgents or whose health has not been set have nan.
+        """
+        return self._read_only(self._health)
+
+    @property
+    def active(self):
+        """
+        Boolean array of the agents' activity.
+
+        HealthAgents are active if their health is greater than 0.
+        """
+        return np.where(self._has_health, self._health > 0, self._active_flags)
+
+    @property
+    def active_count(self):
+        """
+        The number of active agents.
+        """
+        return self._active_count
+
+    @property
+    def active_counts(self):
+        """
+        Read-only array of the number of active agents, indexed by encoding.
+        """
+        return self._read_only(self._active_counts)
+
+    @property
+    def active_encoding_count(self):
+        """
+        The number of encodings that have at least one active agent.
+        """
+        return self._active_encoding_count
+
+    @property
+    def complete(self):
+        """
+        True if every stored agent is still bound to this store.
+
+        If an agent is moved to another store, its row here is deactivated and
+        this store no longer counts all of its agents.
+        """
+        return self._complete
+
+    @property
+    def validation(self):
+        """
+        How the agents' property setters validate their values.
+
+        'full': Every write is validated. This is the default.
+        'trusted': Writes are validated during construction and reset, but writes
+            made while the simulation steps are trusted. They are not validated,
+            and the active counts are rebuilt once at the end of the step instead
+            of on every write.
+        'debug': Every write is validated, and the store checks that its arrays
+            and active counts are consistent after every step.
+        """
+        return self._validation
+
+    @validation.setter
+    def validation(self, value):
+        assert value in ['full', 'trusted', 'debug'], \
+            "Validation must be 'full', 'trusted', or 'debug'."
+        self._validation = value
+
+    @property
+    def validating(self):
+        """
+        True if the agents' property setters currently validate their values.
+        """
+        return not self._trusted
+
+    @contextmanager
+    def stepping(self):
+        """
+        Context in which the simulation steps.
+
+        With 'trusted' validation, the setters skip their checks and the active
+        counts are rebuilt when the context exits. With 'debug' validation, the
+        store is checked when the context exits. Nested contexts have no additional
+        effect.
+        """
+        if self._stepping:
+            yield
+            return
+        self._stepping = True
+        self._stepped = True
+        self._trusted = self._validation == 'trusted'
+        try:
+            yield
+        finally:
+            self._stepping = False
+            if self._trusted:
+                self._trusted = False
+                self._recount()
+        if self._validation == 'debug':
+            self.check()
+
+    def check(self):
+        """
+        Assert that the arrays and the active counts are consistent.
+        """
+        health = self._health[self._has_health]
+        assert np.all(np.isnan(health) | ((0 <= health) & (health <= 1))), \
+            "Health must be between 0 and 1."
+        assert not np.isin(self._encodings, [-2, -1, 0]).any(), \
+            "Encodings -2, -1, and 0 are reserved."
+        active = self.active
+        counts = np.bincount(self._encodings[active], minlength=len(self._active_counts))
+        assert np.array_equal(counts, self._active_counts), \
+            "Active counts do not match the agents' activity."
+        assert self._active_count == active.sum(), \
+            "Active count does not match the agents' activity."
+        assert self._active_encoding_count == np.count_nonzero(counts), \
+            "Active encoding count does not match the agents' activity."
+
+    def _reset(self):
+        """
+        Called when the grid resets.
+
+        Warn if the validation level had no effect in the previous episode because
+        the simulation never stepped inside the stepping context.
+        """
+        if self._resets and not self._stepped and self._validation != 'full':
+            warnings.warn(
+                f"The '{self._validation}' validation level has no effect because the "
+                "simulation does not process its step inside self.stepping()."
+            )
+        self._resets += 1
+
+    def _recount(self):
+        """
+        Rebuild the active counts from the arrays.
+        """
+        active = self.active
+        minlength = self._encodings.max() + 1 if len(self._ids) else 1
+        self._active_counts = np.bincount(self._encodings[active], minlength=minlength)
+        self._active_count = int(active.sum())
+        self._active_encoding_count = int(np.count_nonzero(self._active_counts))
+
+    def _count_active(self, index, change):
+        """
+        Add change (+1 or -1) to the active counts for the agent at this index.
+        """
+        encoding = self._encodings.item(index)
+        if encoding >= len(self._active_counts):
+            self._active_counts = np.pad(
+                self._active_counts, (0, encoding + 1 - len(self._active_counts))
+            )
+        previous = self._active_counts.item(encoding)
+        self._active_counts[encoding] = previous + change
+        self._active_count += change
+        if previous == 0:
+            self._active_encoding_count += 1
+        elif previous + change == 0:
+            self._active_encoding_count -= 1
+
+    def _set_encoding(self, index, value, active):
+        """
+        Change the encoding at this index, moving the agent's count if it is active.
+        """
+        if active:
+            self._count_active(index, -1)
+        self._encodings[index] = value
+        if active:
+            self._count_active(index, 1)
+
+    def _release(self, index):
+        """
+        Deactivate the row of an agent that was moved to another store.
+        """
+        if self.active[index]:
+            self._count_active(index, -1)
+        self._has_health[index] = False
+        self._active_flags[index] = False
+        self._complete = False
+
+    def _read_only(self, array):
+        view = array.view()
+        view.flags.writeable = False
+        return view
+
+
 class GridWorldAgent(PrincipleAgent):
     """
     The base agent in the GridWorld.
+
+    The agent's position, encoding, blocking, and activity are stored as attributes.
+    If the agent is bound to an AgentStore, then the setters also write them to
+    the agent's row in the store's arrays.
     """
-    def __init__(self, initial_position=None, blocking=False, encoding=None, render_shape='o',
-                 render_color='gray', **kwargs):
+    _store = None
+
+    def __init__(self, initial_position=None, blocking=False, static=False, encoding=None,
+                 render_shape='o', render_color='gray', **kwargs):
         super().__init__(**kwargs)
         self.encoding = encoding
         self.initial_position = initial_position
         self.blocking = blocking
+        self.static = static
         self.render_shape = render_shape
         self.render_color = render_color
 
@@ -29,11 +319,20 @@ class GridWorldAgent(PrincipleAgent):
 
     @encoding.setter
     def encoding(self, value):
-        assert type(value) is int, f"{self.id}'s encoding must be an integer."
-        assert value != -2, "-2 encoding reserved for masked observation."
-        assert value != -1, "-1 encoding reserved for out of bounds."
-        assert value != 0, "0 encoding reserved for empty cell."
+        store = self._store
+        if store is None or not store._trusted:
+            assert type(value) is int, f"{self.id}'s encoding must be an integer."
+            assert value != -2, "-2 encoding reserved for masked observation."
+            assert value != -1, "-1 encoding reserved for out of bounds."
+            assert value != 0, "0 encoding reserved for empty cell."
         self._encoding = value
+        if store is not None:
+            if store._trusted:
+                store._encodings[self._store_index] = value
+            else:
+                store._set_encoding(self._store_index, value, self.active)
+            if store._grid is not None:
+                store._grid._reindex(self)
 
     @property
     def initial_position(self):
@@ -54,12 +353,22 @@ class GridWorldAgent(PrincipleAgent):
     def position(self):
         """
         The agent's position in the grid.
+
+        Set the position instead of modifying it in place, so that the grid and
+        the AgentStore see the change.
         """
         return self._position
 
     @position.setter
     def position(self, value):
         self._position = value
+        store = self._store
+        if store is not None:
+            if value is None:
+                store._positioned[self._store_index] = False
+            else:
+                store._positions[self._store_index] = value
+                store._positioned[self._store_index] = True
 
     @property
     def blocking(self):
@@ -70,8 +379,29 @@ class GridWorldAgent(PrincipleAgent):
 
     @blocking.setter
     def blocking(self, value):
-        assert type(value) is bool, "Blocking must be either True or False."
+        store = self._store
+        if store is None or not store._trusted:
+            assert type(value) is bool, "Blocking must be either True or False."
         self._blocking = value
+        if store is not None:
+            store._blocking[self._store_index] = value
+            if store._grid is not None:
+                store._grid._reindex(self)
+
+    @property
+    def static(self):
+        """
+        Specify if this agent never moves from its initial position.
+
+        The shadows of static blocking agents are precomputed by the grid instead
+        of being recalculated every time a mask is generated.
+        """
+        return self._static
+
+    @static.setter
+    def static(self, value):
+        assert type(value) is bool, "Static must be either True or False."
+        self._static = value
 
     @property
     def render_shape(self):
@@ -105,6 +435,23 @@ class GridWorldAgent(PrincipleAgent):
             self.blocking is not None and self.render_shape is not None and \
             self.render_color is not None
 
+    def _bind(self, store, index):
+        """
+        Copy the agent's state into its row in the store.
+        """
+        store._encodings[index] = self.encoding
+        store._blocking[index] = self.blocking
+        store._active_flags[index] = self._active
+        position = getattr(self, '_position', None)
+        self._position = position
+        store._positioned[index] = position is not None
+        if position is not None:
+            store._positions[index] = position
+        if self._store is not None and self._store is not store:
+            self._store._release(self._store_index)
+        self._store = store
+        self._store_index = index
+
 
 class GridObservingAgent(ObservingAgent, GridWorldAgent):
     """
@@ -165,6 +512,7 @@ class HealthAgent(GridWorldAgent):
     def __init__(self, initial_health=None, **kwargs):
         super().__init__(**kwargs)
         self.initial_health = initial_health
+        self._health = None
 
     @property
     def health(self):
@@ -177,8 +525,28 @@ class HealthAgent(GridWorldAgent):
 
     @health.setter
     def health(self, value):
+        store = self._store
+        if store is None:
+            assert type(value) in [int, float], "Health must be a numeric value."
+            self._health = min(max(value, 0), 1)
+            return
+        if store._trusted:
+            value = min(max(value, 0), 1)
+            was_active = self._health is not None and self._health > 0
+            store._health[self._store_index] = value
+            self._health = value
+            if was_active != (value > 0) and store._grid is not None:
+                store._grid._update_activity(self)
+            return
         assert type(value) in [int, float], "Health must be a numeric value."
-        self._health = min(max(value, 0), 1)
+        value = min(max(value, 0), 1)
+        was_active = self._health is not None and self._health > 0
+        store._health[self._store_index] = value
+        self._health = value
+        if was_active != (value > 0):
+            store._count_active(self._store_index, 1 if value > 0 else -1)
+            if store._grid is not None:
+                store._grid._update_activity(self)
 
     @property
     def initial_health(self):
@@ -199,7 +567,12 @@ class HealthAgent(GridWorldAgent):
         """
         The agent is active if its health is greater than 0.
         """
-        return self.health > 0
+        return self._health is not None and self._health > 0
+
+    def _bind(self, store, index):
+        super()._bind(store, index)
+        store._has_health[index] = True
+        store._health[index] = np.nan if self._health is None else self._health
 
 
 class AttackingAgent(ActingAgent, GridWorldAgent):
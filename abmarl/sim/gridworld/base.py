@@ -1,12 +1,14 @@
 
 from abc import ABC
+import contextlib
 
 from matplotlib import pyplot as plt
 import numpy as np
 
 from abmarl.sim import AgentBasedSimulation
 from abmarl.sim.gridworld.agent import GridWorldAgent
-from abmarl.sim.gridworld.grid import Grid
+from abmarl.sim.gridworld.grid import Grid, SparseGrid
+import abmarl.sim.gridworld.utils as gu
 from abmarl.tools.matplotlib_utils import mscatter
 
 
@@ -16,7 +18,42 @@ class GridWorldSimulation(AgentBasedSimulation, ABC):
 
     Extends the AgentBasedSimulation interface for the GridWorld. We provide builders
     for streamlining the building process.
+
+    Simulations apply the validation level given to the builders by processing
+    their steps inside the ``stepping`` context.
     """
+    _agent_store = None
+
+    @property
+    def validation(self):
+        """
+        The validation level of the agents' property setters.
+
+        See AgentStore.validation for the levels.
+        """
+        return 'full' if self._agent_store is None else self._agent_store.validation
+
+    def stepping(self):
+        """
+        Context in which the simulation processes its step.
+
+        Simulations wrap the body of their step function in this context to apply
+        the validation level. With "trusted" validation, the agents' property
+        setters skip their checks inside the context. With "debug" validation, the
+        agents' state is checked when the context exits. Simulations that were
+        not built with the builders have no validation level, and the context does
+        nothing.
+
+        .. code-block:: python
+
+           def step(self, action_dict, **kwargs):
+               with self.stepping():
+                   ...
+        """
+        if self._agent_store is None:
+            return contextlib.nullcontext()
+        return self._agent_store.stepping()
+
     @classmethod
     def build_sim(cls, rows, cols, **kwargs):
         """
@@ -29,6 +66,19 @@ class GridWorldSimulation(AgentBasedSimulation, ABC):
             rows: The number of rows in the grid. Must be a positive integer.
             cols: The number of cols in the grid. Must be a positive integer.
             agents: The dictionary of agents in the grid.
+            sparse_grid: If True, the simulation uses a SparseGrid, which only
+                stores occupied cells. Use this for very large, mostly empty grids.
+                Default False.
+            visibility_algorithm: The algorithm used to mask cells behind blocking
+                agents, either "rays" or "shadowcast". Default "rays".
+            terrain: Optional rows x cols integer array of static terrain encodings.
+                0 means the cell has no terrain.
+            terrain_blocking: List of the terrain encodings that block visibility.
+            validation: How the agents' property setters validate their values.
+                "full" validates every write, "trusted" skips validation inside
+                the simulation's stepping context, and "debug" validates every
+                write and checks the agents' state when the stepping context
+                exits. Default "full".
 
         Returns:
             A GridSimulation configured as specified.
@@ -41,7 +91,8 @@ class GridWorldSimulation(AgentBasedSimulation, ABC):
         return cls._build_sim(rows, cols, **kwargs)
 
     @classmethod
-    def build_sim_from_file(cls, file_name, object_registry, **kwargs):
+    def build_sim_from_file(cls, file_name, object_registry, cache_static_visibility=False,
+                            terrain_registry=None, **kwargs):
         """
         Build a GridSimulation from a text file.
 
@@ -54,6 +105,15 @@ class GridWorldSimulation(AgentBasedSimulation, ABC):
             object_registry: A dictionary that maps characters from the file to a
                 function that generates the agent. This must be a function because
                 each agent must have unique id, which is generated here.
+            cache_static_visibility: If True, the visibility through static blocking
+                agents and terrain is saved to numpy files next to the map file and memory-mapped
+                when the simulation is built from the same map again. The SparseGrid
+                does not precompute the static visibility, so this cannot be used
+                with sparse_grid. Default False.
+            terrain_registry: A dictionary that maps characters from the file to
+                terrain encodings. These characters become the grid's static terrain
+                instead of agents. Use the terrain_blocking parameter to specify
+                which terrain blocks visibility.
 
         Returns:
             A GridSimulation built from the file.
@@ -61,35 +121,73 @@ class GridWorldSimulation(AgentBasedSimulation, ABC):
         assert type(file_name) is str, "The file_name must be the name of the file."
         assert type(object_registry) is dict, "The object_registry must be a dictionary."
         assert 0 not in object_registry, "0 is reserved for empty space."
+        if terrain_registry is None:
+            terrain_registry = {}
+        assert type(terrain_registry) is dict, "The terrain_registry must be a dictionary."
+        for char, encoding in terrain_registry.items():
+            assert char not in object_registry, \
+                f"{char} cannot be in both the object and terrain registries."
+            assert type(encoding) is int and encoding > 0, \
+                "Terrain encodings must be positive integers."
+        assert type(cache_static_visibility) is bool, "Cache static visibility must be a boolean."
+        if cache_static_visibility:
+            kwargs['static_visibility_cache'] = file_name
         agents = {}
         n = 0
         with open(file_name, 'r') as fp:
             lines = fp.read().splitlines()
             cols = len(lines[0].split(' '))
             rows = len(lines)
+            terrain = np.zeros((rows, cols), dtype=int)
             for row, line in enumerate(lines):
                 chars = line.split(' ')
                 assert len(chars) == cols, f"Mismatched number of columns per row in {file_name}"
                 for col, char in enumerate(chars):
-                    if char in object_registry:
+                    if char in terrain_registry:
+                        terrain[row, col] = terrain_registry[char]
+                    elif char in object_registry:
                         agent = object_registry[char](n)
                         agent.initial_position = np.array([row, col])
                         agents[agent.id] = agent
                         n += 1
+        if terrain_registry:
+            kwargs['terrain'] = terrain
 
         return cls._build_sim(rows, cols, agents=agents, **kwargs)
 
     @classmethod
-    def _build_sim(cls, rows, cols, **kwargs):
-        grid = Grid(rows, cols, **kwargs)
+    def _build_sim(cls, rows, cols, sparse_grid=False, validation='full', **kwargs):
+        assert type(sparse_grid) is bool, "Sparse grid must be a boolean."
+        grid = SparseGrid(rows, cols, **kwargs) if sparse_grid else Grid(rows, cols, **kwargs)
+        if grid.agent_store is not None:
+            grid.agent_store.validation = validation
         kwargs['grid'] = grid
-        return cls(**kwargs)
+        sim = cls(**kwargs)
+        sim._agent_store = grid.agent_store
+        return sim
+
+    def get_obs_batch(self, agent_ids, **kwargs):
+        """
+        Return the stacked observations of multiple agents.
+
+        By default, the observations are generated with get_obs one agent at a
+        time and stacked. Simulations can override this to pass the agents to
+        their Observers' get_obs_batch.
+
+        Args:
+            agent_ids: List of the ids of agents with the same observation space.
+
+        Returns:
+            The agents' observations stacked along a new leading axis.
+        """
+        return gu.stack_observations([self.get_obs(agent_id, **kwargs) for agent_id in agent_ids])
 
     def render(self, fig=None, **kwargs):
         """
-        Draw the grid and all active agents in the grid.
+        Draw the grid, its terrain, and all active agents in the grid.
 
         Agents are drawn at their positions using their respective shape and color.
+        Terrain is drawn as gray squares.
 
         Args:
             fig: The figure on which to draw the grid. It's important
@@ -106,6 +204,15 @@ class GridWorldSimulation(AgentBasedSimulation, ABC):
         ax.set_yticks(np.arange(0, self.position_state.rows, 1))
         ax.grid()
 
+        # Draw the terrain
+        terrain = self.position_state.grid.terrain
+        if terrain is not None:
+            terrain_rows, terrain_cols = np.nonzero(terrain)
+            ax.scatter(
+                terrain_cols + 0.5, self.position_state.rows - 0.5 - terrain_rows,
+                marker='s', s=200, c='gray'
+            )
+
         # Draw the agents
         agents_x = [
             agent.position[1] + 0.5 for agent in self.agents.values() if agent.active
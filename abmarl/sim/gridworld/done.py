@@ -8,6 +8,26 @@ class DoneBaseComponent(GridWorldBaseComponent, ABC):
     """
     Abstract Done Component class from which all Done Components will inherit.
     """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._counted_by = None
+
+    def _counting_store(self):
+        """
+        The grid's AgentStore if it keeps counts for exactly these agents.
+
+        Returns:
+            The AgentStore, or None if the done condition must loop over the agents.
+        """
+        store = self.grid.agent_store
+        if store is None or not store.complete or len(store) != len(self.agents):
+            return None
+        if self._counted_by is not store:
+            if set(store.ids) != set(self.agents):
+                return None
+            self._counted_by = store
+        return store
+
     @abstractmethod
     def get_done(self, agent, **kwargs):
         """
@@ -47,6 +67,9 @@ class ActiveDone(DoneBaseComponent):
         """
         Return True if all agents are inactive. Otherwise, return False.
         """
+        store = self._counting_store()
+        if store is not None:
+            return store.active_count == 0
         for agent in self.agents.values():
             if agent.active:
                 return False
@@ -65,5 +88,8 @@ class OneTeamRemainingDone(ActiveDone):
         Return true if all active agents have the same encoding. Otherwise,
         return false.
         """
+        store = self._counting_store()
+        if store is not None:
+            return store.active_encoding_count <= 1
         encodings = set(agent.encoding for agent in self.agents.values() if agent.active)
         return len(encodings) <= 1
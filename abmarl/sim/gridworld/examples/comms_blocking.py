@@ -10,7 +10,6 @@ from abmarl.sim.gridworld.state import PositionState, StateBaseComponent
 from abmarl.sim.gridworld.actor import MoveActor, ActorBaseComponent
 from abmarl.sim.gridworld.observer import SingleGridObserver, ObserverBaseComponent
 from abmarl.sim.gridworld.done import DoneBaseComponent
-import abmarl.sim.gridworld.utils as gu
 
 
 class BroadcastingAgent(Agent, GridWorldAgent):
@@ -115,27 +114,13 @@ class BroadcastingActor(ActorBaseComponent):
         in its observation.
         """
         def determine_broadcast(agent):
-            # Generate local grid and a broadcast mask.
-            local_grid, mask = gu.create_grid_and_mask(
-                agent, self.grid, agent.broadcast_range, self.agents
-            )
-
-            # Randomly scan the local grid for receiving agents.
-            receiving_agents = []
-            for r in range(2 * agent.broadcast_range + 1):
-                for c in range(2 * agent.broadcast_range + 1):
-                    if mask[r, c]: # We can see this cell
-                        candidate_agents = local_grid[r, c]
-                        if candidate_agents is not None:
-                            for other in candidate_agents.values():
-                                if other.id == agent.id: # Cannot broadcast to yourself
-                                    continue
-                                elif other.encoding not in self.broadcast_mapping[agent.encoding]:
-                                    # Cannot broadcast to this type of agent
-                                    continue
-                                else:
-                                    receiving_agents.append(other)
-            return receiving_agents
+            # Broadcast to the visible neighbors according to the broadcast mapping.
+            return [
+                self.agents[other_id] for other_id in self.grid.neighbors(
+                    agent, agent.broadcast_range,
+                    encodings=self.broadcast_mapping[agent.encoding]
+                )
+            ]
 
         if isinstance(broadcasting_agent, self.supported_agent_type):
             action = action_dict[self.key]
@@ -272,23 +257,24 @@ class BroadcastSim(GridWorldSimulation):
         self.rewards = {agent.id: 0 for agent in self.agents.values()}
 
     def step(self, action_dict, **kwargs):
-        # process broadcasts
-        for agent_id, action in action_dict.items():
-            agent = self.agents[agent_id]
-            receiving_agents = self.broadcast_actor.process_action(agent, action, **kwargs)
-            if receiving_agents is not None:
-                self.broadcasting_state.update_receipients(agent, receiving_agents)
-
-        # process moves
-        for agent_id, action in action_dict.items():
-            agent = self.agents[agent_id]
-            move_result = self.move_actor.process_action(agent, action, **kwargs)
-            if not move_result:
-                self.rewards[agent.id] -= 0.1
-
-        # Entropy penalty
-        for agent_id in action_dict:
-            self.rewards[agent_id] -= 0.01
+        with self.stepping():
+            # process broadcasts
+            for agent_id, action in action_dict.items():
+                agent = self.agents[agent_id]
+                receiving_agents = self.broadcast_actor.process_action(agent, action, **kwargs)
+                if receiving_agents is not None:
+                    self.broadcasting_state.update_receipients(agent, receiving_agents)
+
+            # process moves
+            for agent_id, action in action_dict.items():
+                agent = self.agents[agent_id]
+                move_result = self.move_actor.process_action(agent, action, **kwargs)
+                if not move_result:
+                    self.rewards[agent.id] -= 0.1
+
+            # Entropy penalty
+            for agent_id in action_dict:
+                self.rewards[agent_id] -= 0.01
 
     def render(self, **kwargs):
         super().render(**kwargs)
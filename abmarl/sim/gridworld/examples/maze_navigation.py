@@ -38,14 +38,15 @@ class MazeNaviationSim(GridWorldSimulation):
         self.reward = 0
 
     def step(self, action_dict, **kwargs):
-        # Process moves
-        action = action_dict['navigator']
-        move_result = self.move_actor.process_action(self.navigator, action, **kwargs)
-        if not move_result:
-            self.reward -= 0.1
+        with self.stepping():
+            # Process moves
+            action = action_dict['navigator']
+            move_result = self.move_actor.process_action(self.navigator, action, **kwargs)
+            if not move_result:
+                self.reward -= 0.1
 
-        # Entropy penalty
-        self.reward -= 0.01
+            # Entropy penalty
+            self.reward -= 0.01
 
     def get_obs(self, agent_id, **kwargs):
         return {
@@ -81,19 +82,16 @@ if __name__ == "__main__":
             id='target',
             encoding=3,
             render_color='green'
-        ),
-        'W': lambda n: GridWorldAgent(
-            id=f'wall{n}',
-            encoding=2,
-            blocking=True,
-            render_shape='s'
         )
     }
+    terrain_registry = {'W': 2}
 
     file_name = 'maze.txt'
     sim = MazeNaviationSim.build_sim_from_file(
         file_name,
         object_registry,
+        terrain_registry=terrain_registry,
+        terrain_blocking=[2],
         overlapping={1: [3], 3: [1]}
     )
     sim.reset()
@@ -50,27 +50,28 @@ class TeamBattleSim(GridWorldSimulation):
         self.rewards = {agent.id: 0 for agent in self.agents.values()}
 
     def step(self, action_dict, **kwargs):
-        # Process attacks:
-        for agent_id, action in action_dict.items():
-            agent = self.agents[agent_id]
-            attacked_agent = self.attack_actor.process_action(agent, action, **kwargs)
-            if attacked_agent is not None:
-                self.rewards[attacked_agent.id] -= 1
-                self.rewards[agent.id] += 1
-            else:
-                self.rewards[agent.id] -= 0.1
-
-        # Process moves
-        for agent_id, action in action_dict.items():
-            agent = self.agents[agent_id]
-            if agent.active:
-                move_result = self.move_actor.process_action(agent, action, **kwargs)
-                if not move_result:
+        with self.stepping():
+            # Process attacks:
+            for agent_id, action in action_dict.items():
+                agent = self.agents[agent_id]
+                attacked_agent = self.attack_actor.process_action(agent, action, **kwargs)
+                if attacked_agent is not None:
+                    self.rewards[attacked_agent.id] -= 1
+                    self.rewards[agent.id] += 1
+                else:
                     self.rewards[agent.id] -= 0.1
 
-        # Entropy penalty
-        for agent_id in action_dict:
-            self.rewards[agent_id] -= 0.01
+            # Process moves
+            for agent_id, action in action_dict.items():
+                agent = self.agents[agent_id]
+                if agent.active:
+                    move_result = self.move_actor.process_action(agent, action, **kwargs)
+                    if not move_result:
+                        self.rewards[agent.id] -= 0.1
+
+            # Entropy penalty
+            for agent_id in action_dict:
+                self.rewards[agent_id] -= 0.01
 
     def get_obs(self, agent_id, **kwargs):
         agent = self.agents[agent_id]
@@ -78,6 +79,12 @@ class TeamBattleSim(GridWorldSimulation):
             **self.grid_observer.get_obs(agent, **kwargs)
         }
 
+    def get_obs_batch(self, agent_ids, **kwargs):
+        agents = [self.agents[agent_id] for agent_id in agent_ids]
+        return {
+            **self.grid_observer.get_obs_batch(agents, **kwargs)
+        }
+
     def get_reward(self, agent_id, **kwargs):
         reward = self.rewards[agent_id]
         self.rewards[agent_id] = 0
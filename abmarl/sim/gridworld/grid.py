@@ -1,6 +1,9 @@
 
 import numpy as np
 
+from abmarl.sim.gridworld.agent import AgentStore
+from abmarl.sim.gridworld.utils import StaticVisibility, VisibilityService
+
 
 class Grid:
     """
@@ -10,6 +13,41 @@ class Grid:
     grid is a dictionary that maps the agent id to the agent object itself. If agents
     can overlap, then there may be more than one agent per cell.
 
+    Alongside the dictionaries, the Grid maintains an integer count of the agents
+    of each encoding in every cell and the total number of agents in every cell.
+    These arrays are updated incrementally by ``place`` and ``remove`` and are
+    exposed as read-only views through ``encoding_counts`` and ``occupancy`` so
+    that components can work on whole regions of the grid with numpy slicing.
+    The Grid records the encoding and blocking with which it counted each placed
+    agent. If the encoding or blocking of an agent in the Grid's AgentStore changes
+    while it is placed, the agent is recounted with its new values. Other agents
+    are recounted the next time they are placed.
+
+    The overlapping dictionary is compiled into a boolean encoding-by-encoding
+    matrix, and each cell keeps a bitmask of the encodings that occupy it, so
+    that querying a cell is a single bitwise test.
+
+    The Grid also counts the blocking agents in each cell, so that masking only
+    needs to look at the blocking agents near the observing agent. Static blocking
+    agents are not counted when the Grid has precomputed their visibility.
+    Components share a VisibilityService through the Grid, which memoizes each
+    agent's mask until the agent moves or a blocking agent changes
+    position. Every cell is also stamped with the change version at which an agent
+    was last placed in or removed from it, so that components can tell whether
+    a region of the grid changed since they last looked at it.
+
+    The Grid may also have a static terrain layer, which is an integer array of
+    terrain encodings that do not need to be agents. Terrain is counted in the encoding
+    counts like an agent that never leaves its cell, so components observe it
+    the same way. The overlapping dictionary determines which agents can enter
+    terrain cells, and the blocking terrain masks cells like static blocking agents.
+
+    The agents, the encoding counts, and the blocker counts are stored with a border
+    of out-of-bounds cells, so that the window around an agent is a view into the
+    storage instead of a copy. The border grows to the largest window range that
+    has been requested. The masks are cast with rays by default, and symmetric shadowcasting
+    can be selected with ``visibility_algorithm``.
+
     Args:
         rows: The number of rows in the grid.
         cols: The number of columns in the grid.
@@ -17,11 +55,36 @@ class Grid:
             with which they can occupy the same cell. To avoid undefined behavior, the
             overlapping should be symmetric, so that if 2 can overlap with 3, then 3
             can also overlap with 2.
+        agents: Optional dictionary of agents that will be placed in the grid. If
+            given, the encoding counts are sized to the largest encoding up front.
+            Otherwise, they grow as agents with new encodings are placed. Agents
+            that are both static and blocking are used to precompute the static
+            visibility. The agents are also bound to the Grid's AgentStore, which
+            holds their state in arrays.
+        static_visibility_cache: Optional path prefix for persisting the precomputed
+            static visibility tables.
+        visibility_algorithm: The algorithm used to mask cells behind blocking
+            agents, either "rays" or "shadowcast". Static visibility is only
+            precomputed for rays. Default "rays".
+        terrain: Optional rows x cols integer array of terrain encodings. 0 means
+            the cell has no terrain.
+        terrain_blocking: List of the terrain encodings that block visibility.
     """
-    def __init__(self, rows, cols, overlapping=None, **kwargs):
+    # Whether the visibility through static blockers is precomputed for rays
+    _precomputes_static_visibility = True
+
+    # The value of each padded layer outside the grid
+    _padding_fill = {
+        'cells': None, 'encoding_counts': 0, 'blocker_counts': 0, 'in_bounds': False,
+        'change_stamps': 0
+    }
+
+    def __init__(self, rows, cols, overlapping=None, agents=None, static_visibility_cache=None,
+                 visibility_algorithm='rays', terrain=None, terrain_blocking=None, **kwargs):
         assert type(rows) is int and rows > 0, "Rows must be a positive integer."
         assert type(cols) is int and cols > 0, "Cols must be a positive integer."
-        self._internal = np.empty((rows, cols), dtype=object)
+        self._rows = rows
+        self._cols = cols
 
         # Overlapping matrix
         if overlapping is not None:
@@ -35,35 +98,293 @@ class Grid:
             self._overlapping = overlapping
         else:
             self._overlapping = {}
+        assert visibility_algorithm in ['rays', 'shadowcast'], \
+            "Visibility algorithm must be either 'rays' or 'shadowcast'."
+        self._visibility_algorithm = visibility_algorithm
+
+        # Terrain
+        if terrain is not None:
+            assert type(terrain) is np.ndarray, "Terrain must be a numpy array."
+            assert terrain.shape == (rows, cols), "Terrain must have the shape of the grid."
+            assert np.issubdtype(terrain.dtype, np.integer) and (terrain >= 0).all(), \
+                "Terrain must be nonnegative integer encodings."
+            terrain = terrain.copy()
+            terrain.flags.writeable = False
+        self._terrain = terrain
+        if terrain_blocking is None:
+            terrain_blocking = []
+        assert type(terrain_blocking) is list, "Terrain blocking must be a list."
+        for i in terrain_blocking:
+            assert type(i) is int, "All elements in terrain blocking must be integers."
+        self._terrain_blocking = terrain_blocking
+
+        # Storage for the agents and the occupancy arrays
+        self._number_of_encodings = 0
+        self._allocate()
+
+        number_of_encodings = max([
+            *self._overlapping.keys(),
+            *[i for v in self._overlapping.values() for i in v]
+        ], default=0)
+        if terrain is not None:
+            number_of_encodings = max(number_of_encodings, int(terrain.max(initial=0)))
+        if agents is not None:
+            number_of_encodings = max(
+                [number_of_encodings, *[agent.encoding for agent in agents.values()]]
+            )
+        self._grow_encodings(number_of_encodings)
+
+        # Static visibility
+        self._static_visibility = None
+        if visibility_algorithm == 'rays' and self._precomputes_static_visibility:
+            static_blockers = []
+            for agent in (agents or {}).values():
+                if agent.blocking and agent.static:
+                    assert agent.initial_position is not None, \
+                        f"Static blocking agent {agent.id} must have an initial position."
+                    static_blockers.append(agent.initial_position.astype(int))
+            blocking_terrain = terrain is not None and np.isin(terrain, terrain_blocking).any()
+            if static_blockers or blocking_terrain:
+                static_blocking = self._terrain_blocks()
+                if static_blockers:
+                    static_blocking[tuple(np.array(static_blockers).T)] = True
+                self._static_visibility = StaticVisibility(
+                    static_blocking, cache_prefix=static_visibility_cache
+                )
+
+        self._blocker_version = 0
+        self._change_version = 0
+        self._reset_count = 0
+        self._visibility = VisibilityService(self)
+        self._agent_store = AgentStore(agents, grid=self) if agents is not None else None
 
     @property
     def rows(self):
         """
         The number of rows in the grid.
         """
-        return self._internal.shape[0]
+        return self._rows
 
     @property
     def cols(self):
         """
         The number of columns in the grid.
         """
-        return self._internal.shape[1]
+        return self._cols
+
+    @property
+    def encoding_counts(self):
+        """
+        Read-only rows x cols x max_encoding array of agent counts.
+
+        ``encoding_counts[r, c, e - 1]`` is the number of agents with encoding ``e``
+        at cell ``(r, c)``. The terrain is counted like an agent that never leaves
+        its cell, so on terrain cells the counts sum to one more than the occupancy.
+        """
+        view = self._encoding_counts.view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def occupancy(self):
+        """
+        Read-only rows x cols array with the number of agents in each cell.
+
+        The terrain is not an agent, so it does not count toward the occupancy.
+        """
+        view = self._occupancy.view()
+        view.flags.writeable = False
+        return view
+
+    @property
+    def blocker_counts(self):
+        """
+        Read-only rows x cols array with the number of blocking agents in each cell.
+
+        Static blocking agents are not included if their visibility is precomputed.
+        """
+        view = self._blocker_counts.view()
+        view.flags.writeable = False
+        return view
+
+    def window(self, position, window_range):
+        """
+        Read-only view of the cells within window_range of position.
+
+        Args:
+            position: The center of the window.
+            window_range: The integer range from the center.
+
+        Returns:
+            Object array of size (2 * range + 1) x (2 * range + 1) with the dictionaries
+            of agents in each cell. Cells outside the grid are None.
+        """
+        return self._window('cells', position, window_range)
+
+    def encoding_counts_window(self, position, window_range):
+        """
+        Read-only view of the encoding counts within window_range of position.
+
+        Cells outside the grid have zero counts.
+        """
+        return self._window('encoding_counts', position, window_range)
+
+    def blocker_counts_window(self, position, window_range):
+        """
+        Read-only view of the blocker counts within window_range of position.
+
+        Cells outside the grid have zero counts.
+        """
+        return self._window('blocker_counts', position, window_range)
+
+    def in_bounds_window(self, position, window_range):
+        """
+        Read-only boolean view that is True where the window is inside the grid.
+        """
+        return self._window('in_bounds', position, window_range)
+
+    def change_stamps_window(self, position, window_range):
+        """
+        Read-only view of the change stamps within window_range of position.
+
+        Each cell holds the change version at which it last changed. Cells outside
+        the grid never change and have a stamp of zero.
+        """
+        return self._window('change_stamps', position, window_range)
+
+    def encoding_counts_windows(self, positions, window_range):
+        """
+        Gather the encoding counts within window_range of each position.
+
+        Args:
+            positions: N x 2 array of the centers of the windows.
+            window_range: The integer range from the centers.
+
+        Returns:
+            N x (2 * range + 1) x (2 * range + 1) x max_encoding array of counts.
+        """
+        return self._windows('encoding_counts', positions, window_range)
+
+    def in_bounds_windows(self, positions, window_range):
+        """
+        Gather boolean windows that are True where each window is inside the grid.
+        """
+        return self._windows('in_bounds', positions, window_range)
+
+    @property
+    def terrain(self):
+        """
+        Read-only rows x cols array of terrain encodings, or None if there is no terrain.
+        """
+        return self._terrain
+
+    @property
+    def terrain_blocking(self):
+        """
+        The terrain encodings that block visibility.
+        """
+        return self._terrain_blocking
+
+    @property
+    def agent_store(self):
+        """
+        The AgentStore that holds the state of the Grid's agents in arrays.
+
+        None if the Grid was not given the agents.
+        """
+        return self._agent_store
+
+    @property
+    def blocker_version(self):
+        """
+        Counter that changes whenever a blocking agent enters or leaves a cell.
+        """
+        return self._blocker_version
+
+    @property
+    def change_version(self):
+        """
+        Counter that increases whenever an agent is placed in or removed from a cell.
+        """
+        return self._change_version
+
+    @property
+    def reset_count(self):
+        """
+        Counter that increases whenever the grid is reset.
+        """
+        return self._reset_count
+
+    @property
+    def visibility_algorithm(self):
+        """
+        The algorithm used to mask cells behind blocking agents.
+        """
+        return self._visibility_algorithm
+
+    @property
+    def visibility(self):
+        """
+        The VisibilityService that memoizes the agents' masks.
+        """
+        return self._visibility
+
+    @property
+    def static_visibility(self):
+        """
+        The precomputed visibility through the static blocking agents.
+
+        None if there are no static blocking agents.
+        """
+        return self._static_visibility
+
+    @property
+    def overlap_matrix(self):
+        """
+        Read-only boolean matrix compiled from the overlapping dictionary.
+
+        ``overlap_matrix[i, j]`` is True if an agent with encoding ``i`` can occupy
+        the same cell as an agent with encoding ``j``. Row and column 0 are unused.
+        """
+        view = self._overlap_matrix.view()
+        view.flags.writeable = False
+        return view
 
     def reset(self, **kwargs):
         """
         Reset the grid to an empty state.
         """
+        if self._agent_store is not None:
+            self._agent_store._reset()
         for i in range(self.rows):
             for j in range(self.cols):
                 self._internal[i, j] = {}
+        self._encoding_counts.fill(0)
+        self._occupancy.fill(0)
+        self._cell_masks.fill(0)
+        self._indexed.clear()
+        self._untracked_count = 0
+        self._blocker_counts.fill(0)
+        if self._terrain is not None:
+            rs, cs = np.nonzero(self._terrain)
+            encodings = self._terrain[rs, cs]
+            self._encoding_counts[rs, cs, encodings - 1] = 1
+            self._cell_masks[rs, cs] = [1 << int(encoding) for encoding in encodings]
+            if self._static_visibility is None:
+                self._blocker_counts[self._terrain_blocks()] = 1
+        self._blocker_version += 1
+        self._change_version += 1
+        self._reset_count += 1
+        self._change_stamps.fill(self._change_version)
+        self._visibility.clear()
 
     def query(self, agent, ndx):
         """
         Query a cell in the grid to see if is available to this agent.
 
         The cell is available for the agent if it is empty or if both the occupying agent
-        and the querying agent are overlappable.
+        and the querying agent are overlappable. Inactive agents do not occupy
+        the cell. The terrain in the cell must also be overlappable with the agent.
 
         Args:
             agent: The agent for which we are checking availabilty.
@@ -73,16 +394,26 @@ class Grid:
             The availability of this cell.
         """
         ndx = tuple(ndx)
-        if self._internal[ndx]: # There are agents here
-            try:
-                return all([
-                    True if other.encoding in self._overlapping[agent.encoding] else False
-                    for other in self._internal[ndx].values() if other.active
-                ])
-            except KeyError:
-                return False
-        else:
+        cell_mask = self._cell_masks[ndx]
+        if not cell_mask: # There are no agents here
+            return True
+        if agent.encoding >= len(self._blocked_by):
+            self._grow_encodings(agent.encoding)
+        if not cell_mask & self._blocked_by[agent.encoding]:
             return True
+        if not self._untracked_count:
+            # The mask only has the terrain and the active agents, so some
+            # occupant cannot overlap with this agent.
+            return False
+        if self._terrain is not None and self._terrain[ndx] and \
+                not self._overlap_matrix[agent.encoding, self._terrain[ndx]]:
+            return False
+        # Some occupant cannot overlap with this agent. It only blocks the cell
+        # if it is still active.
+        return all([
+            self._overlap_matrix[agent.encoding, other.encoding]
+            for other in self._internal[ndx].values() if other.active
+        ])
 
     def place(self, agent, ndx):
         """
@@ -102,6 +433,8 @@ class Grid:
         """
         ndx = tuple(ndx)
         if self.query(agent, ndx):
+            if agent.id not in self._internal[ndx]:
+                self._add_to_indices(agent, ndx)
             self._internal[ndx][agent.id] = agent
             agent.position = np.array(ndx)
             return True
@@ -118,6 +451,582 @@ class Grid:
         """
         ndx = tuple(ndx)
         del self._internal[ndx][agent.id]
+        self._remove_from_indices(agent, ndx)
+
+    def neighbors(self, agent, neighbor_range, encodings=None, visible_only=True):
+        """
+        Find the agents near an agent.
+
+        The encoding counts select the cells that have agents with the requested
+        encodings, and only those cells are searched. The agent itself and inactive
+        agents are not neighbors.
+
+        Args:
+            agent: The agent whose neighbors we find.
+            neighbor_range: The integer range from the agent.
+            encodings: Iterable of the encodings that the neighbors can have.
+                Default None allows every encoding.
+            visible_only: If True, only the agents in the cells that are visible
+                to the agent are neighbors. Default True.
+
+        Returns:
+            Array of the neighbors' ids, ordered by the row and column of their cells.
+        """
+        counts = self.encoding_counts_window(agent.position, neighbor_range)
+        allowed = np.ones(counts.shape[-1] + 1, dtype=bool)
+        if encodings is not None:
+            allowed[:] = False
+            encodings = np.array(list(encodings), dtype=int)
+            allowed[encodings[(encodings > 0) & (encodings < len(allowed))]] = True
+        cells = counts[..., allowed[1:]].any(axis=-1)
+        if visible_only:
+            cells &= self.visibility.get_mask(agent, neighbor_range).astype(bool)
+
+        neighbor_ids = []
+        for r, c in np.argwhere(cells) + agent.position - neighbor_range:
+            for other in self[r, c].values():
+                if other.id != agent.id and other.active and allowed[other.encoding]:
+                    neighbor_ids.append(other.id)
+        return np.array(neighbor_ids, dtype=object)
+
+    def _add_to_indices(self, agent, ndx):
+        """
+        Update the occupancy arrays for an agent entering a cell.
+        """
+        encoding, blocker = agent.encoding, self._is_indexed_blocker(agent)
+        tracked = self._tracks_activity(agent)
+        self._indexed[agent.id, ndx] = encoding, blocker, tracked
+        if encoding > self._number_of_encodings:
+            self._grow_encodings(encoding)
+        count_ndx = ndx + (encoding - 1,)
+        self._change_version += 1
+        self._change_stamps[ndx] = self._change_version
+        self._occupancy[ndx] += 1
+        self._encoding_counts[count_ndx] += 1
+        if agent.active or not tracked:
+            self._cell_masks[ndx] |= 1 << encoding
+        if not tracked:
+            self._untracked_count += 1
+        if blocker:
+            self._blocker_counts[ndx] += 1
+            self._blocker_version += 1
+
+    def _remove_from_indices(self, agent, ndx):
+        """
+        Update the occupancy arrays for an agent leaving a cell.
+        """
+        encoding, blocker, tracked = self._indexed.pop((agent.id, ndx))
+        count_ndx = ndx + (encoding - 1,)
+        self._change_version += 1
+        self._change_stamps[ndx] = self._change_version
+        self._occupancy[ndx] -= 1
+        self._encoding_counts[count_ndx] -= 1
+        if not tracked:
+            self._untracked_count -= 1
+        if self._encoding_counts[count_ndx] == 0:
+            self._cell_masks[ndx] &= ~(1 << encoding)
+        else:
+            self._refresh_cell_mask(ndx)
+        if blocker:
+            self._blocker_counts[ndx] -= 1
+            self._blocker_version += 1
+
+    def _reindex(self, agent):
+        """
+        Recount a placed agent whose encoding or blocking changed.
+        """
+        if agent.position is None:
+            return
+        ndx = tuple(int(i) for i in agent.position)
+        if (agent.id, ndx) in self._indexed:
+            self._remove_from_indices(agent, ndx)
+            self._add_to_indices(agent, ndx)
+
+    def _update_activity(self, agent):
+        """
+        Update the cell mask of a placed agent that became active or inactive.
+        """
+        if agent.position is None:
+            return
+        ndx = tuple(int(i) for i in agent.position)
+        if (agent.id, ndx) in self._indexed:
+            self._refresh_cell_mask(ndx)
+
+    def _refresh_cell_mask(self, ndx):
+        """
+        Rebuild the mask of a cell from its terrain and its active agents.
+        """
+        cell_mask = 0
+        if self._terrain is not None and self._terrain[ndx]:
+            cell_mask = 1 << int(self._terrain[ndx])
+        for other in self[ndx].values():
+            entry = self._indexed.get((other.id, ndx))
+            if entry is not None and (other.active or not entry[2]):
+                cell_mask |= 1 << entry[0]
+        self._cell_masks[ndx] = cell_mask
+
+    def _tracks_activity(self, agent):
+        """
+        The Grid is told when an agent in its AgentStore becomes active or inactive.
+
+        Other agents always count in the cell masks, and the cells that they
+        occupy are checked agent by agent.
+        """
+        return self._agent_store is not None and agent._store is self._agent_store
+
+    def _terrain_blocks(self):
+        """
+        Boolean rows x cols array that is True where the terrain blocks visibility.
+        """
+        if self._terrain is None:
+            return np.zeros((self.rows, self.cols), dtype=bool)
+        return np.isin(self._terrain, self._terrain_blocking)
+
+    def _is_indexed_blocker(self, agent):
+        """
+        Blocking agents are indexed unless their shadows are precomputed.
+        """
+        return agent.blocking and not (agent.static and self._static_visibility is not None)
+
+    def _allocate(self):
+        """
+        Allocate the storage for the agents and the occupancy arrays.
+        """
+        self._padding = 0
+        self._padded = {
+            'cells': np.empty((self.rows, self.cols), dtype=object),
+            'encoding_counts': np.zeros((self.rows, self.cols, 0), dtype=int),
+            'blocker_counts': np.zeros((self.rows, self.cols), dtype=int),
+            'in_bounds': np.ones((self.rows, self.cols), dtype=bool),
+            'change_stamps': np.zeros((self.rows, self.cols), dtype=int),
+        }
+        self._bind_padded()
+        self._occupancy = np.zeros((self.rows, self.cols), dtype=int)
+        self._cell_masks = np.zeros((self.rows, self.cols), dtype=object)
+        self._indexed = {}
+        self._untracked_count = 0
+
+    def _bind_padded(self):
+        """
+        Point the storage attributes at the interior of the padded layers.
+        """
+        interior = (
+            slice(self._padding, self._padding + self.rows),
+            slice(self._padding, self._padding + self.cols)
+        )
+        self._internal = self._padded['cells'][interior]
+        self._encoding_counts = self._padded['encoding_counts'][interior]
+        self._blocker_counts = self._padded['blocker_counts'][interior]
+        self._change_stamps = self._padded['change_stamps'][interior]
+
+    def __getstate__(self):
+        # The interior layers are views of the padded layers, which pickling would
+        # copy, so they are rebound to the padded layers when unpickled.
+        state = self.__dict__.copy()
+        if '_padded' in state:
+            for name in ['_internal', '_encoding_counts', '_blocker_counts', '_change_stamps']:
+                state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if '_padded' in state:
+            self._bind_padded()
+
+    def _grow_padding(self, padding):
+        """
+        Widen the out-of-bounds border of the padded layers to padding cells.
+        """
+        offset = padding - self._padding
+        for name, layer in self._padded.items():
+            grown = np.full(
+                (self.rows + 2 * padding, self.cols + 2 * padding) + layer.shape[2:],
+                self._padding_fill[name],
+                dtype=layer.dtype
+            )
+            grown[offset:offset + layer.shape[0], offset:offset + layer.shape[1]] = layer
+            self._padded[name] = grown
+        self._padding = padding
+        self._bind_padded()
+
+    def _window(self, layer, position, window_range):
+        """
+        Read-only view of a padded layer within window_range of position.
+        """
+        if window_range > self._padding:
+            self._grow_padding(window_range)
+        r = position[0] + self._padding
+        c = position[1] + self._padding
+        view = self._padded[layer][
+            r - window_range:r + window_range + 1, c - window_range:c + window_range + 1
+        ]
+        view.flags.writeable = False
+        return view
+
+    def _windows(self, layer, positions, window_range):
+        """
+        Gather the windows of a padded layer around each position with one index.
+        """
+        if window_range > self._padding:
+            self._grow_padding(window_range)
+        offsets = np.arange(-window_range, window_range + 1) + self._padding
+        rows = np.asarray(positions)[:, 0, np.newaxis] + offsets
+        cols = np.asarray(positions)[:, 1, np.newaxis] + offsets
+        return self._padded[layer][rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+
+    def _resize_encoding_counts(self, number_of_encodings):
+        """
+        Extend the encoding counts to number_of_encodings channels.
+        """
+        self._padded['encoding_counts'] = np.pad(
+            self._padded['encoding_counts'],
+            ((0, 0), (0, 0), (0, number_of_encodings - self._number_of_encodings))
+        )
+        self._bind_padded()
+
+    def _grow_encodings(self, number_of_encodings):
+        """
+        Resize the encoding-dependent arrays to support encodings up to number_of_encodings.
+
+        The overlap matrix is recompiled from the overlapping dictionary, and
+        each encoding gets a bitmask of the encodings with which it cannot overlap.
+        """
+        if number_of_encodings > self._number_of_encodings:
+            self._resize_encoding_counts(number_of_encodings)
+            self._number_of_encodings = number_of_encodings
+        self._overlap_matrix = np.zeros(
+            (number_of_encodings + 1, number_of_encodings + 1), dtype=bool
+        )
+        for encoding, others in self._overlapping.items():
+            for other in others:
+                self._overlap_matrix[encoding, other] = True
+        self._blocked_by = [
+            sum(1 << other for other in range(1, number_of_encodings + 1)
+                if not self._overlap_matrix[encoding, other])
+            for encoding in range(number_of_encodings + 1)
+        ]
 
     def __getitem__(self, subscript):
         return self._internal.__getitem__(subscript)
+
+
+class SparseGrid(Grid):
+    """
+    A Grid that only stores the occupied cells.
+
+    The SparseGrid keeps the agents in a spatial hash that maps occupied cells to
+    the dictionary of agents there, so that memory and reset cost scale with the
+    number of agents instead of the area of the grid. This is useful for very
+    large, mostly empty grids.
+
+    The SparseGrid supports the same interface as the Grid. Indexing the grid,
+    ``encoding_counts``, and ``occupancy`` produces dense arrays for the indexed
+    region only, so components should index small regions, such as the window
+    around an agent. Empty cells are represented by new empty dictionaries, so
+    modifying the grid must go through ``place`` and ``remove``. The SparseGrid
+    does not support terrain. It does not precompute the static visibility either,
+    since the tables are as large as the grid, so static blocking agents are
+    counted like other blocking agents.
+    """
+    _precomputes_static_visibility = False
+
+    def __init__(self, rows, cols, terrain=None, static_visibility_cache=None, **kwargs):
+        assert terrain is None, "The SparseGrid does not support terrain."
+        assert static_visibility_cache is None, \
+            "The SparseGrid does not precompute the static visibility."
+        super().__init__(rows, cols, **kwargs)
+
+    @property
+    def encoding_counts(self):
+        """
+        Read-only rows x cols x max_encoding view of agent counts.
+
+        Indexing the view produces a dense array of the indexed region.
+        """
+        return _SparseLayer(
+            self._dense_encoding_counts, (self.rows, self.cols, self._number_of_encodings)
+        )
+
+    @property
+    def occupancy(self):
+        """
+        Read-only rows x cols view of the number of agents in each cell.
+
+        Indexing the view produces a dense array of the indexed region.
+        """
+        return _SparseLayer(self._dense_occupancy, (self.rows, self.cols))
+
+    @property
+    def blocker_counts(self):
+        """
+        Read-only rows x cols view of the number of blocking agents in each cell.
+
+        Indexing the view produces a dense array of the indexed region.
+        """
+        return _SparseLayer(self._dense_blocker_counts, (self.rows, self.cols))
+
+    def reset(self, **kwargs):
+        """
+        Reset the grid to an empty state.
+        """
+        if self._agent_store is not None:
+            self._agent_store._reset()
+        self._cells.clear()
+        self._encoding_counts.clear()
+        self._cell_masks.clear()
+        self._indexed.clear()
+        self._untracked_count = 0
+        self._blocker_counts.clear()
+        self._blocker_version += 1
+        self._change_version += 1
+        self._reset_count += 1
+        self._change_stamps.clear()
+        self._reset_stamp = self._change_version
+        self._visibility.clear()
+
+    def query(self, agent, ndx):
+        """
+        Query a cell in the grid to see if is available to this agent.
+
+        The cell is available for the agent if it is empty or if both the occupying agent
+        and the querying agent are overlappable. Inactive agents do not occupy
+        the cell.
+
+        Args:
+            agent: The agent for which we are checking availabilty.
+            ndx: The cell to query.
+
+        Returns:
+            The availability of this cell.
+        """
+        ndx = tuple(ndx)
+        cell_mask = self._cell_masks.get(ndx, 0)
+        if not cell_mask: # There are no agents here
+            return True
+        if agent.encoding >= len(self._blocked_by):
+            self._grow_encodings(agent.encoding)
+        if not cell_mask & self._blocked_by[agent.encoding]:
+            return True
+        if not self._untracked_count:
+            # The mask only has the active agents, so some occupant cannot
+            # overlap with this agent.
+            return False
+        return all([
+            self._overlap_matrix[agent.encoding, other.encoding]
+            for other in self._cells[ndx].values() if other.active
+        ])
+
+    def place(self, agent, ndx):
+        """
+        Place an agent at an index.
+
+        If the cell is available, the agent will be placed at that index
+        in the grid and the agent's position will be updated. The placement is
+        successful if the new position is unoccupied or if the agent already occupying
+        that position is overlappable AND this agent is overlappable.
+
+        Args:
+            agent: The agent to place.
+            ndx: The new index for this agent.
+
+        Returns:
+            The successfulness of the placement.
+        """
+        ndx = tuple(int(i) for i in ndx)
+        assert 0 <= ndx[0] < self.rows and 0 <= ndx[1] < self.cols, \
+            "The index must be within the grid."
+        if self.query(agent, ndx):
+            cell = self._cells.setdefault(ndx, {})
+            if agent.id not in cell:
+                self._add_to_indices(agent, ndx)
+            cell[agent.id] = agent
+            agent.position = np.array(ndx)
+            return True
+        else:
+            return False
+
+    def remove(self, agent, ndx):
+        """
+        Remove an agent from an index.
+
+        Args:
+            agent: The agent to remove
+            ndx: The old index for this agent
+        """
+        ndx = tuple(int(i) for i in ndx)
+        cell = self._cells[ndx]
+        del cell[agent.id]
+        self._remove_from_indices(agent, ndx)
+        if not cell:
+            del self._cells[ndx]
+            del self._encoding_counts[ndx]
+            del self._cell_masks[ndx]
+
+    def _add_to_indices(self, agent, ndx):
+        encoding, blocker = agent.encoding, self._is_indexed_blocker(agent)
+        tracked = self._tracks_activity(agent)
+        self._indexed[agent.id, ndx] = encoding, blocker, tracked
+        if encoding > self._number_of_encodings:
+            self._grow_encodings(encoding)
+        self._change_version += 1
+        self._change_stamps[ndx] = self._change_version
+        counts = self._encoding_counts.get(ndx)
+        if counts is None:
+            counts = np.zeros(self._number_of_encodings, dtype=int)
+            self._encoding_counts[ndx] = counts
+            self._cell_masks[ndx] = 0
+        counts[encoding - 1] += 1
+        if agent.active or not tracked:
+            self._cell_masks[ndx] |= 1 << encoding
+        if not tracked:
+            self._untracked_count += 1
+        if blocker:
+            self._blocker_counts[ndx] = self._blocker_counts.get(ndx, 0) + 1
+            self._blocker_version += 1
+
+    def _remove_from_indices(self, agent, ndx):
+        encoding, blocker, tracked = self._indexed.pop((agent.id, ndx))
+        self._change_version += 1
+        self._change_stamps[ndx] = self._change_version
+        counts = self._encoding_counts[ndx]
+        counts[encoding - 1] -= 1
+        if not tracked:
+            self._untracked_count -= 1
+        if counts[encoding - 1] == 0:
+            self._cell_masks[ndx] &= ~(1 << encoding)
+        else:
+            self._refresh_cell_mask(ndx)
+        if blocker:
+            self._blocker_counts[ndx] -= 1
+            self._blocker_version += 1
+            if not self._blocker_counts[ndx]:
+                del self._blocker_counts[ndx]
+
+    def _allocate(self):
+        self._cells = {}
+        self._encoding_counts = {}
+        self._cell_masks = {}
+        self._indexed = {}
+        self._untracked_count = 0
+        self._blocker_counts = {}
+        self._change_stamps = {}
+        self._reset_stamp = 0
+
+    def _resize_encoding_counts(self, number_of_encodings):
+        for ndx, counts in self._encoding_counts.items():
+            self._encoding_counts[ndx] = np.pad(
+                counts, (0, number_of_encodings - self._number_of_encodings)
+            )
+
+    def _window(self, layer, position, window_range):
+        """
+        Dense copy of a layer within window_range of position.
+        """
+        r, c = int(position[0]), int(position[1])
+        rows = range(r - window_range, r + window_range + 1)
+        cols = range(c - window_range, c + window_range + 1)
+        in_bounds = np.outer(
+            [0 <= i < self.rows for i in rows], [0 <= j < self.cols for j in cols]
+        )
+        if layer == 'in_bounds':
+            return in_bounds
+        window = {
+            'cells': self._dense_agents,
+            'encoding_counts': self._dense_encoding_counts,
+            'blocker_counts': self._dense_blocker_counts,
+            'change_stamps': self._dense_change_stamps,
+        }[layer](rows, cols)
+        window[~in_bounds] = self._padding_fill[layer]
+        return window
+
+    def _windows(self, layer, positions, window_range):
+        return np.stack([self._window(layer, position, window_range) for position in positions])
+
+    def _dense_agents(self, rows, cols):
+        window = np.empty((len(rows), len(cols)), dtype=object)
+        for i, r in enumerate(rows):
+            for j, c in enumerate(cols):
+                cell = self._cells.get((r, c))
+                window[i, j] = {} if cell is None else cell
+        return window
+
+    def _dense_encoding_counts(self, rows, cols):
+        window = np.zeros((len(rows), len(cols), self._number_of_encodings), dtype=int)
+        for (i, j), ndx in self._window_cells(rows, cols):
+            window[i, j] = self._encoding_counts[ndx]
+        return window
+
+    def _dense_occupancy(self, rows, cols):
+        window = np.zeros((len(rows), len(cols)), dtype=int)
+        for (i, j), ndx in self._window_cells(rows, cols):
+            window[i, j] = len(self._cells[ndx])
+        return window
+
+    def _dense_blocker_counts(self, rows, cols):
+        window = np.zeros((len(rows), len(cols)), dtype=int)
+        for (i, j), ndx in self._window_cells(rows, cols):
+            window[i, j] = self._blocker_counts.get(ndx, 0)
+        return window
+
+    def _dense_change_stamps(self, rows, cols):
+        window = np.empty((len(rows), len(cols)), dtype=int)
+        for i, r in enumerate(rows):
+            for j, c in enumerate(cols):
+                window[i, j] = self._change_stamps.get((r, c), self._reset_stamp)
+        return window
+
+    def _window_cells(self, rows, cols):
+        """
+        Generate the (window index, grid index) pairs of the occupied cells in the window.
+
+        We either scan the window or scan the occupied cells, whichever is smaller.
+        """
+        if len(rows) * len(cols) <= len(self._cells):
+            for i, r in enumerate(rows):
+                for j, c in enumerate(cols):
+                    if (r, c) in self._cells:
+                        yield (i, j), (r, c)
+        else:
+            row_lookup = {r: i for i, r in enumerate(rows)}
+            col_lookup = {c: j for j, c in enumerate(cols)}
+            for ndx in self._cells:
+                if ndx[0] in row_lookup and ndx[1] in col_lookup:
+                    yield (row_lookup[ndx[0]], col_lookup[ndx[1]]), ndx
+
+    def __getitem__(self, subscript):
+        if type(subscript) is tuple and len(subscript) == 2 and \
+                not isinstance(subscript[0], slice) and not isinstance(subscript[1], slice):
+            return self._cells.get(subscript, {})
+        return _SparseLayer(self._dense_agents, (self.rows, self.cols))[subscript]
+
+
+class _SparseLayer:
+    """
+    Read-only view of a SparseGrid layer that materializes the indexed region.
+
+    The first two indices must be integers or slices.
+
+    Args:
+        densify: Function that takes a range of rows and a range of columns and
+            produces the dense array for that region.
+        shape: The shape of the full layer.
+    """
+    def __init__(self, densify, shape):
+        self._densify = densify
+        self.shape = shape
+
+    def __getitem__(self, subscript):
+        if type(subscript) is not tuple:
+            subscript = (subscript,)
+        subscript = subscript + (slice(None),) * max(0, 2 - len(subscript))
+        rows = range(self.shape[0])[subscript[0]]
+        cols = range(self.shape[1])[subscript[1]]
+        window = self._densify(
+            rows if type(rows) is range else [rows],
+            cols if type(cols) is range else [cols],
+        )
+        squeeze = (
+            0 if type(rows) is not range else slice(None),
+            0 if type(cols) is not range else slice(None),
+        )
+        return window[squeeze + subscript[2:]]
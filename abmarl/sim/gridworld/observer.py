@@ -1,7 +1,7 @@
 
 from abc import ABC, abstractmethod
 
-from gym.spaces import Box
+from gym.spaces import Box, Dict, Discrete
 import numpy as np
 
 from abmarl.sim.gridworld.base import GridWorldBaseComponent
@@ -12,7 +12,35 @@ import abmarl.sim.gridworld.utils as gu
 class ObserverBaseComponent(GridWorldBaseComponent, ABC):
     """
     Abstract Observer Component base from which all observer components will inherit.
+
+    Args:
+        reuse_buffers: If True, the Observer writes the observations into buffers
+            that it owns and overwrites them the next time it observes, so callers
+            that keep observations across steps must copy them. Default False.
     """
+    def __init__(self, reuse_buffers=False, **kwargs):
+        super().__init__(**kwargs)
+        self.reuse_buffers = reuse_buffers
+        self._buffers = {}
+        self._buffers_reset_count = None
+
+    @property
+    def reuse_buffers(self):
+        """
+        Overwrite the same output buffers each time the Observer observes.
+
+        Reusing the buffers avoids allocating new arrays every step, but an
+        observation is only valid until the next observation for the same agent
+        or the same batch of agents. Each batch of agents has its own buffer,
+        and the buffers are released when the grid resets.
+        """
+        return self._reuse_buffers
+
+    @reuse_buffers.setter
+    def reuse_buffers(self, value):
+        assert type(value) is bool, "Reuse buffers must be a boolean."
+        self._reuse_buffers = value
+
     @property
     @abstractmethod
     def key(self):
@@ -50,20 +78,240 @@ class ObserverBaseComponent(GridWorldBaseComponent, ABC):
         """
         pass
 
+    def get_obs_batch(self, agents, **kwargs):
+        """
+        Observe the state of the simulation for multiple agents.
+
+        By default, the observations are generated one agent at a time and stacked.
+        Observers can override this to generate the stacked observations directly.
+
+        Args:
+            agents: List of agents for which we return observations. All the agents
+                must be supported by this Observer and have the same observation
+                space.
+
+        Returns:
+            The agents' observations stacked along a new leading axis.
+        """
+        return gu.stack_observations([self.get_obs(agent, **kwargs) for agent in agents])
+
+    def _get_buffer(self, owner, shape):
+        """
+        Get a zeroed integer array for an observation.
 
-class SingleGridObserver(ObserverBaseComponent):
+        Args:
+            owner: The key of the buffer, such as the id of the observing agent.
+            shape: The shape of the observation.
+
+        Returns:
+            A new array, or the owner's buffer if the Observer reuses its buffers.
+        """
+        if not self.reuse_buffers:
+            return np.zeros(shape, dtype=int)
+        if self._buffers_reset_count != self.grid.reset_count:
+            # The batches of agents change from episode to episode, so the
+            # buffers are only kept for the current episode.
+            self._buffers.clear()
+            self._buffers_reset_count = self.grid.reset_count
+        buffer = self._buffers.get(owner)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.zeros(shape, dtype=int)
+            self._buffers[owner] = buffer
+        else:
+            buffer.fill(0)
+        return buffer
+
+
+class GridWindowObserver(ObserverBaseComponent, ABC):
+    """
+    Abstract Observer that observes a window of the grid centered on the agent's position.
+
+    The observation is built from the grid's encoding counts, the out of bounds
+    cells, and the mask of the observation window.
+
+    Args:
+        incremental: If True, the Observer remembers each agent's observation
+            and reuses it until the agent moves or an agent is placed in or removed
+            from the agent's observation window. Default False.
+    """
+    def __init__(self, incremental=False, **kwargs):
+        super().__init__(**kwargs)
+        self.incremental = incremental
+        self._cached_obs = {}
+
+    @property
+    def incremental(self):
+        """
+        Reuse the agents' previous observations when their windows have not changed.
+
+        The Grid stamps every cell when an agent is placed in or removed from it,
+        so an observation only needs to be recomputed if the observing agent
+        moved or a cell in its window was stamped since the last observation.
+        """
+        return self._incremental
+
+    @incremental.setter
+    def incremental(self, value):
+        assert type(value) is bool, "Incremental must be a boolean."
+        self._incremental = value
+
+    def _max_encoding(self):
+        """
+        The largest encoding that the agents can observe, including the terrain's.
+        """
+        max_encoding = max([agent.encoding for agent in self.agents.values()])
+        if self.grid.terrain is not None:
+            max_encoding = max(max_encoding, int(self.grid.terrain.max()))
+        return max_encoding
+
+    def get_obs(self, agent, **kwargs):
+        """
+        The agent observes a sub-grid centered on its position.
+
+        The observation may include other agents, empty spaces, out of bounds, and
+        masked cells, which can be blocked from view by other blocking agents.
+
+        Returns:
+            The observation as a dictionary.
+        """
+        if not isinstance(agent, self.supported_agent_type):
+            return {}
+
+        obs = self._get_buffer(agent.id, (1,) + self._obs_shape(agent.view_range))
+        cached = self._get_cached_obs(agent) if self.incremental else None
+        if cached is not None:
+            obs[0] = cached
+            return {self.key: obs[0]}
+
+        # Generate an observation mask and count the agents of each encoding in
+        # the observation window.
+        mask = self.grid.visibility.get_mask(agent, agent.view_range)
+        counts = self.grid.encoding_counts_window(agent.position, agent.view_range)
+        in_bounds = self.grid.in_bounds_window(agent.position, agent.view_range)
+
+        self._observe(obs, [agent], counts[np.newaxis], in_bounds[np.newaxis], mask[np.newaxis])
+        if self.incremental:
+            self._cache_obs(agent, obs[0])
+        return {self.key: obs[0]}
+
+    def get_obs_batch(self, agents, **kwargs):
+        """
+        The agents observe sub-grids centered on their positions.
+
+        The observation windows of all the agents are gathered from the grid at
+        once.
+
+        Args:
+            agents: List of GridObservingAgents with the same view range.
+
+        Returns:
+            Dictionary that maps this Observer's key to the stacked observations.
+        """
+        assert len(agents) > 0, "There must be at least one agent."
+        view_range = agents[0].view_range
+        for agent in agents:
+            assert isinstance(agent, self.supported_agent_type), \
+                f"{agent.id} is not supported by this Observer."
+            assert agent.view_range == view_range, \
+                "All the agents must have the same view range."
+        obs = self._get_buffer(
+            tuple(agent.id for agent in agents), (len(agents),) + self._obs_shape(view_range)
+        )
+
+        # Fill in the cached observations and recompute the stale ones.
+        stale = list(range(len(agents)))
+        if self.incremental:
+            stale = []
+            for n, agent in enumerate(agents):
+                cached = self._get_cached_obs(agent)
+                if cached is None:
+                    stale.append(n)
+                else:
+                    obs[n] = cached
+        if not stale:
+            return {self.key: obs}
+
+        stale_agents = [agents[n] for n in stale]
+        positions = np.array([agent.position for agent in stale_agents])
+        stale_obs = obs if len(stale) == len(agents) else \
+            np.zeros((len(stale),) + obs.shape[1:], dtype=int)
+        self._observe(
+            stale_obs,
+            stale_agents,
+            self.grid.encoding_counts_windows(positions, view_range),
+            self.grid.in_bounds_windows(positions, view_range),
+            np.stack([
+                self.grid.visibility.get_mask(agent, view_range) for agent in stale_agents
+            ])
+        )
+        if stale_obs is not obs:
+            obs[stale] = stale_obs
+        if self.incremental:
+            for n in stale:
+                self._cache_obs(agents[n], obs[n])
+        return {self.key: obs}
+
+    @abstractmethod
+    def _obs_shape(self, view_range):
+        """
+        The shape of the observation for an agent with this view range.
+        """
+        pass
+
+    @abstractmethod
+    def _observe(self, obs, agents, counts, in_bounds, masks):
+        """
+        Fill the observations from the observation windows.
+
+        Args:
+            obs: The zeroed stacked observations to fill.
+            agents: List of the observing agents.
+            counts: The encoding counts in each agent's observation window.
+            in_bounds: Boolean arrays that are True where the windows are in bounds.
+            masks: The agents' observation masks.
+        """
+        pass
+
+    def _get_cached_obs(self, agent):
+        """
+        The agent's previous observation if its window has not changed, otherwise None.
+        """
+        entry = self._cached_obs.get(agent.id)
+        if entry is None:
+            return None
+        position, view_range, version, obs = entry
+        if position != tuple(agent.position) or view_range != agent.view_range:
+            return None
+        if self.grid.change_stamps_window(agent.position, view_range).max() > version:
+            return None
+        return obs
+
+    def _cache_obs(self, agent, obs):
+        """
+        Remember the agent's observation.
+        """
+        self._cached_obs[agent.id] = (
+            tuple(agent.position), agent.view_range, self.grid.change_version, obs.copy()
+        )
+
+
+class SingleGridObserver(GridWindowObserver):
     """
     Observe a subset of the grid centered on the agent's position.
 
     The observation is centered around the observing agent's position. Each agent
     in the "observation window" is recorded in the relative cell using its encoding.
     If there are multiple agents on a single cell with different encodings, the
-    agent will observe only one of them chosen at random.
+    agent will observe only one of them, chosen according to tie_breaking.
+
+    The observation is built from the grid's encoding counts in the observation
+    window, so the cost does not depend on the number of agents in each cell.
     """
-    def __init__(self, observe_self=True, **kwargs):
+    def __init__(self, observe_self=True, tie_breaking='random', **kwargs):
         super().__init__(**kwargs)
         self.observe_self = observe_self
-        max_encoding = max([agent.encoding for agent in self.agents.values()])
+        self.tie_breaking = tie_breaking
+        max_encoding = self._max_encoding()
         for agent in self.agents.values():
             if isinstance(agent, self.supported_agent_type):
                 agent.observation_space[self.key] = Box(
@@ -98,56 +346,82 @@ class SingleGridObserver(ObserverBaseComponent):
         assert type(value) is bool, "Observe self must be a boolean."
         self._observe_self = value
 
-    def get_obs(self, agent, **kwargs):
+    @property
+    def tie_breaking(self):
         """
-        The agent observes a sub-grid centered on its position.
-
-        The observation may include other agents, empty spaces, out of bounds, and
-        masked cells, which can be blocked from view by other blocking agents.
+        How the agent chooses which encoding to observe on a cell with multiple agents.
 
-        Returns:
-            The observation as a dictionary.
+        "random" observes one of the agents at random, "max" observes the largest
+        encoding, and "recent" observes the agent that most recently arrived at
+        the cell.
         """
-        if not isinstance(agent, self.supported_agent_type):
-            return {}
-
-        # Generate a local grid and an observation mask
-        local_grid, mask = gu.create_grid_and_mask(
-            agent, self.grid, agent.view_range, self.agents
-        )
-
-        # Convolve the grid observation with the mask.
-        obs = np.zeros((2 * agent.view_range + 1, 2 * agent.view_range + 1), dtype=int)
-        for r in range(2 * agent.view_range + 1):
-            for c in range(2 * agent.view_range + 1):
-                if mask[r, c]: # We can see this cell
-                    candidate_agents = local_grid[r, c]
-                    if candidate_agents is None: # This cell is out of bounds
-                        obs[r, c] = -1
-                    elif not candidate_agents: # In bounds empty cell
-                        obs[r, c] = 0
-                    else: # Observe one of the agents at this cell
-                        if self.observe_self:
-                            obs[r, c] = np.random.choice([
-                                other.encoding for other in candidate_agents.values()
-                            ])
-                        else:
-                            choices = [
-                                other.encoding
-                                for other in candidate_agents.values()
-                                if other.id != agent.id
-                            ]
-                            # It may be that the observing agent is the only agent
-                            # at this location but it cannot observe itself, which
-                            # makes choices an empty list.
-                            obs[r, c] = np.random.choice(choices) if choices else 0
-                else: # Cell blocked by agent. Indicate invisible with -2
-                    obs[r, c] = -2
-
-        return {self.key: obs}
+        return self._tie_breaking
+
+    @tie_breaking.setter
+    def tie_breaking(self, value):
+        assert value in ['random', 'max', 'recent'], \
+            "Tie breaking must be either 'random', 'max', or 'recent'."
+        self._tie_breaking = value
+
+    def _obs_shape(self, view_range):
+        return (2 * view_range + 1, 2 * view_range + 1)
+
+    def _observe(self, obs, agents, counts, in_bounds, masks):
+        if not self.observe_self:
+            counts = counts.copy()
+            for n, agent in enumerate(agents):
+                if agent.id in self.grid[agent.position[0], agent.position[1]]:
+                    counts[n, agent.view_range, agent.view_range, agent.encoding - 1] -= 1
+
+        # Observe one of the agents in each occupied cell, then indicate out of
+        # bounds with -1 and invisible with -2.
+        occupied = counts.any(axis=-1)
+        if occupied.any():
+            obs[occupied] = self._choose_encodings(agents, counts, occupied)
+        obs[~in_bounds] = -1
+        obs[masks == 0] = -2
+
+    def _choose_encodings(self, agents, counts, occupied):
+        """
+        Choose the encoding that the agents observe in each occupied cell.
 
+        Args:
+            agents: List of the observing agents.
+            counts: The encoding counts in each agent's observation window.
+            occupied: Boolean array of the occupied cells in the observation windows.
 
-class MultiGridObserver(ObserverBaseComponent):
+        Returns:
+            The observed encodings of the occupied cells.
+        """
+        counts = counts[occupied]
+        if self.tie_breaking == 'max':
+            return counts.shape[-1] - np.argmax(counts[:, ::-1] > 0, axis=-1)
+        elif self.tie_breaking == 'random':
+            # One draw for the whole window. Each agent in a cell is equally likely,
+            # so the encodings are weighted by their counts.
+            cumulative = counts.cumsum(axis=-1)
+            draws = (np.random.uniform(size=len(counts)) * cumulative[:, -1]).astype(int)
+            return (cumulative <= draws[:, np.newaxis]).sum(axis=-1) + 1
+        else: # Cells keep their agents in the order that they arrived
+            encodings = []
+            for n, r, c in zip(*np.nonzero(occupied)):
+                agent = agents[n]
+                ndx = (
+                    agent.position[0] + r - agent.view_range,
+                    agent.position[1] + c - agent.view_range
+                )
+                # The terrain was there before any agent arrived.
+                encodings.append(next(
+                    (
+                        other.encoding for other in reversed(self.grid[ndx].values())
+                        if self.observe_self or other.id != agent.id
+                    ),
+                    None if self.grid.terrain is None else self.grid.terrain[ndx]
+                ))
+            return encodings
+
+
+class MultiGridObserver(GridWindowObserver):
     """
     Observe a subset of the grid centered on the agent's position.
 
@@ -155,10 +429,12 @@ class MultiGridObserver(ObserverBaseComponent):
     agent sees a stack of observations, one for each positive encoding, where the
     number of agents of each encoding is given rather than the encoding
     itself. Out of bounds and masked indicators appear in every grid.
+
+    The stack is copied from the grid's encoding counts in the observation window.
     """
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.number_of_encodings = max([agent.encoding for agent in self.agents.values()])
+        self.number_of_encodings = self._max_encoding()
         for agent in self.agents.values():
             if isinstance(agent, self.supported_agent_type):
                 agent.observation_space[self.key] = Box(
@@ -182,46 +458,116 @@ class MultiGridObserver(ObserverBaseComponent):
         """
         return GridObservingAgent
 
-    def get_obs(self, agent, **kwargs):
+    def _obs_shape(self, view_range):
+        return (2 * view_range + 1, 2 * view_range + 1, self.number_of_encodings)
+
+    def _observe(self, obs, agents, counts, in_bounds, masks):
+        # Copy the number of agents of each encoding in the observation window,
+        # then indicate out of bounds with -1 and invisible with -2 in every channel.
+        channels = min(self.number_of_encodings, counts.shape[-1])
+        obs[..., :channels] = counts[..., :channels]
+        obs[~in_bounds] = -1
+        obs[masks == 0] = -2
+
+
+class SparseGridObserver(SingleGridObserver):
+    """
+    Observe the agents in a subset of the grid centered on the agent's position.
+
+    The observation window is built like the SingleGridObserver's, but the agent
+    observes a fixed-capacity list of the occupied cells that it can see instead
+    of the whole window. Each entry in the list is the row offset, column offset,
+    and encoding of a cell relative to the observing agent, sorted from the nearest
+    cell to the farthest. Unused entries are zeros, and the observation includes
+    the number of valid entries. Empty, out of bounds, and masked cells are not
+    listed, so the size of the observation depends on the capacity instead of
+    the view range.
+
+    Args:
+        capacity: The maximum number of entries in the observation. If there
+            are more occupied cells in view, the farthest ones are left out.
+            Defaults to the number of agents.
+    """
+    def __init__(self, capacity=None, **kwargs):
+        super().__init__(**kwargs)
+        self.capacity = len(self.agents) if capacity is None else capacity
+        max_encoding = self._max_encoding()
+        for agent in self.agents.values():
+            if isinstance(agent, self.supported_agent_type):
+                low = [-agent.view_range, -agent.view_range, 0]
+                high = [agent.view_range, agent.view_range, max_encoding]
+                agent.observation_space[self.key] = Dict({
+                    'count': Discrete(self.capacity + 1),
+                    'entries': Box(
+                        np.tile(low, (self.capacity, 1)),
+                        np.tile(high, (self.capacity, 1)),
+                        dtype=int
+                    )
+                })
+
+    @property
+    def capacity(self):
+        """
+        The maximum number of entries in the observation.
         """
-        The agent observes one or more sub-grids centered on its position.
+        return self._capacity
 
-        The observation may include other agents, empty spaces, out of bounds, and
-        masked cells, which can be blocked from view by other blocking agents.
-        Each grid records the number of agents on a particular cell correlated
-        to a specific encoding.
+    @capacity.setter
+    def capacity(self, value):
+        assert type(value) is int and value > 0, "Capacity must be a positive integer."
+        self._capacity = value
+
+    def get_obs(self, agent, **kwargs):
+        """
+        The agent observes the occupied cells that it can see around its position.
 
         Returns:
             The observation as a dictionary.
         """
         if not isinstance(agent, self.supported_agent_type):
             return {}
+        obs = super().get_obs(agent, **kwargs)[self.key]
+        count, entries = self._sparsify(agent.id, obs[np.newaxis])
+        return {self.key: {'count': int(count[0]), 'entries': entries[0]}}
 
-        # Generate a local grid and an observation mask.
-        local_grid, mask = gu.create_grid_and_mask(
-            agent, self.grid, agent.view_range, self.agents
-        )
+    def get_obs_batch(self, agents, **kwargs):
+        """
+        The agents observe the occupied cells that they can see around their positions.
 
-        # Convolve the grid observation with the mask.
-        obs = np.zeros(
-            (2 * agent.view_range + 1, 2 * agent.view_range + 1, self.number_of_encodings),
-            dtype=int
-        )
-        for encoding in range(self.number_of_encodings):
-            for r in range(2 * agent.view_range + 1):
-                for c in range(2 * agent.view_range + 1):
-                    if mask[r, c]: # We can see this cell
-                        candidate_agents = local_grid[r, c]
-                        if candidate_agents is None: # This cell is out of bounds
-                            obs[r, c, encoding] = -1
-                        elif not candidate_agents: # In bounds empty cell
-                            obs[r, c, encoding] = 0
-                        else: # Observe the number of agents at this cell with this encoding
-                            obs[r, c, encoding] = sum([
-                                True if other.encoding == encoding + 1 else False
-                                for other in candidate_agents.values()
-                            ])
-                    else: # Cell blocked by agent. Indicate invisible with -2
-                        obs[r, c, encoding] = -2
+        Args:
+            agents: List of GridObservingAgents with the same view range.
 
-        return {self.key: obs}
+        Returns:
+            Dictionary that maps this Observer's key to the stacked observations.
+        """
+        obs = super().get_obs_batch(agents, **kwargs)[self.key]
+        count, entries = self._sparsify(tuple(agent.id for agent in agents), obs)
+        return {self.key: {'count': count, 'entries': entries}}
+
+    def _sparsify(self, owner, obs):
+        """
+        Convert stacked grid observations to lists of entries.
+
+        Args:
+            owner: The key of the output buffers.
+            obs: The stacked grid observations.
+
+        Returns:
+            The number of valid entries and the entries of each observation.
+        """
+        view_range = (obs.shape[1] - 1) // 2
+        n, r, c = np.nonzero(obs > 0)
+        encodings = obs[n, r, c]
+        r, c = r - view_range, c - view_range
+
+        # Sort the cells from nearest to farthest within each observation and
+        # keep the first capacity of them.
+        order = np.lexsort((c, r, np.maximum(np.abs(r), np.abs(c)), n))
+        n, r, c, encodings = n[order], r[order], c[order], encodings[order]
+        rank = np.arange(len(n)) - np.searchsorted(n, np.arange(len(obs)))[n]
+        keep = rank < self.capacity
+
+        entries = self._get_buffer((owner, 'entries'), (len(obs), self.capacity, 3))
+        entries[n[keep], rank[keep]] = np.stack([r[keep], c[keep], encodings[keep]], axis=-1)
+        count = np.minimum(np.bincount(n, minlength=len(obs)), self.capacity)
+        return count, entries
@@ -5,6 +5,7 @@ import numpy as np
 
 from abmarl.sim.gridworld.base import GridWorldBaseComponent
 from abmarl.sim.gridworld.agent import HealthAgent
+from abmarl.sim.gridworld.grid import SparseGrid
 
 
 class StateBaseComponent(GridWorldBaseComponent, ABC):
@@ -23,6 +24,10 @@ class PositionState(StateBaseComponent):
     """
     Manage the agents' positions in the grid.
     """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._free_cells = None
+
     def reset(self, **kwargs):
         """
         Give agents their starting positions.
@@ -34,29 +39,131 @@ class PositionState(StateBaseComponent):
         # Prioritize placing agents with initial positions. We must keep track
         # of which positions have been taken so that
         # the random placement below doesn't try to place an agent there.
-        ravelled_positions_available = set(i for i in range(self.rows * self.cols))
+        taken = []
+        unpositioned_agents = []
         for agent in self.agents.values():
             if agent.initial_position is not None:
                 r, c = agent.initial_position
                 assert self.grid.place(agent, (r, c)), "All initial positions must " + \
                     "be unique or agents with the same initial positions must be overlappable."
-                try:
-                    ravelled_positions_available.remove(
-                        np.ravel_multi_index(agent.position, (self.rows, self.cols))
-                    )
-                except KeyError:
-                    continue
-
-        # Now place all the rest of the agents who did not have initial positions
-        # and block off those positions as well. We have to do this one agent at
-        # a time because the list of available positions is updated after each
-        # agent is placed.
-        for agent in self.agents.values():
-            if agent.initial_position is None:
-                n = np.random.choice([*ravelled_positions_available], 1)
-                r, c = np.unravel_index(n.item(), shape=(self.rows, self.cols))
-                assert self.grid.place(agent, (r, c))
-                ravelled_positions_available.remove(n.item())
+                taken.append(np.ravel_multi_index(agent.position, (self.rows, self.cols)))
+            else:
+                unpositioned_agents.append(agent)
+
+        # Now place all the rest of the agents who did not have initial positions.
+        # We sample all of their positions at once without replacement from the
+        # cells that are still available. With terrain, the agents are sampled
+        # in groups by encoding, each group excluding the terrain that it cannot
+        # enter, starting with the groups that can enter the fewest cells.
+        if unpositioned_agents:
+            groups = {}
+            for agent in unpositioned_agents:
+                key = agent.encoding if self.grid.terrain is not None else None
+                groups.setdefault(key, []).append(agent)
+            excluded = {}
+            for encoding in groups:
+                if encoding is None:
+                    excluded[encoding] = np.empty(0, dtype=int)
+                else:
+                    enterable = self.grid.overlap_matrix[encoding].copy()
+                    enterable[0] = True
+                    excluded[encoding] = np.flatnonzero(~enterable[self.grid.terrain])
+            for encoding in sorted(groups, key=lambda encoding: -len(excluded[encoding])):
+                group = groups[encoding]
+                ravelled_positions = self._sample_free_cells(
+                    len(group), np.concatenate([np.array(taken, dtype=int), excluded[encoding]])
+                )
+                rs, cs = np.unravel_index(ravelled_positions, shape=(self.rows, self.cols))
+                for agent, r, c in zip(group, rs, cs):
+                    assert self.grid.place(agent, (r, c))
+                taken.extend(ravelled_positions)
+
+    def _sample_free_cells(self, number, taken):
+        """
+        Uniformly sample ravelled cells without replacement, excluding the taken cells.
+        """
+        taken = np.unique(np.array(taken, dtype=int))
+        assert number <= self.rows * self.cols - len(taken), \
+            "There are not enough cells available to place all the agents."
+        if isinstance(self.grid, SparseGrid):
+            # Most cells are free, so rejection sampling avoids storing every cell.
+            samples = np.empty(0, dtype=int)
+            while len(samples) < number:
+                candidates = np.random.randint(0, self.rows * self.cols, 2 * number)
+                candidates = candidates[~np.isin(candidates, taken)]
+                _, first = np.unique(np.concatenate([samples, candidates]), return_index=True)
+                samples = np.concatenate([samples, candidates])[np.sort(first)]
+            return samples[:number]
+        else:
+            if self._free_cells is None or self._free_cells.capacity != self.rows * self.cols:
+                self._free_cells = _FreeCellIndex(self.rows * self.cols)
+            self._free_cells.reset()
+            self._free_cells.remove(taken)
+            return self._free_cells.sample(number)
+
+
+class _FreeCellIndex:
+    """
+    Index of free cells that supports uniform sampling without replacement.
+
+    The index is a permutation of all the ravelled cells where the free cells
+    make up the first ``size`` entries, along with the inverse permutation to look
+    up where each cell is. Removing a cell swaps it behind the free region, so
+    removal is O(1) per cell, and resetting the index just marks every cell as free.
+
+    Args:
+        capacity: The total number of cells.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._cells = np.arange(capacity)
+        self._lookup = np.arange(capacity)
+        self.size = capacity
+
+    def reset(self):
+        """
+        Mark every cell as free.
+        """
+        self.size = self.capacity
+
+    def remove(self, cells):
+        """
+        Remove an array of cells from the free region.
+
+        Cells that are not free are ignored.
+        """
+        positions = np.unique(self._lookup[cells])
+        positions = positions[positions < self.size]
+        new_size = self.size - len(positions)
+        # Removed cells that are in front of the new boundary swap with free cells
+        # that are behind it.
+        holes = positions[positions < new_size]
+        tail = np.arange(new_size, self.size)
+        fillers = tail[~np.isin(tail, positions)]
+        hole_cells = self._cells[holes]
+        self._cells[holes] = self._cells[fillers]
+        self._cells[fillers] = hole_cells
+        self._lookup[self._cells[holes]] = holes
+        self._lookup[self._cells[fillers]] = fillers
+        self.size = new_size
+
+    def sample(self, number):
+        """
+        Uniformly sample and remove a number of free cells.
+        """
+        if 2 * number <= self.size:
+            # Draw with replacement and redraw the duplicates.
+            positions = np.unique(np.random.randint(0, self.size, number))
+            while len(positions) < number:
+                positions = np.unique(np.concatenate([
+                    positions, np.random.randint(0, self.size, number - len(positions))
+                ]))
+            positions = np.random.permutation(positions)
+        else:
+            positions = np.random.permutation(self.size)[:number]
+        cells = self._cells[positions]
+        self.remove(cells)
+        return cells
 
 
 class HealthState(StateBaseComponent):
@@ -1,8 +1,13 @@
 
+from functools import lru_cache
+import hashlib
+import os
+import warnings
+
 import numpy as np
 
 
-def create_grid_and_mask(agent, grid, mask_range, agents):
+def create_grid_and_mask(agent, grid, mask_range, agents=None):
     """
     Generate a local grid and a mask.
 
@@ -14,13 +19,14 @@ def create_grid_and_mask(agent, grid, mask_range, agents):
     rays from the center of the agent's position to the edges of the other agents'
     cell. All cells that are "behind" that cell and between the two rays are
     invisible to the observing agent. In the mask, 1 means that the cell is visibile,
-    0 means that it is invisible.
+    0 means that it is invisible. The blocking agents are found through the grid's
+    blocker index, so only agents in the grid can block.
 
     Args:
         agent: The agent of interest.
         grid: The grid.
         mask_range: The integer range from the agent of interest.
-        agents: The dictionary of agents.
+        agents: Deprecated and ignored. The blocking comes from the grid.
 
     Returns:
         Two matrices. The first is a local grid centered around the agent's location
@@ -28,90 +34,415 @@ def create_grid_and_mask(agent, grid, mask_range, agents):
         (2 * range + 1) x (2 * range + 1) that shows which cells are masked to the
         agent of interest.
     """
-    # Generate a completely empty grid
-    local_grid = np.empty((mask_range * 2 + 1, mask_range * 2 + 1), dtype=object)
+    if agents is not None:
+        warnings.warn(
+            "The agents argument of create_grid_and_mask is deprecated and ignored "
+            "because the blocking comes from the grid.",
+            DeprecationWarning
+        )
+    return create_local_grid(agent, grid, mask_range), create_mask(agent, grid, mask_range)
+
+
+def create_local_grid(agent, grid, mask_range):
+    """
+    Generate a local grid centered around the agent's location.
+
+    Cells of the local grid that are outside the grid are None. The local grid
+    is a read-only view of the grid's padded storage, so it is not copied.
+
+    Args:
+        agent: The agent of interest.
+        grid: The grid.
+        mask_range: The integer range from the agent of interest.
+
+    Returns:
+        Object array of size (2 * range + 1) x (2 * range + 1) with values from
+        the actual grid.
+    """
+    local_grid = grid.window(agent.position, mask_range)
+    return local_grid
 
-    # Copy the section of the grid around the agent's position
-    (r, c) = agent.position
-    r_lower = max([0, r - mask_range])
-    r_upper = min([grid.rows - 1, r + mask_range]) + 1
-    c_lower = max([0, c - mask_range])
-    c_upper = min([grid.cols - 1, c + mask_range]) + 1
-    local_grid[
-        (r_lower+mask_range-r):(r_upper+mask_range-r),
-        (c_lower+mask_range-c):(c_upper+mask_range-c)
-    ] = grid[r_lower:r_upper, c_lower:c_upper]
+
+def create_mask(agent, grid, mask_range):
+    """
+    Generate the mask of the cells that are visible to the agent.
+
+    See ``create_grid_and_mask`` for how blocking agents mask cells with rays.
+    If the grid's visibility algorithm is "shadowcast", then the mask is computed
+    with ``shadowcast_mask`` instead.
+
+    Args:
+        agent: The agent of interest.
+        grid: The grid.
+        mask_range: The integer range from the agent of interest.
+
+    Returns:
+        Array of size (2 * range + 1) x (2 * range + 1), where 1 means that the
+        cell is visible and 0 means that it is invisible.
+    """
+    # Gather the blocking agents within the mask range from the grid's blocker
+    # index. The shadows of static blocking agents are precomputed by the grid.
+    blocking = grid.blocker_counts_window(agent.position, mask_range) > 0
+    if grid.visibility_algorithm == 'shadowcast':
+        return shadowcast_mask(blocking, mask_range)
+
+    offsets = np.argwhere(blocking)
+    offsets = offsets[np.any(offsets != mask_range, axis=1)]
 
     mask = np.ones((2 * mask_range + 1, 2 * mask_range + 1))
-    for other in agents.values():
-        if other.blocking:
-            r_diff, c_diff = other.position - agent.position
-            # Ensure the other agent within the view range
-            if -mask_range <= r_diff <= mask_range and \
-                    -mask_range <= c_diff <= mask_range:
-                if c_diff > 0 and r_diff == 0: # Other is to the right of agent
-                    upper = lambda t: (r_diff + 0.5) / (c_diff - 0.5) * t
-                    lower = lambda t: (r_diff - 0.5) / (c_diff - 0.5) * t
-                    for c in range(c_diff, mask_range+1):
-                        for r in range(-mask_range, mask_range+1):
-                            if c == c_diff and r == r_diff: continue # don't mask the other
-                            if lower(c) < r < upper(c):
-                                mask[r + mask_range, c + mask_range] = 0
-                elif c_diff > 0 and r_diff > 0: # Other is below-right of agent
-                    upper = lambda t: (r_diff + 0.5) / (c_diff - 0.5) * t
-                    lower = lambda t: (r_diff - 0.5) / (c_diff + 0.5) * t
-                    for c in range(c_diff, mask_range+1):
-                        for r in range(r_diff, mask_range+1):
-                            if c == c_diff and r == r_diff: continue # Don't mask the other
-                            if lower(c) < r < upper(c):
-                                mask[r + mask_range, c + mask_range] = 0
-                elif c_diff == 0 and r_diff > 0: # Other is below the agent
-                    left = lambda t: (c_diff - 0.5) / (r_diff - 0.5) * t
-                    right = lambda t: (c_diff + 0.5) / (r_diff - 0.5) * t
-                    for c in range(-mask_range, mask_range+1):
-                        for r in range(r_diff, mask_range+1):
-                            if c == c_diff and r == r_diff: continue # don't mask the other
-                            if left(r) < c < right(r):
-                                mask[r + mask_range, c + mask_range] = 0
-                elif c_diff < 0 and r_diff > 0: # Other is below-left of agent
-                    upper = lambda t: (r_diff + 0.5) / (c_diff + 0.5) * t
-                    lower = lambda t: (r_diff - 0.5) / (c_diff - 0.5) * t
-                    for c in range(c_diff, -mask_range-1, -1):
-                        for r in range(r_diff, mask_range+1):
-                            if c == c_diff and r == r_diff: continue # don't mask the other
-                            if lower(c) < r < upper(c):
-                                mask[r + mask_range, c + mask_range] = 0
-                elif c_diff < 0 and r_diff == 0: # Other is left of agent
-                    upper = lambda t: (r_diff + 0.5) / (c_diff + 0.5) * t
-                    lower = lambda t: (r_diff - 0.5) / (c_diff + 0.5) * t
-                    for c in range(c_diff, -mask_range-1, -1):
-                        for r in range(-mask_range, mask_range+1):
-                            if c == c_diff and r == r_diff: continue # don't mask the other
-                            if lower(c) < r < upper(c):
-                                mask[r + mask_range, c + mask_range] = 0
-                elif c_diff < 0 and r_diff < 0: # Other is above-left of agent
-                    upper = lambda t: (r_diff + 0.5) / (c_diff - 0.5) * t
-                    lower = lambda t: (r_diff - 0.5) / (c_diff + 0.5) * t
-                    for c in range(c_diff, -mask_range - 1, -1):
-                        for r in range(r_diff, -mask_range - 1, -1):
-                            if c == c_diff and r == r_diff: continue # don't mask the other
-                            if lower(c) < r < upper(c):
-                                mask[r + mask_range, c + mask_range] = 0
-                elif c_diff == 0 and r_diff < 0: # Other is above the agent
-                    left = lambda t: (c_diff - 0.5) / (r_diff + 0.5) * t
-                    right = lambda t: (c_diff + 0.5) / (r_diff + 0.5) * t
-                    for c in range(-mask_range, mask_range+1):
-                        for r in range(r_diff, -mask_range - 1, -1):
-                            if c == c_diff and r == r_diff: continue # don't mask the other
-                            if left(r) < c < right(r):
-                                mask[r + mask_range, c + mask_range] = 0
-                elif c_diff > 0 and r_diff < 0: # Other is above-right of agent
-                    upper = lambda t: (r_diff + 0.5) / (c_diff + 0.5) * t
-                    lower = lambda t: (r_diff - 0.5) / (c_diff - 0.5) * t
-                    for c in range(c_diff, mask_range+1):
-                        for r in range(r_diff, -mask_range - 1, -1):
-                            if c == c_diff and r == r_diff: continue # don't mask the other
-                            if lower(c) < r < upper(c):
-                                mask[r + mask_range, c + mask_range] = 0
-
-    return local_grid, mask
+    if len(offsets):
+        mask[get_shadow_stencils(mask_range)[offsets[:, 0], offsets[:, 1]].any(axis=0)] = 0
+    if grid.static_visibility is not None:
+        mask[~grid.static_visibility.get_mask(agent.position, mask_range)] = 0
+
+    return mask
+
+
+def shadowcast_mask(blocking, mask_range):
+    """
+    Generate a mask with symmetric recursive shadowcasting.
+
+    The window around the agent is scanned one quadrant at a time, row by row
+    outward from the agent, while tracking the slopes of the visible sector. A
+    floor cell is visible if its center lies within the sector, which makes the
+    visibility symmetric: if A can see B, then B can see A. Blocking cells are
+    visible if any part of them is within the sector. Each cell is visited at most
+    once per quadrant, so the cost does not depend on the number of blocking agents.
+
+    Args:
+        blocking: Boolean array of size (2 * range + 1) x (2 * range + 1) that is
+            True where there is a blocking agent. The center cell is ignored.
+        mask_range: The integer range from the agent of interest.
+
+    Returns:
+        Array of size (2 * range + 1) x (2 * range + 1), where 1 means that the
+        cell is visible and 0 means that it is invisible.
+    """
+    mask = np.zeros((2 * mask_range + 1, 2 * mask_range + 1))
+    mask[mask_range, mask_range] = 1
+    quadrants = [
+        lambda depth, col: (mask_range - depth, mask_range + col), # North
+        lambda depth, col: (mask_range + col, mask_range + depth), # East
+        lambda depth, col: (mask_range + depth, mask_range + col), # South
+        lambda depth, col: (mask_range + col, mask_range - depth), # West
+    ]
+    for transform in quadrants:
+        # Each row in the stack is a depth and the start and end slopes of the
+        # sector. The slopes are kept as integer fractions (numerator, denominator)
+        # so that ties on the cell centers are resolved exactly.
+        rows = [(1, -1, 1, 1, 1)]
+        while rows:
+            depth, start_num, start_den, end_num, end_den = rows.pop()
+            if depth > mask_range:
+                continue
+            # Round the start up and the end down when the slope is on a cell edge
+            min_col = (2 * depth * start_num + start_den) // (2 * start_den)
+            max_col = -((end_den - 2 * depth * end_num) // (2 * end_den))
+            previous_is_wall = None
+            for col in range(min_col, max_col + 1):
+                cell = transform(depth, col)
+                is_wall = bool(blocking[cell])
+                if is_wall or (
+                    depth * start_num <= col * start_den and col * end_den <= depth * end_num
+                ):
+                    mask[cell] = 1
+                if previous_is_wall and not is_wall:
+                    start_num, start_den = 2 * col - 1, 2 * depth
+                if previous_is_wall is False and is_wall:
+                    rows.append(
+                        (depth + 1, start_num, start_den, 2 * col - 1, 2 * depth)
+                    )
+                previous_is_wall = is_wall
+            if previous_is_wall is False:
+                rows.append((depth + 1, start_num, start_den, end_num, end_den))
+    return mask
+
+
+@lru_cache(maxsize=8)
+def get_shadow_stencils(mask_range):
+    """
+    Get the shadow of every blocking offset within a range.
+
+    The shadow that a blocking cell casts depends only on its offset from the
+    center and on the range, so we compute the shadows of all the offsets once
+    per range and cache them. The least recently used ranges are evicted when
+    the cache is full.
+
+    Args:
+        mask_range: The integer range from the center.
+
+    Returns:
+        A read-only boolean array of size (2 * range + 1) x (2 * range + 1) x
+        (2 * range + 1) x (2 * range + 1). The stencil at ``[r + range, c + range]``
+        is the shadow of a blocking cell at offset (r, c).
+    """
+    size = 2 * mask_range + 1
+    r_diffs, c_diffs = np.divmod(np.arange(size * size), size)
+    r_diffs, c_diffs = r_diffs - mask_range, c_diffs - mask_range
+    not_center = (r_diffs != 0) | (c_diffs != 0)
+    stencils = np.zeros((size * size, size, size), dtype=bool)
+    stencils[not_center] = compute_shadows(
+        r_diffs[not_center], c_diffs[not_center], mask_range
+    )
+    stencils = stencils.reshape(size, size, size, size)
+    stencils.flags.writeable = False
+    return stencils
+
+
+def compute_shadows(r_diffs, c_diffs, mask_range):
+    """
+    Compute the shadows cast by blocking cells onto a local grid.
+
+    We draw rays from the center of the local grid to the edges of each blocking
+    cell. The cells that are "behind" the blocking cell and between the two rays
+    are in its shadow. All blocking cells are processed at once by broadcasting
+    over the (2 * range + 1) x (2 * range + 1) local grid.
+
+    Args:
+        r_diffs: Array of row offsets of the blocking cells relative to the center.
+        c_diffs: Array of column offsets of the blocking cells relative to the center.
+            The offsets must be within the mask range and cannot be (0, 0).
+        mask_range: The integer range from the center.
+
+    Returns:
+        A boolean array of size n x (2 * range + 1) x (2 * range + 1), where n is
+        the number of blocking cells and True indicates that the cell is in that
+        blocking cell's shadow.
+    """
+    rd = np.asarray(r_diffs, dtype=int)[:, None, None]
+    cd = np.asarray(c_diffs, dtype=int)[:, None, None]
+    local_offsets = np.arange(-mask_range, mask_range + 1)
+    r = local_offsets[None, :, None]
+    c = local_offsets[None, None, :]
+
+    # Only cells behind the blocking cell can be in its shadow.
+    behind = np.where(rd > 0, r >= rd, np.where(rd < 0, r <= rd, True)) & \
+        np.where(cd > 0, c >= cd, np.where(cd < 0, c <= cd, True)) & \
+        ~((r == rd) & (c == cd))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # If the blocking cell is in a different column, the rays are functions
+        # of the column.
+        c_sign = np.sign(cd)
+        r_sign = np.sign(rd)
+        upper_shift = np.where(rd == 0, -0.5 * c_sign, -0.5 * c_sign * r_sign)
+        lower_shift = np.where(rd == 0, -0.5 * c_sign, 0.5 * c_sign * r_sign)
+        upper = (rd + 0.5) / (cd + upper_shift) * c
+        lower = (rd - 0.5) / (cd + lower_shift) * c
+        column_shadow = (lower < r) & (r < upper)
+
+        # If the blocking cell is in the same column, the rays are functions
+        # of the row.
+        left = (cd - 0.5) / (rd - 0.5 * r_sign) * r
+        right = (cd + 0.5) / (rd - 0.5 * r_sign) * r
+        row_shadow = (left < c) & (c < right)
+
+    return behind & np.where(cd != 0, column_shadow, row_shadow)
+
+
+class StaticVisibility:
+    """
+    Precomputed visibility through cells that are always blocking.
+
+    For every cell in the grid and every requested range, we compute which cells
+    of the surrounding (2 * range + 1) x (2 * range + 1) window are visible
+    through the static blocking cells. The table for a range is computed the first
+    time that range is requested. If a cache prefix is given, the table is saved
+    to a numpy file and memory-mapped on later uses, so the work is done only once
+    per map.
+
+    Args:
+        blocking: Boolean rows x cols array that is True where there is a static
+            blocking cell.
+        cache_prefix: Optional path prefix for saving the tables. Each table is
+            saved to a file whose name includes the range and a hash of the blocking
+            layout.
+    """
+    def __init__(self, blocking, cache_prefix=None):
+        assert type(blocking) is np.ndarray and blocking.ndim == 2, \
+            "Blocking must be a 2-dimensional numpy array."
+        assert cache_prefix is None or type(cache_prefix) is str, \
+            "The cache prefix must be a string."
+        self._blocking = blocking.astype(bool)
+        self._blocking.flags.writeable = False
+        self._cache_prefix = cache_prefix
+        self._tables = {}
+
+    @property
+    def blocking(self):
+        """
+        Read-only boolean array of the static blocking cells.
+        """
+        return self._blocking
+
+    def get_mask(self, position, mask_range):
+        """
+        Get the visibility mask around a position.
+
+        Args:
+            position: The position of the center of the window.
+            mask_range: The integer range from the center.
+
+        Returns:
+            Boolean array of size (2 * range + 1) x (2 * range + 1) that is True
+            where the cell is visible through the static blocking cells.
+        """
+        return self.get_table(mask_range)[position[0], position[1]]
+
+    def get_table(self, mask_range):
+        """
+        Get the visibility masks for every cell in the grid.
+
+        Args:
+            mask_range: The integer range from the center.
+
+        Returns:
+            Boolean array of size rows x cols x (2 * range + 1) x (2 * range + 1).
+        """
+        table = self._tables.get(mask_range)
+        if table is None:
+            if self._cache_prefix is None:
+                table = self._compute_table(mask_range)
+            else:
+                file_name = self._cache_file(mask_range)
+                if not os.path.exists(file_name):
+                    np.save(file_name, self._compute_table(mask_range))
+                table = np.load(file_name, mmap_mode='r')
+            self._tables[mask_range] = table
+        return table
+
+    def _cache_file(self, mask_range):
+        layout_hash = hashlib.md5(
+            np.packbits(self._blocking).tobytes() + str(self._blocking.shape).encode()
+        ).hexdigest()[:16]
+        return f"{self._cache_prefix}.visibility_{mask_range}_{layout_hash}.npy"
+
+    def _compute_table(self, mask_range):
+        rows, cols = self._blocking.shape
+        size = 2 * mask_range + 1
+        table = np.ones((rows, cols, size, size), dtype=bool)
+        stencils = get_shadow_stencils(mask_range)
+        for r_diff in range(-mask_range, mask_range + 1):
+            for c_diff in range(-mask_range, mask_range + 1):
+                if r_diff == 0 and c_diff == 0 or abs(r_diff) >= rows or abs(c_diff) >= cols:
+                    continue
+                # Find the cells that have a blocking cell at this offset.
+                has_blocker = np.zeros((rows, cols), dtype=bool)
+                has_blocker[
+                    max(0, -r_diff):rows - max(0, r_diff),
+                    max(0, -c_diff):cols - max(0, c_diff)
+                ] = self._blocking[
+                    max(0, r_diff):rows - max(0, -r_diff),
+                    max(0, c_diff):cols - max(0, -c_diff)
+                ]
+                if has_blocker.any():
+                    table[has_blocker] &= ~stencils[r_diff + mask_range, c_diff + mask_range]
+        return table
+
+
+def stack_observations(observations):
+    """
+    Stack a list of observations along a new leading axis.
+
+    Dictionary observations are stacked entry by entry.
+
+    Args:
+        observations: List of observations with the same structure.
+
+    Returns:
+        The stacked observation.
+    """
+    if isinstance(observations[0], dict):
+        return {
+            key: stack_observations([obs[key] for obs in observations])
+            for key in observations[0]
+        }
+    return np.stack(observations)
+
+
+class VisibilityService:
+    """
+    Memoize the masks of the agents in a grid.
+
+    Several components may need the mask for the same agent in the same step,
+    such as an attack that checks the attack range and an observation that checks
+    the view range. The service memoizes the mask for each agent until the agent
+    moves or a blocking agent is placed in or removed from the grid. Because the
+    visibility is cast outward from the agent, the mask for a smaller range is the
+    center of the mask for a larger range, so smaller requests are cropped from
+    larger cached results. The mask is computed at the largest range that the
+    agent uses, which is the largest of its view and attack ranges and the ranges
+    requested for it before, so that every request can be cropped from it.
+
+    Args:
+        grid: The grid.
+    """
+    def __init__(self, grid):
+        self.grid = grid
+        self._cache = {}
+        self._ranges = {}
+
+    def get_mask(self, agent, mask_range):
+        """
+        Get the mask for an agent.
+
+        The mask is shared with the cache, so it is read-only.
+
+        Args:
+            agent: The agent of interest.
+            mask_range: The integer range from the agent of interest.
+
+        Returns:
+            The mask as in ``create_mask``.
+        """
+        position = tuple(agent.position)
+        entry = self._cache.get(agent.id)
+        if entry is not None and entry[0] == position and \
+                entry[1] == self.grid.blocker_version and entry[2] >= mask_range:
+            return _crop(entry[3], entry[2], mask_range)
+
+        max_range = self._max_range(agent, mask_range)
+        mask = create_mask(agent, self.grid, max_range)
+        mask.flags.writeable = False
+        self._cache[agent.id] = (position, self.grid.blocker_version, max_range, mask)
+        return _crop(mask, max_range, mask_range)
+
+    def _max_range(self, agent, mask_range):
+        """
+        Register the requested range and get the largest range that the agent uses.
+        """
+        max_range = max(
+            mask_range,
+            self._ranges.get(agent.id, 0),
+            getattr(agent, 'view_range', None) or 0,
+            getattr(agent, 'attack_range', None) or 0,
+        )
+        self._ranges[agent.id] = max_range
+        return max_range
+
+    def get_grid_and_mask(self, agent, mask_range):
+        """
+        Get the local grid and the mask for an agent.
+
+        Args:
+            agent: The agent of interest.
+            mask_range: The integer range from the agent of interest.
+
+        Returns:
+            The local grid and the mask as in ``create_grid_and_mask``.
+        """
+        return create_local_grid(agent, self.grid, mask_range), self.get_mask(agent, mask_range)
+
+    def clear(self):
+        """
+        Forget all the memoized masks.
+        """
+        self._cache.clear()
+
+
+def _crop(window, window_range, crop_range):
+    """
+    Crop the center of a (2 * window_range + 1) square window to crop_range.
+    """
+    offset = window_range - crop_range
+    return window[offset:offset + 2 * crop_range + 1, offset:offset + 2 * crop_range + 1]
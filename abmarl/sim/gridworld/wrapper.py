@@ -1,6 +1,9 @@
 
 from abc import abstractmethod
 
+from gym.spaces import Box
+import numpy as np
+
 from abmarl.sim.gridworld.actor import ActorBaseComponent
 from abmarl.sim.gridworld.observer import ObserverBaseComponent
 from abmarl.sim.gridworld.base import GridWorldBaseComponent
@@ -141,22 +144,230 @@ class ActorWrapper(ComponentWrapper, ActorBaseComponent):
             )
 
 
-# TODO Abmarl-202: Fill out the details of the abstract observer wrapper.
 class ObserverWrapper(ComponentWrapper, ObserverBaseComponent):
-    pass
+    """
+    Wraps an ObserverComponent.
+
+    Modify the observation space of the agents involved with the Observer, namely
+    the specific observer's channel. The observations from the wrapped observer
+    are in the unwrapped space, so we wrap them before sending them to the trainer.
+    This is the opposite from how we wrap and unwrap actions.
+    """
+    def __init__(self, component):
+        assert isinstance(component, ObserverBaseComponent), \
+            "Wrapped component must be an ObserverBaseComponent."
+        self._observer = component
+        # Need to record the pre-wrapped space for the wrapping functions.
+        self.from_space = {
+            agent.id: agent.observation_space[self.key]
+            for agent in self.agents.values()
+            if isinstance(agent, self.supported_agent_type)
+        }
+        for agent in self.agents.values():
+            if isinstance(agent, self.supported_agent_type):
+                assert self.check_space(agent.observation_space[self.key]), \
+                    f"Cannot wrap {self.key} observation channel for agent {agent.id}"
+                agent.observation_space[self.key] = self.wrap_space(
+                    agent.observation_space[self.key]
+                )
+
+    @property
+    def wrapped_component(self):
+        """
+        Get the wrapped observer.
+        """
+        return self._observer
+
+    @property
+    def key(self):
+        """
+        The key is the same as the wrapped observer's key.
+        """
+        return self.wrapped_component.key
+
+    @property
+    def supported_agent_type(self):
+        """
+        The supported agent type is the same as the wrapped observer's supported agent type.
+        """
+        return self.wrapped_component.supported_agent_type
+
+    @property
+    def reuse_buffers(self):
+        """
+        The buffers are reused if the wrapped observer reuses its buffers.
+        """
+        return self.wrapped_component.reuse_buffers
+
+    @reuse_buffers.setter
+    def reuse_buffers(self, value):
+        self.wrapped_component.reuse_buffers = value
+
+    @property
+    def _buffers(self):
+        return self.wrapped_component._buffers
+
+    def get_obs(self, agent, **kwargs):
+        """
+        Get the observation from the wrapped observer and wrap it.
+
+        Args:
+            agent: The observing agent.
+
+        Returns:
+            The observation as a dictionary. The observation in this channel is
+            in the wrapped space.
+        """
+        obs = self.wrapped_component.get_obs(agent, **kwargs)
+        if isinstance(agent, self.supported_agent_type):
+            obs = {self.key: self.wrap_point(self.from_space[agent.id], obs[self.key])}
+        return obs
+
+
+class PoolingObserverWrapper(ObserverWrapper):
+    """
+    Observe the far cells of a grid observation at a coarser resolution.
+
+    The cells within full_range of the observing agent keep their full resolution.
+    Farther out, the cells are grouped into blocks of pool_size cells along each
+    axis, starting from the full-resolution region, and each block is max-pooled
+    into a single cell. Blocks at the edge of the observation may be smaller.
+    The wrapper works with square observations whose first two axes are the rows
+    and columns of the grid, such as the SingleGridObserver's and MultiGridObserver's.
+
+    Args:
+        component: The observer to wrap.
+        full_range: The range from the agent within which the cells keep their
+            full resolution.
+        pool_size: The number of cells pooled together along each axis.
+    """
+    def __init__(self, component, full_range=1, pool_size=2):
+        assert type(full_range) is int and full_range >= 0, \
+            "Full range must be a nonnegative integer."
+        assert type(pool_size) is int and pool_size > 0, "Pool size must be a positive integer."
+        self.full_range = full_range
+        self.pool_size = pool_size
+        super().__init__(component)
 
+    def check_space(self, space):
+        """
+        Ensure that the space is an integer Box whose first two axes are an odd square.
+        """
+        return isinstance(space, Box) and len(space.shape) >= 2 and \
+            space.shape[0] == space.shape[1] and space.shape[0] % 2 == 1 and \
+            np.issubdtype(space.dtype, np.integer)
 
-# Docs for ObserverWrapper:
-"""
-Observer Wrappers
-~~~~~~~~~~~~~~~~~
+    def wrap_space(self, space):
+        """
+        Shrink the first two axes of the space to the number of pooled cells.
+        """
+        size = len(self._pool_starts(space.shape[0] // 2))
+        return Box(
+            space.low.min(), space.high.max(), (size, size) + space.shape[2:], space.dtype
+        )
 
-An Observer Wrapper uses the ``get_obs`` function, at which point
-it can request an observation by passing the request to the underlying Observer
-and then modify the data from the observer before sending it out. Observer Wrappers
-may need to modifiy the observation spaces of corresponding agents to ensure that
-the Trainer is expecting the correct format.
-"""
+    def wrap_point(self, space, point):
+        """
+        Max-pool the observation.
+
+        The point may be a stack of observations along leading axes, such as
+        the observations from get_obs_batch.
+        """
+        starts = self._pool_starts(space.shape[0] // 2)
+        axis = np.ndim(point) - len(space.shape)
+        point = np.maximum.reduceat(point, starts, axis=axis)
+        return np.maximum.reduceat(point, starts, axis=axis + 1)
+
+    def get_obs_batch(self, agents, **kwargs):
+        """
+        Get the stacked observations from the wrapped observer and pool them together.
+        """
+        obs = self.wrapped_component.get_obs_batch(agents, **kwargs)
+        return {self.key: self.wrap_point(self.from_space[agents[0].id], obs[self.key])}
+
+    def _pool_starts(self, view_range):
+        """
+        The index at which each pooled cell starts along an axis of the observation.
+        """
+        full_range = min(self.full_range, view_range)
+        lower = np.arange(
+            view_range - full_range - self.pool_size, -self.pool_size, -self.pool_size
+        )
+        upper = np.arange(view_range + full_range + 1, 2 * view_range + 1, self.pool_size)
+        return np.concatenate([
+            np.maximum(lower, 0)[::-1],
+            np.arange(view_range - full_range, view_range + full_range + 1),
+            upper
+        ])
+
+
+class DownsampleObserverWrapper(ObserverWrapper):
+    """
+    Crop a grid observation around the agent and keep every stride-th cell.
+
+    The observation is cropped to the cells within crop_range of the observing
+    agent, and then the cells whose offsets from the agent are multiples of the
+    stride are kept, so the agent's own cell is always kept. The wrapper works with
+    square observations whose first two axes are the rows and columns of the
+    grid, such as the SingleGridObserver's and MultiGridObserver's.
+
+    Args:
+        component: The observer to wrap.
+        crop_range: The range from the agent to which the observation is cropped.
+            Defaults to the agents' view range, which does not crop.
+        stride: The distance between the kept cells.
+    """
+    def __init__(self, component, crop_range=None, stride=1):
+        assert crop_range is None or (type(crop_range) is int and crop_range >= 0), \
+            "Crop range must be a nonnegative integer."
+        assert type(stride) is int and stride > 0, "Stride must be a positive integer."
+        self.crop_range = crop_range
+        self.stride = stride
+        super().__init__(component)
+
+    def check_space(self, space):
+        """
+        Ensure that the space is a Box whose first two axes are an odd square that
+        is at least as large as the crop.
+        """
+        return isinstance(space, Box) and len(space.shape) >= 2 and \
+            space.shape[0] == space.shape[1] and space.shape[0] % 2 == 1 and \
+            (self.crop_range is None or self.crop_range <= space.shape[0] // 2)
+
+    def wrap_space(self, space):
+        """
+        Shrink the first two axes of the space to the number of kept cells.
+        """
+        size = len(self._kept_indices(space.shape[0] // 2))
+        return Box(
+            space.low.min(), space.high.max(), (size, size) + space.shape[2:], space.dtype
+        )
+
+    def wrap_point(self, space, point):
+        """
+        Keep the cropped and strided cells of the observation.
+
+        The point may be a stack of observations along leading axes, such as
+        the observations from get_obs_batch.
+        """
+        indices = self._kept_indices(space.shape[0] // 2)
+        axis = np.ndim(point) - len(space.shape)
+        return np.take(np.take(point, indices, axis=axis), indices, axis=axis + 1)
+
+    def get_obs_batch(self, agents, **kwargs):
+        """
+        Get the stacked observations from the wrapped observer and downsample them together.
+        """
+        obs = self.wrapped_component.get_obs_batch(agents, **kwargs)
+        return {self.key: self.wrap_point(self.from_space[agents[0].id], obs[self.key])}
+
+    def _kept_indices(self, view_range):
+        """
+        The indices of the kept cells along an axis of the observation.
+        """
+        crop_range = view_range if self.crop_range is None else self.crop_range
+        offsets = np.arange(0, crop_range + 1, self.stride)
+        return view_range + np.concatenate([-offsets[:0:-1], offsets])
 
 
 class RavelActionWrapper(ActorWrapper):
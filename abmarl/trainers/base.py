@@ -1,5 +1,6 @@
 
 from abc import ABC, abstractmethod
+from copy import deepcopy
 
 from abmarl.policies.policy import Policy
 from abmarl.managers import SimulationManager
@@ -109,10 +110,11 @@ class MultiPolicyTrainer(ABC):
         for policy in self.policies.values():
             policy.reset()
 
-        # Data collection
+        # Data collection. The observations are copied in case the simulation
+        # reuses its observation buffers from step to step.
         observations, actions, rewards = {}, {}, {}
         for agent_id, agent_obs in obs.items():
-            observations[agent_id] = [agent_obs]
+            observations[agent_id] = [deepcopy(agent_obs)]
 
         # Generate episode of data
         for j in range(horizon):
@@ -122,9 +124,9 @@ class MultiPolicyTrainer(ABC):
             # Store the data
             for agent_id, agent_obs in obs.items():
                 try:
-                    observations[agent_id].append(agent_obs)
+                    observations[agent_id].append(deepcopy(agent_obs))
                 except KeyError:
-                    observations[agent_id] = [agent_obs]
+                    observations[agent_id] = [deepcopy(agent_obs)]
             for agent_id, agent_reward in reward.items():
                 try:
                     rewards[agent_id].append(agent_reward)
@@ -15,14 +15,9 @@ object_registry = {
         id='target',
         encoding=3,
         render_color='green'
-    ),
-    'W': lambda n: GridWorldAgent(
-        id=f'wall{n}',
-        encoding=2,
-        blocking=True,
-        render_shape='s'
     )
 }
+terrain_registry = {'W': 2}
 
 file_name = 'maze.txt'
 sim = MultiAgentWrapper(
@@ -30,6 +25,8 @@ sim = MultiAgentWrapper(
         MazeNaviationSim.build_sim_from_file(
             file_name,
             object_registry,
+            terrain_registry=terrain_registry,
+            terrain_blocking=[2],
             overlapping={1: [3], 3: [1]}
         )
     )
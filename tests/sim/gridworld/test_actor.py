@@ -11,6 +11,10 @@ from abmarl.sim.gridworld.grid import Grid
 from .helpers import grid
 
 
+class HealthAttackingAgent(HealthAgent, AttackingAgent):
+    pass
+
+
 def test_move_actor():
     agents = {
         'agent0': MovingAgent(
@@ -118,6 +122,101 @@ def test_move_actor_with_overlap():
     np.testing.assert_array_equal(agents['agent3'].position, np.array([2, 2]))
 
 
+def test_move_actor_process_moves():
+    def build(move_resolution):
+        agents = {
+            'agent0': MovingAgent(
+                id='agent0', initial_position=np.array([0, 0]), encoding=1, move_range=1
+            ),
+            'agent1': MovingAgent(
+                id='agent1', initial_position=np.array([0, 1]), encoding=1, move_range=1
+            ),
+            'agent2': MovingAgent(
+                id='agent2', initial_position=np.array([2, 0]), encoding=2, move_range=1
+            ),
+            'agent3': MovingAgent(
+                id='agent3', initial_position=np.array([2, 2]), encoding=2, move_range=1
+            ),
+            'agent4': MovingAgent(
+                id='agent4', initial_position=np.array([4, 0]), encoding=3, move_range=1
+            ),
+            'agent5': MovingAgent(
+                id='agent5', initial_position=np.array([4, 2]), encoding=3, move_range=1
+            ),
+        }
+        grid = Grid(5, 6, overlapping={3: [3]})
+        position_state = PositionState(grid=grid, agents=agents)
+        move_actor = MoveActor(grid=grid, agents=agents, move_resolution=move_resolution)
+        position_state.reset()
+        return agents, move_actor
+
+    moves = np.array([
+        [0, 1], # agent0 follows agent1
+        [0, 1], # agent1 moves into an empty cell
+        [0, 1], # agent2 and agent3 collide
+        [0, -1],
+        [0, 1], # agent4 and agent5 collide but can overlap
+        [0, -1],
+    ])
+
+    agents, move_actor = build('sequential')
+    assert move_actor.move_resolution == 'sequential'
+    success = move_actor.process_moves(list(agents.values()), moves)
+    np.testing.assert_array_equal(success, [False, True, True, False, True, True])
+    np.testing.assert_array_equal(agents['agent0'].position, [0, 0])
+    np.testing.assert_array_equal(agents['agent1'].position, [0, 2])
+    np.testing.assert_array_equal(agents['agent2'].position, [2, 1])
+    np.testing.assert_array_equal(agents['agent3'].position, [2, 2])
+    np.testing.assert_array_equal(agents['agent4'].position, [4, 1])
+    np.testing.assert_array_equal(agents['agent5'].position, [4, 1])
+
+    # Sequential resolution depends on the order of the agents.
+    agents, move_actor = build('sequential')
+    success = move_actor.process_moves(list(agents.values())[::-1], moves[::-1])
+    np.testing.assert_array_equal(success, [True, True, True, False, True, True])
+    np.testing.assert_array_equal(agents['agent0'].position, [0, 1])
+    np.testing.assert_array_equal(agents['agent2'].position, [2, 0])
+    np.testing.assert_array_equal(agents['agent3'].position, [2, 1])
+
+    agents, move_actor = build('simultaneous')
+    success = move_actor.process_moves(list(agents.values()), moves)
+    np.testing.assert_array_equal(success, [False, True, False, False, True, True])
+    np.testing.assert_array_equal(agents['agent0'].position, [0, 0])
+    np.testing.assert_array_equal(agents['agent1'].position, [0, 2])
+    np.testing.assert_array_equal(agents['agent2'].position, [2, 0])
+    np.testing.assert_array_equal(agents['agent3'].position, [2, 2])
+    np.testing.assert_array_equal(agents['agent4'].position, [4, 1])
+    np.testing.assert_array_equal(agents['agent5'].position, [4, 1])
+    grid = move_actor.grid
+    assert grid[0, 0] == {'agent0': agents['agent0']}
+    assert grid[0, 2] == {'agent1': agents['agent1']}
+    assert not grid[0, 1]
+    assert grid[4, 1] == {'agent4': agents['agent4'], 'agent5': agents['agent5']}
+
+    # Moving out of bounds fails and staying succeeds.
+    success = move_actor.process_moves(
+        [agents['agent4'], agents['agent1'], agents['agent2'], agents['agent3']],
+        np.array([[1, 0], [0, -1], [0, 0], [0, -1]])
+    )
+    np.testing.assert_array_equal(success, [False, True, True, True])
+    np.testing.assert_array_equal(agents['agent1'].position, [0, 1])
+    np.testing.assert_array_equal(agents['agent3'].position, [2, 1])
+
+    # Swapping is rejected.
+    success = move_actor.process_moves(
+        [agents['agent2'], agents['agent3']], np.array([[0, 1], [0, -1]])
+    )
+    np.testing.assert_array_equal(success, [False, False])
+
+    assert move_actor.process_actions({
+        'agent0': {'move': np.array([1, 0])}, 'agent1': {'move': np.array([-1, 0])}
+    }) == {'agent0': True, 'agent1': False}
+    np.testing.assert_array_equal(agents['agent0'].position, [1, 0])
+
+    with pytest.raises(AssertionError):
+        MoveActor(grid=grid, agents=agents, move_resolution='random')
+
+
 def test_attack_actor():
     agents = {
         'agent0': HealthAgent(id='agent0', initial_position=np.array([4, 4]), encoding=1),
@@ -184,3 +283,175 @@ def test_attack_actor_attack_mapping():
 
     with pytest.raises(AssertionError):
         AttackActor(agents=agents, grid=grid, attack_mapping={1: ['2', 3], 2: [2, 3]})
+
+
+def test_attack_actor_process_actions():
+    np.random.seed(24)
+    agents = {
+        'agent0': HealthAgent(
+            id='agent0', initial_position=np.array([4, 4]), encoding=1, initial_health=1
+        ),
+        'agent1': HealthAttackingAgent(
+            id='agent1',
+            initial_position=np.array([2, 2]),
+            encoding=1,
+            attack_range=1,
+            attack_strength=1,
+            attack_accuracy=1,
+            initial_health=1
+        ),
+        'agent2': HealthAttackingAgent(
+            id='agent2',
+            initial_position=np.array([2, 3]),
+            encoding=2,
+            attack_range=2,
+            attack_strength=0.5,
+            attack_accuracy=1,
+            initial_health=1
+        ),
+        'agent3': HealthAttackingAgent(
+            id='agent3',
+            initial_position=np.array([3, 4]),
+            encoding=2,
+            attack_range=1,
+            attack_strength=0.5,
+            attack_accuracy=1,
+            initial_health=1
+        ),
+        'agent4': HealthAttackingAgent(
+            id='agent4',
+            initial_position=np.array([0, 0]),
+            encoding=1,
+            attack_range=1,
+            attack_strength=1,
+            attack_accuracy=1,
+            initial_health=1
+        ),
+    }
+    grid = Grid(5, 6)
+    position_state = PositionState(grid=grid, agents=agents)
+    health_state = HealthState(grid=grid, agents=agents)
+    attack_actor = AttackActor(attack_mapping={1: [2], 2: [1]}, grid=grid, agents=agents)
+    assert attack_actor.attack_matrix[1, 2]
+    assert attack_actor.attack_matrix[2, 1]
+    assert not attack_actor.attack_matrix[1, 1]
+    assert not attack_actor.attack_matrix[2, 2]
+
+    position_state.reset()
+    health_state.reset()
+    attacked_agents = attack_actor.process_actions({
+        'agent0': {},
+        'agent1': {'attack': 1},
+        'agent2': {'attack': 1},
+        'agent3': {'attack': 1},
+        'agent4': {'attack': 0},
+    })
+    # agent1 kills agent2, but agent2 still attacks because the attacks are simultaneous.
+    assert attacked_agents['agent0'] is None
+    assert attacked_agents['agent1'] == agents['agent2']
+    assert attacked_agents['agent2'] in [agents['agent1'], agents['agent0']]
+    assert attacked_agents['agent3'] == agents['agent0']
+    assert attacked_agents['agent4'] is None
+    assert not agents['agent2'].active
+    assert not grid[2, 3]
+    assert agents['agent3'].active
+    assert agents['agent4'].active
+    if attacked_agents['agent2'] == agents['agent0']:
+        # agent0's damage from agent2 and agent3 is applied together.
+        assert not agents['agent0'].active
+        assert not grid[4, 4]
+        assert agents['agent1'].health == 1
+    else:
+        assert agents['agent0'].health == 0.5
+        assert agents['agent1'].health == 0.5
+
+    # Inactive agents do not attack, and agents out of range cannot be attacked.
+    attacked_agents = attack_actor.process_actions({
+        'agent2': {'attack': 1}, 'agent4': {'attack': 1}
+    })
+    assert attacked_agents == {'agent2': None, 'agent4': None}
+
+
+def test_attack_actor_process_actions_accuracy():
+    np.random.seed(24)
+    agents = {
+        'agent0': HealthAgent(id='agent0', initial_position=np.array([2, 2]), encoding=1),
+        'agent1': HealthAgent(id='agent1', initial_position=np.array([2, 4]), encoding=1),
+        'agent2': HealthAttackingAgent(
+            id='agent2',
+            initial_position=np.array([2, 3]),
+            encoding=2,
+            attack_range=1,
+            attack_strength=0,
+            attack_accuracy=0.5
+        ),
+        'agent3': HealthAttackingAgent(
+            id='agent3',
+            initial_position=np.array([1, 3]),
+            encoding=2,
+            attack_range=1,
+            attack_strength=0,
+            attack_accuracy=0
+        ),
+    }
+    grid = Grid(5, 6)
+    position_state = PositionState(grid=grid, agents=agents)
+    health_state = HealthState(grid=grid, agents=agents)
+    attack_actor = AttackActor(attack_mapping={2: [1]}, grid=grid, agents=agents)
+    position_state.reset()
+    health_state.reset()
+
+    attacks = {'agent0': 0, 'agent1': 0, None: 0}
+    for _ in range(400):
+        attacked_agents = attack_actor.process_actions({
+            'agent2': {'attack': 1}, 'agent3': {'attack': 1}
+        })
+        assert attacked_agents['agent3'] is None
+        attacked_agent = attacked_agents['agent2']
+        attacks[None if attacked_agent is None else attacked_agent.id] += 1
+    # The attack misses both candidates a quarter of the time.
+    assert 60 < attacks[None] < 140
+    assert 110 < attacks['agent0'] < 190
+    assert 110 < attacks['agent1'] < 190
+
+
+def test_attack_actor_encoding_not_in_attack_mapping():
+    agents = {
+        'agent0': HealthAttackingAgent(
+            id='agent0',
+            initial_position=np.array([0, 0]),
+            encoding=1,
+            attack_range=1,
+            attack_strength=1,
+            attack_accuracy=1
+        ),
+        'agent1': HealthAttackingAgent(
+            id='agent1',
+            initial_position=np.array([0, 1]),
+            encoding=3,
+            attack_range=1,
+            attack_strength=1,
+            attack_accuracy=1
+        ),
+    }
+    grid = Grid(2, 2)
+    position_state = PositionState(grid=grid, agents=agents)
+    health_state = HealthState(grid=grid, agents=agents)
+    attack_actor = AttackActor(attack_mapping={1: [3]}, grid=grid, agents=agents)
+    position_state.reset()
+    health_state.reset()
+
+    # agent1's encoding is not in the attack mapping, so it cannot attack.
+    assert attack_actor.process_action(agents['agent1'], {'attack': 1}) is None
+    attacked_agents = attack_actor.process_actions({
+        'agent0': {'attack': 0}, 'agent1': {'attack': 1}
+    })
+    assert attacked_agents['agent1'] is None
+    assert agents['agent0'].active
+
+    attacked_agents = attack_actor.process_actions({
+        'agent0': {'attack': 1}, 'agent1': {'attack': 1}
+    })
+    assert attacked_agents['agent0'] is agents['agent1']
+    assert attacked_agents['agent1'] is None
+    assert not agents['agent1'].active
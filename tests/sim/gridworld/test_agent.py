@@ -1,9 +1,15 @@
 
+import copy
+import pickle
+import timeit
+
 import numpy as np
 import pytest
 
 from abmarl.sim.gridworld.agent import GridWorldAgent, GridObservingAgent, MovingAgent, \
-    HealthAgent, AttackingAgent
+    HealthAgent, AttackingAgent, AgentStore
+from abmarl.sim.gridworld.grid import Grid
+from abmarl.sim.gridworld.state import PositionState
 from abmarl.sim import PrincipleAgent, ActingAgent, ObservingAgent
 
 
@@ -18,6 +24,7 @@ def test_grid_world_agent():
     assert agent.id == 'agent'
     np.testing.assert_array_equal(agent.initial_position, np.array([2, 2]))
     assert agent.blocking
+    assert not agent.static
     assert agent.encoding == 4
     assert agent.render_shape == 'o'
     assert agent.render_color == 'gray'
@@ -45,6 +52,14 @@ def test_grid_world_agent():
             encoding=0
         )
 
+    # Static
+    with pytest.raises(AssertionError):
+        agent = GridWorldAgent(
+            id='agent',
+            encoding=1,
+            static=1
+        )
+
     # Initial position
     with pytest.raises(AssertionError):
         agent = GridWorldAgent(
@@ -172,3 +187,195 @@ def test_attacking_agent():
             attack_strength=0.6,
             attack_accuracy=-0.3
         )
+
+
+def test_agent_store():
+    agents = {
+        'agent0': HealthAgent(id='agent0', encoding=1, initial_health=0.5),
+        'agent1': GridWorldAgent(id='agent1', encoding=2, blocking=True),
+        'agent2': HealthAgent(id='agent2', encoding=3),
+    }
+    agents['agent0'].health = 0.5
+    agents['agent1'].position = np.array([1, 2])
+    store = AgentStore(agents)
+    assert len(store) == 3
+    assert store.ids == ['agent0', 'agent1', 'agent2']
+    assert store.index('agent1') == 1
+
+    # The agents' state moved into the store
+    np.testing.assert_array_equal(store.encodings, [1, 2, 3])
+    np.testing.assert_array_equal(store.blocking, [False, True, False])
+    np.testing.assert_array_equal(store.positioned, [False, True, False])
+    np.testing.assert_array_equal(store.positions[1], [1, 2])
+    np.testing.assert_array_equal(store.health, [0.5, np.nan, np.nan])
+    np.testing.assert_array_equal(store.active, [True, True, False])
+    assert agents['agent0'].position is None
+    assert agents['agent2'].health is None
+
+    # The agents' properties read and write the store, with the same types as before.
+    assert type(agents['agent1'].encoding) is int
+    assert type(agents['agent1'].blocking) is bool
+    assert type(agents['agent0'].health) is float
+    agents['agent0'].position = np.array([3, 4])
+    agents['agent2'].health = 2
+    agents['agent0'].health = -1
+    np.testing.assert_array_equal(store.positions[0], [3, 4])
+    np.testing.assert_array_equal(store.health, [0, np.nan, 1])
+    np.testing.assert_array_equal(store.active, [False, True, True])
+    assert not agents['agent0'].active
+    assert agents['agent2'].health == 1
+    with pytest.raises(AssertionError):
+        agents['agent1'].encoding = 0
+    with pytest.raises(AssertionError):
+        agents['agent0'].health = '1'
+
+    # The store's arrays are read-only mirrors of the agents' values
+    agents['agent0'].position = None
+    assert not store.positioned[0]
+    agents['agent0'].position = np.array([3, 4])
+    with pytest.raises(ValueError):
+        store.health[0] = 1
+
+    # The grid binds its agents to its own store
+    grid = Grid(5, 5, agents=agents)
+    assert grid.agent_store is not store
+    grid.reset()
+    assert grid.place(agents['agent2'], (0, 1))
+    np.testing.assert_array_equal(grid.agent_store.positions[2], [0, 1])
+    np.testing.assert_array_equal(grid.agent_store.positions[0], [3, 4])
+    np.testing.assert_array_equal(grid.agent_store.health, [0, np.nan, 1])
+    assert Grid(5, 5).agent_store is None
+
+
+
+
+def test_agent_store_property_cost():
+    # Unbound agents run the plain attribute properties, which are the baseline cost.
+    unbound = HealthAgent(id='unbound', encoding=1)
+    bound = HealthAgent(id='bound', encoding=1)
+    AgentStore({'bound': bound})
+    for agent in [unbound, bound]:
+        agent.health = 1
+        agent.position = np.array([1, 2])
+
+    def cost(statement, agent):
+        return min(timeit.repeat(statement, globals={'agent': agent}, number=20000, repeat=5))
+
+    for statement in ['agent.health', 'agent.position', 'agent.encoding', 'agent.active']:
+        assert cost(statement, bound) < 1.5 * cost(statement, unbound), statement
+    assert cost('agent.health = 0.5', bound) < 2 * cost('agent.health = 0.5', unbound)
+
+
+def test_agent_store_pickle():
+    agents = {
+        'agent0': HealthAgent(id='agent0', encoding=1, initial_position=np.array([0, 1])),
+        'agent1': HealthAgent(id='agent1', encoding=2, initial_position=np.array([2, 2])),
+    }
+    grid = Grid(3, 3, agents=agents)
+    position_state = PositionState(agents=agents, grid=grid)
+    position_state.reset()
+
+    for copied in [pickle.loads(pickle.dumps((agents, grid, position_state))),
+                   copy.deepcopy((agents, grid, position_state))]:
+        copied_agents, copied_grid, copied_state = copied
+        assert copied_agents['agent0']._store is copied_grid.agent_store
+        copied_state.reset()
+        np.testing.assert_array_equal(copied_agents['agent0'].position, [0, 1])
+        np.testing.assert_array_equal(copied_agents['agent1'].position, [2, 2])
+        copied_grid.remove(copied_agents['agent0'], (0, 1))
+        assert copied_grid.place(copied_agents['agent0'], (1, 1))
+        np.testing.assert_array_equal(copied_agents['agent0'].position, [1, 1])
+        np.testing.assert_array_equal(copied_grid.agent_store.positions[0], [1, 1])
+
+    # The original agents are unaffected
+    np.testing.assert_array_equal(agents['agent0'].position, [0, 1])
+
+
+def test_agent_store_active_counts():
+    agents = {
+        'agent0': HealthAgent(id='agent0', encoding=1, initial_health=1),
+        'agent1': HealthAgent(id='agent1', encoding=1, initial_health=1),
+        'agent2': HealthAgent(id='agent2', encoding=2, initial_health=1),
+        'agent3': GridWorldAgent(id='agent3', encoding=3),
+    }
+    store = AgentStore(agents)
+    # HealthAgents without health are inactive
+    assert store.active_count == 1
+    np.testing.assert_array_equal(store.active_counts, [0, 0, 0, 1])
+    assert store.active_encoding_count == 1
+
+    for agent in ['agent0', 'agent1', 'agent2']:
+        agents[agent].health = 1
+    assert store.active_count == 4
+    np.testing.assert_array_equal(store.active_counts, [0, 2, 1, 1])
+    assert store.active_encoding_count == 3
+
+    # Only changes in activity change the counts
+    agents['agent0'].health = 0.5
+    agents['agent2'].health = 0
+    agents['agent2'].health = 0
+    assert store.active_count == 3
+    np.testing.assert_array_equal(store.active_counts, [0, 2, 0, 1])
+    assert store.active_encoding_count == 2
+
+    # Changing the encoding of an active agent moves its count
+    agents['agent1'].encoding = 5
+    np.testing.assert_array_equal(store.active_counts, [0, 1, 0, 1, 0, 1])
+    agents['agent2'].encoding = 1
+    np.testing.assert_array_equal(store.active_counts, [0, 1, 0, 1, 0, 1])
+    assert store.active_encoding_count == 3
+    np.testing.assert_array_equal(
+        store.active_counts, np.bincount(store.encodings[store.active], minlength=6)
+    )
+
+    # Moving an agent to another store releases it from this one
+    assert store.complete
+    other_store = AgentStore({'agent0': agents['agent0']})
+    assert not store.complete
+    assert store.active_count == 2
+    assert other_store.active_count == 1
+    agents['agent0'].health = 0
+    assert store.active_count == 2
+    assert other_store.active_count == 0
+
+
+def test_agent_store_validation():
+    agents = {
+        'agent0': HealthAgent(id='agent0', encoding=1, initial_health=1),
+        'agent1': HealthAgent(id='agent1', encoding=2, initial_health=1),
+    }
+    store = AgentStore(agents)
+    assert store.validation == 'full'
+    with pytest.raises(AssertionError):
+        store.validation = 'none'
+
+    # Full validation checks every write, including while stepping
+    with store.stepping():
+        assert store.validating
+        with pytest.raises(AssertionError):
+            agents['agent0'].health = '1'
+
+    # Trusted validation skips the checks only while stepping
+    store.validation = 'trusted'
+    with pytest.raises(AssertionError):
+        agents['agent0'].health = '1'
+    with store.stepping():
+        assert not store.validating
+        with store.stepping():
+            assert not store.validating
+        assert not store.validating
+        agents['agent0'].health = np.float64(0.5)
+        agents['agent1'].blocking = np.bool_(True)
+    assert store.validating
+    assert agents['agent0'].health == 0.5
+    assert agents['agent1'].blocking
+
+    # Debug validation checks the store after stepping
+    store.validation = 'debug'
+    with store.stepping():
+        agents['agent0'].health = 0
+    store.check()
+    store._active_count = 5
+    with pytest.raises(AssertionError):
+        with store.stepping():
+            pass
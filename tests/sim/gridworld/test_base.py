@@ -0,0 +1,122 @@
+
+import numpy as np
+import pytest
+
+from abmarl.sim.gridworld.base import GridWorldSimulation
+from abmarl.sim.gridworld.agent import HealthAgent
+from abmarl.sim.gridworld.state import HealthState
+
+
+class HealthSim(GridWorldSimulation):
+    """
+    Simulation whose step sets the agents' health directly.
+    """
+    def __init__(self, **kwargs):
+        self.agents = kwargs['agents']
+        self.health_state = HealthState(**kwargs)
+
+    def reset(self, **kwargs):
+        self.health_state.reset(**kwargs)
+
+    def step(self, action_dict, **kwargs):
+        with self.stepping():
+            for agent_id, health in action_dict.items():
+                self.agents[agent_id].health = health
+
+    def get_obs(self, agent_id, **kwargs):
+        return {}
+
+    def get_reward(self, agent_id, **kwargs):
+        return 0
+
+    def get_done(self, agent_id, **kwargs):
+        return not self.agents[agent_id].active
+
+    def get_all_done(self, **kwargs):
+        return False
+
+    def get_info(self, agent_id, **kwargs):
+        return {}
+
+
+def _build(validation=None):
+    agents = {
+        'agent0': HealthAgent(id='agent0', encoding=1),
+        'agent1': HealthAgent(id='agent1', encoding=2),
+    }
+    if validation is None:
+        sim = HealthSim.build_sim(2, 2, agents=agents)
+    else:
+        sim = HealthSim.build_sim(2, 2, agents=agents, validation=validation)
+    sim.reset()
+    return sim
+
+
+def test_build_sim_validation_full():
+    sim = _build()
+    assert sim.validation == 'full'
+    with pytest.raises(AssertionError):
+        sim.step({'agent0': np.float64(0.5)})
+
+
+def test_build_sim_validation_trusted():
+    sim = _build('trusted')
+    assert sim.validation == 'trusted'
+    sim.step({'agent0': np.float64(0.5), 'agent1': np.float64(0)})
+    assert sim.agents['agent0'].health == 0.5
+    assert not sim.agents['agent1'].active
+    assert sim._agent_store.active_count == 1
+
+    # Writes outside of step are still validated
+    assert sim._agent_store.validating
+    with pytest.raises(AssertionError):
+        sim.agents['agent0'].health = np.float64(0.5)
+    sim.reset()
+    assert sim._agent_store.active_count == 2
+
+
+def test_build_sim_validation_debug():
+    sim = _build('debug')
+    assert sim.validation == 'debug'
+    sim.step({'agent0': 0.5})
+    with pytest.raises(AssertionError):
+        sim.step({'agent0': np.float64(0.5)})
+
+    # The store is checked after the step
+    sim._agent_store._active_count = 0
+    with pytest.raises(AssertionError):
+        sim.step({})
+
+    with pytest.raises(AssertionError):
+        _build('none')
+
+
+class UnwrappedHealthSim(HealthSim):
+    """
+    Simulation whose step does not enter the stepping context.
+    """
+    def reset(self, **kwargs):
+        self.health_state.grid.reset()
+        super().reset(**kwargs)
+
+    def step(self, action_dict, **kwargs):
+        for agent_id, health in action_dict.items():
+            self.agents[agent_id].health = health
+
+
+def test_build_sim_validation_without_stepping_warns():
+    agents = {
+        'agent0': HealthAgent(id='agent0', encoding=1),
+        'agent1': HealthAgent(id='agent1', encoding=2),
+    }
+    sim = UnwrappedHealthSim.build_sim(2, 2, agents=agents, validation='trusted')
+    sim.reset()
+    sim.step({'agent0': 0.5})
+    with pytest.warns(UserWarning):
+        sim.reset()
+
+    sim = HealthSim.build_sim(2, 2, agents=agents, validation='trusted')
+    sim.reset()
+    sim.step({'agent0': 0.5})
+    sim.health_state.grid.reset()
+    sim.reset()
@@ -1,7 +1,7 @@
 
 from abmarl.sim.gridworld.agent import HealthAgent
 from abmarl.sim.gridworld.state import HealthState
-from abmarl.sim.gridworld.done import ActiveDone, DoneBaseComponent
+from abmarl.sim.gridworld.done import ActiveDone, DoneBaseComponent, OneTeamRemainingDone
 from abmarl.sim.gridworld.grid import Grid
 
 
@@ -37,3 +37,45 @@ def test_active_done():
     agents['agent2'].health = 0
     assert active_done.get_done(agents['agent2'])
     assert active_done.get_all_done()
+
+
+def test_done_with_agent_store():
+    agents = {
+        'agent0': HealthAgent(id='agent0', encoding=1),
+        'agent1': HealthAgent(id='agent1', encoding=1),
+        'agent2': HealthAgent(id='agent2', encoding=2),
+    }
+    grid = Grid(2, 3, agents=agents)
+    health_state = HealthState(agents=agents, grid=grid)
+    health_state.reset()
+
+    active_done = ActiveDone(agents=agents, grid=grid)
+    team_done = OneTeamRemainingDone(agents=agents, grid=grid)
+    assert active_done._counting_store() is grid.agent_store
+    assert team_done._counting_store() is grid.agent_store
+    assert not active_done.get_all_done()
+    assert not team_done.get_all_done()
+
+    agents['agent2'].health = 0
+    assert active_done.get_done(agents['agent2'])
+    assert not active_done.get_all_done()
+    assert team_done.get_all_done()
+
+    agents['agent0'].health = 0
+    assert not active_done.get_all_done()
+    assert team_done.get_all_done()
+
+    agents['agent1'].health = 0
+    assert active_done.get_all_done()
+    assert team_done.get_all_done()
+
+    health_state.reset()
+    assert not active_done.get_all_done()
+    assert not team_done.get_all_done()
+
+    # Components that only see some of the agents loop over them
+    partial_done = ActiveDone(agents={'agent0': agents['agent0']}, grid=grid)
+    assert partial_done._counting_store() is None
+    agents['agent0'].health = 0
+    assert partial_done.get_all_done()
+    assert not active_done.get_all_done()
@@ -1,9 +1,13 @@
 
+import pickle
+
 import numpy as np
 import pytest
 
-from abmarl.sim.gridworld.grid import Grid
-from abmarl.sim.gridworld.agent import GridWorldAgent
+from abmarl.sim.gridworld.grid import Grid, SparseGrid
+from abmarl.sim.gridworld.agent import GridWorldAgent, GridObservingAgent, HealthAgent
+from abmarl.sim.gridworld.state import PositionState
+from abmarl.sim.gridworld.observer import SingleGridObserver, MultiGridObserver
 
 
 def test_grid_rows():
@@ -131,3 +135,533 @@ def test_grid_remove():
 
     with pytest.raises(KeyError):
         grid.remove(agent1, (1, 0))
+
+
+def test_grid_occupancy_arrays():
+    agents = {
+        'agent1': GridWorldAgent(id='agent1', encoding=1),
+        'agent2': GridWorldAgent(id='agent2', encoding=3),
+        'agent3': GridWorldAgent(id='agent3', encoding=3),
+    }
+    grid = Grid(3, 3, overlapping={1: [3], 3: [1, 3]}, agents=agents)
+    grid.reset()
+    assert grid.encoding_counts.shape == (3, 3, 3)
+    assert grid.occupancy.shape == (3, 3)
+    np.testing.assert_array_equal(grid.occupancy, np.zeros((3, 3)))
+
+    assert grid.place(agents['agent1'], (1, 0))
+    assert grid.place(agents['agent2'], (1, 0))
+    assert grid.place(agents['agent3'], (2, 2))
+    np.testing.assert_array_equal(
+        grid.occupancy,
+        np.array([
+            [0, 0, 0],
+            [2, 0, 0],
+            [0, 0, 1]
+        ])
+    )
+    np.testing.assert_array_equal(grid.encoding_counts[1, 0], np.array([1, 0, 1]))
+    np.testing.assert_array_equal(grid.encoding_counts[2, 2], np.array([0, 0, 1]))
+
+    grid.remove(agents['agent2'], (1, 0))
+    np.testing.assert_array_equal(grid.encoding_counts[1, 0], np.array([1, 0, 0]))
+    assert grid.occupancy[1, 0] == 1
+
+    with pytest.raises(ValueError):
+        grid.occupancy[0, 0] = 1
+    with pytest.raises(ValueError):
+        grid.encoding_counts[0, 0, 0] = 1
+
+    grid.reset()
+    np.testing.assert_array_equal(grid.occupancy, np.zeros((3, 3)))
+    np.testing.assert_array_equal(grid.encoding_counts, np.zeros((3, 3, 3)))
+
+
+def test_grid_encoding_counts_grow():
+    grid = Grid(2, 2)
+    grid.reset()
+    assert grid.encoding_counts.shape == (2, 2, 0)
+    agent = GridWorldAgent(id='agent0', encoding=4)
+    assert grid.place(agent, (0, 1))
+    assert grid.encoding_counts.shape == (2, 2, 4)
+    np.testing.assert_array_equal(grid.encoding_counts[0, 1], np.array([0, 0, 0, 1]))
+
+
+def test_grid_overlap_matrix():
+    grid = Grid(3, 3, overlapping={1: [2], 2: [1, 3], 3: [2, 3]})
+    np.testing.assert_array_equal(
+        grid.overlap_matrix,
+        np.array([
+            [False, False, False, False],
+            [False, False,  True, False],
+            [False,  True, False,  True],
+            [False, False,  True,  True],
+        ])
+    )
+    with pytest.raises(ValueError):
+        grid.overlap_matrix[1, 1] = True
+
+
+def test_grid_query_with_cell_masks():
+    grid = Grid(3, 3, overlapping={1: [2], 2: [1, 3], 3: [2, 3]})
+    grid.reset()
+    agent1 = GridWorldAgent(id='agent1', encoding=1)
+    agent2 = GridWorldAgent(id='agent2', encoding=2)
+    agent3 = GridWorldAgent(id='agent3', encoding=3)
+    agent4 = GridWorldAgent(id='agent4', encoding=3)
+    agent5 = GridWorldAgent(id='agent5', encoding=5)
+    assert grid.place(agent2, (1, 1))
+    assert grid.query(agent1, (1, 1))
+    assert grid.query(agent3, (1, 1))
+    assert grid.place(agent3, (1, 1))
+    assert not grid.query(agent1, (1, 1))
+    assert grid.query(agent4, (1, 1))
+    assert not grid.query(agent5, (1, 1))
+
+    grid.remove(agent3, (1, 1))
+    assert grid.query(agent1, (1, 1))
+    grid.remove(agent2, (1, 1))
+    assert grid.query(agent5, (1, 1))
+    assert grid.place(agent5, (1, 1))
+    assert not grid.query(agent2, (1, 1))
+
+    # Inactive agents do not block the cell
+    agent5._active = False
+    assert grid.query(agent2, (1, 1))
+
+
+def test_grid_cell_masks_track_activity():
+    for grid_class in [Grid, SparseGrid]:
+        agents = {
+            'agent0': HealthAgent(id='agent0', encoding=1, initial_health=1),
+            'agent1': HealthAgent(id='agent1', encoding=1, initial_health=1),
+            'agent2': HealthAgent(id='agent2', encoding=2, initial_health=1),
+        }
+        grid = grid_class(3, 3, agents=agents, overlapping={1: [1]})
+        grid.reset()
+        for agent in agents.values():
+            agent.health = agent.initial_health
+        assert grid.place(agents['agent0'], (1, 1))
+        assert grid.place(agents['agent1'], (1, 1))
+        assert not grid.query(agents['agent2'], (1, 1))
+
+        # The cell mask keeps the encoding while any agent with it is active.
+        agents['agent0'].health = 0
+        assert grid._cell_masks[1, 1] == 1 << 1
+        assert not grid.query(agents['agent2'], (1, 1))
+
+        # Inactive agents are cleared from the mask, so the mask alone decides.
+        agents['agent1'].health = 0
+        assert grid._cell_masks[1, 1] == 0
+        assert not grid._untracked_count
+        assert grid.query(agents['agent2'], (1, 1))
+
+        agents['agent1'].health = 1
+        assert not grid.query(agents['agent2'], (1, 1))
+        grid.remove(agents['agent1'], (1, 1))
+        assert grid._cell_masks[1, 1] == 0
+        assert grid.place(agents['agent2'], (1, 1))
+
+        # Agents outside the Grid's AgentStore are checked agent by agent.
+        other = GridWorldAgent(id='other', encoding=3)
+        assert grid.place(other, (0, 0))
+        assert grid._untracked_count == 1
+        assert not grid.query(agents['agent0'], (0, 0))
+        other._active = False
+        assert grid.query(agents['agent0'], (0, 0))
+        grid.remove(other, (0, 0))
+        assert not grid._untracked_count
+
+
+def test_sparse_grid_place_query_remove():
+    grid = SparseGrid(1000, 2000, overlapping={1: [2], 2: [1]})
+    assert grid.rows == 1000
+    assert grid.cols == 2000
+    grid.reset()
+    assert grid[500, 1500] == {}
+    agent1 = GridWorldAgent(id='agent1', encoding=1)
+    agent2 = GridWorldAgent(id='agent2', encoding=2)
+    agent3 = GridWorldAgent(id='agent3', encoding=2)
+    assert grid.place(agent1, (500, 1500))
+    assert grid.place(agent2, (500, 1500))
+    assert not grid.place(agent3, (500, 1500))
+    assert grid.place(agent3, (999, 1999))
+    np.testing.assert_array_equal(agent3.position, np.array([999, 1999]))
+    assert grid[500, 1500] == {'agent1': agent1, 'agent2': agent2}
+    assert len(grid._cells) == 2
+
+    grid.remove(agent1, (500, 1500))
+    grid.remove(agent2, (500, 1500))
+    assert grid[500, 1500] == {}
+    assert grid.query(agent1, (500, 1500))
+    assert len(grid._cells) == 1
+    with pytest.raises(KeyError):
+        grid.remove(agent1, (500, 1500))
+
+    grid.reset()
+    assert len(grid._cells) == 0
+    assert grid[999, 1999] == {}
+
+
+def test_sparse_grid_slicing():
+    grid = SparseGrid(4, 5, overlapping={1: [2], 2: [1]})
+    dense = Grid(4, 5, overlapping={1: [2], 2: [1]})
+    grid.reset()
+    dense.reset()
+    agents = [
+        (GridWorldAgent(id='agent0', encoding=1), (0, 0)),
+        (GridWorldAgent(id='agent1', encoding=2), (0, 0)),
+        (GridWorldAgent(id='agent2', encoding=2), (2, 3)),
+        (GridWorldAgent(id='agent3', encoding=1), (3, 4)),
+    ]
+    for agent, ndx in agents:
+        assert grid.place(agent, ndx)
+        assert dense.place(agent, ndx)
+
+    assert grid.encoding_counts.shape == dense.encoding_counts.shape
+    assert grid.occupancy.shape == dense.occupancy.shape
+    for subscript in [
+        (slice(None), slice(None)),
+        (slice(1, 3), slice(2, 5)),
+        (0, slice(None)),
+        (slice(None), 4),
+        (2, 3),
+    ]:
+        np.testing.assert_array_equal(grid[subscript], dense[subscript])
+        np.testing.assert_array_equal(
+            grid.encoding_counts[subscript], dense.encoding_counts[subscript]
+        )
+        np.testing.assert_array_equal(grid.occupancy[subscript], dense.occupancy[subscript])
+    np.testing.assert_array_equal(
+        grid.encoding_counts[0, 0, 1], dense.encoding_counts[0, 0, 1]
+    )
+
+
+def test_sparse_grid_matches_grid_in_observer():
+    def build_agents():
+        return {
+            'agent0': GridObservingAgent(
+                id='agent0', encoding=1, view_range=3, initial_position=np.array([2, 2])
+            ),
+            'agent1': GridWorldAgent(
+                id='agent1', encoding=2, initial_position=np.array([3, 3]), blocking=True
+            ),
+            'agent2': GridWorldAgent(id='agent2', encoding=3, initial_position=np.array([4, 4])),
+            'agent3': GridWorldAgent(id='agent3', encoding=3, initial_position=np.array([0, 4])),
+        }
+
+    dense_agents, sparse_agents = build_agents(), build_agents()
+    dense_grid, sparse_grid = Grid(6, 6), SparseGrid(6, 6)
+    PositionState(grid=dense_grid, agents=dense_agents).reset()
+    PositionState(grid=sparse_grid, agents=sparse_agents).reset()
+    for observer_class in [SingleGridObserver, MultiGridObserver]:
+        dense_observer = observer_class(grid=dense_grid, agents=dense_agents)
+        sparse_observer = observer_class(grid=sparse_grid, agents=sparse_agents)
+        np.testing.assert_array_equal(
+            dense_observer.get_obs(dense_agents['agent0'])['grid'],
+            sparse_observer.get_obs(sparse_agents['agent0'])['grid'],
+        )
+
+
+def test_grid_blocker_counts():
+    for grid_class in [Grid, SparseGrid]:
+        wall = GridWorldAgent(
+            id='wall', encoding=2, blocking=True, static=True, initial_position=np.array([0, 0])
+        )
+        blocker = GridWorldAgent(id='blocker', encoding=2, blocking=True)
+        agent = GridWorldAgent(id='agent', encoding=1)
+        grid = grid_class(3, 4, agents={'wall': wall, 'blocker': blocker, 'agent': agent})
+        grid.reset()
+        assert grid.place(wall, (0, 0))
+        assert grid.place(blocker, (1, 2))
+        assert grid.place(agent, (2, 3))
+        # The SparseGrid does not precompute static visibility, so it counts the wall
+        wall_count = 1 if grid_class is SparseGrid else 0
+        np.testing.assert_array_equal(
+            grid.blocker_counts[:, :],
+            np.array([
+                [wall_count, 0, 0, 0],
+                [0, 0, 1, 0],
+                [0, 0, 0, 0],
+            ])
+        )
+        grid.remove(blocker, (1, 2))
+        assert grid.blocker_counts[:, :].sum() == wall_count
+
+    # Without precomputed visibility, static blockers are indexed too
+    grid = Grid(3, 4)
+    grid.reset()
+    assert grid.place(wall, (0, 0))
+    assert grid.blocker_counts[0, 0] == 1
+
+
+def test_grid_windows():
+    for grid_class in [Grid, SparseGrid]:
+        agent0 = GridWorldAgent(id='agent0', encoding=1)
+        agent1 = GridWorldAgent(id='agent1', encoding=2, blocking=True)
+        grid = grid_class(3, 4)
+        grid.reset()
+        assert grid.place(agent0, (0, 0))
+        assert grid.place(agent1, (1, 1))
+
+        window = grid.window(agent0.position, 1)
+        assert window.shape == (3, 3)
+        assert all(cell is None for cell in window[0, :])
+        assert all(cell is None for cell in window[:, 0])
+        assert window[1, 1] == {'agent0': agent0}
+        assert window[2, 2] == {'agent1': agent1}
+        assert window[1, 2] == {}
+        np.testing.assert_array_equal(
+            grid.in_bounds_window(agent0.position, 1),
+            np.array([
+                [False, False, False],
+                [False, True, True],
+                [False, True, True],
+            ])
+        )
+        np.testing.assert_array_equal(
+            grid.encoding_counts_window(agent0.position, 1)[..., 1],
+            np.array([
+                [0, 0, 0],
+                [0, 0, 0],
+                [0, 0, 1],
+            ])
+        )
+        np.testing.assert_array_equal(
+            grid.blocker_counts_window(agent1.position, 2),
+            np.array([
+                [0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0],
+                [0, 0, 1, 0, 0],
+                [0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0],
+            ])
+        )
+
+
+def test_grid_windows_are_views():
+    agent0 = GridWorldAgent(id='agent0', encoding=1)
+    grid = Grid(3, 4)
+    grid.reset()
+    assert grid.place(agent0, (1, 1))
+    window = grid.window(agent0.position, 1)
+    assert not window.flags.writeable
+    assert window[1, 1] is grid[1, 1]
+
+    # The padding grows to the largest range, and the storage stays consistent
+    window = grid.window(agent0.position, 3)
+    assert window.shape == (7, 7)
+    assert window[3, 3] is grid[1, 1]
+    assert grid._internal.shape == (3, 4)
+    agent1 = GridWorldAgent(id='agent1', encoding=3)
+    assert grid.place(agent1, (2, 3))
+    assert grid.encoding_counts[2, 3, 2] == 1
+    assert grid.encoding_counts_window(agent0.position, 3)[4, 5, 2] == 1
+    assert 'agent1' in window[4, 5]
+
+
+
+
+def test_grid_encoding_change_while_placed():
+    for grid_class in [Grid, SparseGrid]:
+        agents = {
+            'agent0': GridWorldAgent(id='agent0', encoding=1),
+            'agent1': GridWorldAgent(id='agent1', encoding=2),
+        }
+        grid = grid_class(2, 2, overlapping={2: [2]}, agents=agents)
+        grid.reset()
+        assert grid.place(agents['agent0'], (0, 0))
+
+        # Agents in the Grid's store are recounted when their encoding changes
+        agents['agent0'].encoding = 2
+        np.testing.assert_array_equal(grid.encoding_counts[0, 0], [0, 1])
+        assert grid.query(agents['agent1'], (0, 0))
+        grid.remove(agents['agent0'], (0, 0))
+        np.testing.assert_array_equal(grid.encoding_counts[0, 0], [0, 0])
+        assert grid.query(GridWorldAgent(id='agent2', encoding=1), (0, 0))
+
+        # Other agents are removed with the encoding they were counted with
+        agent = GridWorldAgent(id='agent3', encoding=1)
+        assert grid.place(agent, (1, 1))
+        agent.encoding = 2
+        grid.remove(agent, (1, 1))
+        np.testing.assert_array_equal(grid.encoding_counts[1, 1], [0, 0])
+
+
+
+def test_grid_blocking_change_while_placed():
+    for grid_class in [Grid, SparseGrid]:
+        agents = {
+            'agent0': GridObservingAgent(id='agent0', encoding=1, view_range=2),
+            'agent1': GridWorldAgent(id='agent1', encoding=2),
+        }
+        grid = grid_class(1, 3, agents=agents)
+        grid.reset()
+        assert grid.place(agents['agent0'], (0, 0))
+        assert grid.place(agents['agent1'], (0, 1))
+        assert grid.visibility.get_mask(agents['agent0'], 2).astype(bool)[2, 4]
+
+        # Agents in the Grid's store are recounted when their blocking changes
+        agents['agent1'].blocking = True
+        assert grid.blocker_counts[0, 1] == 1
+        assert not grid.visibility.get_mask(agents['agent0'], 2).astype(bool)[2, 4]
+        grid.remove(agents['agent1'], (0, 1))
+        assert not grid.blocker_counts[:, :].any()
+
+        # Other agents are removed with the blocking they were counted with
+        agent = GridWorldAgent(id='agent2', encoding=2)
+        assert grid.place(agent, (0, 2))
+        agent.blocking = True
+        grid.remove(agent, (0, 2))
+        assert not grid.blocker_counts[:, :].any()
+
+
+def test_grid_pickle_keeps_views():
+    for grid_class in [Grid, SparseGrid]:
+        agent0 = GridWorldAgent(id='agent0', encoding=1, blocking=True)
+        grid = grid_class(3, 4)
+        grid.reset()
+        grid.window((1, 1), 2)
+        assert grid.place(agent0, (1, 1))
+
+        grid = pickle.loads(pickle.dumps(grid))
+        agent0 = grid[1, 1]['agent0']
+        grid.reset()
+        assert grid.place(agent0, (2, 3))
+        assert grid.encoding_counts[2, 3, 0] == 1
+        assert grid.encoding_counts_window((2, 3), 1)[1, 1, 0] == 1
+        assert grid.blocker_counts_window((2, 3), 1)[1, 1] == 1
+        assert grid.window((2, 3), 1)[1, 1] == {'agent0': agent0}
+
+
+def test_grid_change_stamps():
+    for grid_class in [Grid, SparseGrid]:
+        agent0 = GridWorldAgent(id='agent0', encoding=1)
+        agent1 = GridWorldAgent(id='agent1', encoding=2)
+        grid = grid_class(3, 4)
+        grid.reset()
+        version = grid.change_version
+        np.testing.assert_array_equal(
+            grid.change_stamps_window((1, 1), 1), np.full((3, 3), version)
+        )
+        assert grid.place(agent0, (0, 0))
+        assert grid.place(agent1, (2, 3))
+        assert grid.change_version == version + 2
+        stamps = grid.change_stamps_window((1, 1), 2)
+        assert stamps[1, 1] == version + 1
+        assert stamps[2, 2] == version
+        assert stamps[0, 0] == 0 # Out of bounds
+        assert grid.change_stamps_window((2, 3), 0)[0, 0] == version + 2
+
+        grid.remove(agent1, (2, 3))
+        assert grid.change_version == version + 3
+        assert grid.change_stamps_window((2, 3), 0)[0, 0] == version + 3
+        assert grid.change_stamps_window((1, 1), 0)[0, 0] == version
+
+        grid.reset()
+        assert grid.change_version == version + 4
+        assert (grid.change_stamps_window((1, 1), 1) == version + 4).all()
+
+
+def test_grid_neighbors():
+    for grid_class in [Grid, SparseGrid]:
+        agents = {
+            'agent0': GridWorldAgent(id='agent0', encoding=1),
+            'agent1': GridWorldAgent(id='agent1', encoding=2),
+            'agent2': GridWorldAgent(id='agent2', encoding=1),
+            'wall': GridWorldAgent(id='wall', encoding=3, blocking=True),
+            'agent3': GridWorldAgent(id='agent3', encoding=2),
+            'agent4': HealthAgent(id='agent4', encoding=2, initial_health=1),
+            'agent5': GridWorldAgent(id='agent5', encoding=2),
+        }
+        grid = grid_class(5, 5, agents=agents)
+        grid.reset()
+        agents['agent4'].health = 1
+        assert grid.place(agents['agent0'], (2, 2))
+        assert grid.place(agents['agent1'], (0, 0))
+        assert grid.place(agents['agent2'], (1, 2))
+        assert grid.place(agents['wall'], (2, 3))
+        assert grid.place(agents['agent3'], (2, 4))
+        assert grid.place(agents['agent4'], (3, 1))
+        assert grid.place(agents['agent5'], (4, 4))
+
+        np.testing.assert_array_equal(
+            grid.neighbors(agents['agent0'], 2),
+            ['agent1', 'agent2', 'wall', 'agent4', 'agent5']
+        )
+        np.testing.assert_array_equal(
+            grid.neighbors(agents['agent0'], 2, visible_only=False),
+            ['agent1', 'agent2', 'wall', 'agent3', 'agent4', 'agent5']
+        )
+        np.testing.assert_array_equal(
+            grid.neighbors(agents['agent0'], 1, encodings=[2, 3]), ['wall', 'agent4']
+        )
+        np.testing.assert_array_equal(
+            grid.neighbors(agents['agent0'], 2, encodings=[1, 7]), ['agent2']
+        )
+        assert len(grid.neighbors(agents['agent0'], 2, encodings=[])) == 0
+
+        # Inactive agents are not neighbors
+        agents['agent4'].health = 0
+        np.testing.assert_array_equal(
+            grid.neighbors(agents['agent0'], 1), ['agent2', 'wall']
+        )
+
+
+def test_grid_terrain():
+    terrain = np.array([
+        [0, 2, 0, 0],
+        [0, 2, 0, 3],
+        [0, 0, 0, 0],
+    ])
+    agents = {
+        'agent0': GridObservingAgent(id='agent0', encoding=1, view_range=3),
+        'agent1': GridWorldAgent(id='agent1', encoding=4),
+    }
+    for visibility_algorithm in ['rays', 'shadowcast']:
+        grid = Grid(
+            3, 4, agents=agents, overlapping={1: [3], 4: [2, 3]}, terrain=terrain,
+            terrain_blocking=[2], visibility_algorithm=visibility_algorithm
+        )
+        np.testing.assert_array_equal(grid.terrain, terrain)
+        assert grid.terrain_blocking == [2]
+        with pytest.raises(ValueError):
+            grid.terrain[0, 0] = 1
+        grid.reset()
+
+        # The terrain is counted like an agent that never leaves.
+        assert grid.encoding_counts.shape == (3, 4, 4)
+        np.testing.assert_array_equal(grid.encoding_counts[:, :, 1], terrain == 2)
+        np.testing.assert_array_equal(grid.encoding_counts[:, :, 2], terrain == 3)
+        assert not grid.occupancy.any()
+        assert not grid[0, 1]
+
+        # Agents can only enter terrain with which they can overlap.
+        assert not grid.query(agents['agent0'], (0, 1))
+        assert grid.query(agents['agent0'], (1, 3))
+        assert grid.query(agents['agent1'], (0, 1))
+        assert not grid.place(agents['agent0'], (1, 1))
+        assert grid.place(agents['agent0'], (1, 3))
+        grid.remove(agents['agent0'], (1, 3))
+        assert grid.encoding_counts[1, 3, 2] == 1
+        assert not grid.place(agents['agent0'], (1, 1))
+
+        # Blocking terrain masks the cells behind it.
+        assert grid.place(agents['agent0'], (1, 0))
+        mask = grid.visibility.get_mask(agents['agent0'], 3)
+        assert mask[3, 4] # The terrain itself is visible
+        assert not mask[3, 5] # Behind the terrain
+        assert not mask[3, 6]
+        assert mask[4, 4] # Below the terrain
+        if visibility_algorithm == 'rays':
+            assert grid.static_visibility is not None
+            assert not grid.blocker_counts[:, :].any()
+        else:
+            np.testing.assert_array_equal(grid.blocker_counts[:, :], terrain == 2)
+
+    with pytest.raises(AssertionError):
+        Grid(3, 4, terrain=terrain[:2])
+    with pytest.raises(AssertionError):
+        Grid(3, 4, terrain=-terrain)
+    with pytest.raises(AssertionError):
+        SparseGrid(3, 4, terrain=terrain)
@@ -1,12 +1,15 @@
 
-from gym.spaces import Box
+import copy
+
+from gym.spaces import Box, Dict, Discrete
 import numpy as np
+import pytest
 
 from abmarl.sim.gridworld.observer import ObserverBaseComponent, SingleGridObserver, \
-    MultiGridObserver
+    MultiGridObserver, SparseGridObserver
 from abmarl.sim.gridworld.agent import GridObservingAgent, GridWorldAgent, MovingAgent
 from abmarl.sim.gridworld.state import PositionState
-from abmarl.sim.gridworld.grid import Grid
+from abmarl.sim.gridworld.grid import Grid, SparseGrid
 
 
 def test_single_grid_observer():
@@ -621,7 +624,7 @@ def test_multi_grid_observer_blocking():
 
 
 def test_observe_self():
-    np.random.seed(24)
+    np.random.seed(2)
     class HackAgent(GridObservingAgent, MovingAgent): pass
 
     agents = {
@@ -678,3 +681,401 @@ def test_observe_self():
             [-1,  0,  0]
         ])
     )
+
+
+def test_single_grid_observer_tie_breaking():
+    agents = {
+        'agent0': GridObservingAgent(
+            id='agent0', encoding=1, view_range=1, initial_position=np.array([1, 1])
+        ),
+        'agent1': GridWorldAgent(id='agent1', encoding=3, initial_position=np.array([0, 1])),
+        'agent2': GridWorldAgent(id='agent2', encoding=2, initial_position=np.array([0, 1])),
+        'agent3': GridWorldAgent(id='agent3', encoding=2, initial_position=np.array([1, 1])),
+    }
+    grid = Grid(3, 3, overlapping={1: [2, 3], 2: [1, 3], 3: [1, 2]})
+    position_state = PositionState(grid=grid, agents=agents)
+    position_state.reset()
+
+    max_observer = SingleGridObserver(agents=agents, grid=grid, tie_breaking='max')
+    np.testing.assert_array_equal(
+        max_observer.get_obs(agents['agent0'])['grid'],
+        np.array([
+            [0, 3, 0],
+            [0, 2, 0],
+            [0, 0, 0]
+        ])
+    )
+    recent_observer = SingleGridObserver(agents=agents, grid=grid, tie_breaking='recent')
+    np.testing.assert_array_equal(
+        recent_observer.get_obs(agents['agent0'])['grid'],
+        np.array([
+            [0, 2, 0],
+            [0, 2, 0],
+            [0, 0, 0]
+        ])
+    )
+    recent_no_self_observer = SingleGridObserver(
+        agents=agents, grid=grid, tie_breaking='recent', observe_self=False
+    )
+    grid.remove(agents['agent0'], (1, 1))
+    grid.place(agents['agent0'], (1, 1))
+    np.testing.assert_array_equal(
+        recent_no_self_observer.get_obs(agents['agent0'])['grid'],
+        np.array([
+            [0, 2, 0],
+            [0, 2, 0],
+            [0, 0, 0]
+        ])
+    )
+
+    # Random tie breaking observes each agent in the cell equally often
+    np.random.seed(0)
+    random_observer = SingleGridObserver(agents=agents, grid=grid)
+    assert random_observer.tie_breaking == 'random'
+    observed = np.array([
+        random_observer.get_obs(agents['agent0'])['grid'][0, 1] for _ in range(2000)
+    ])
+    assert set(observed) == {2, 3}
+    assert 0.45 < np.mean(observed == 2) < 0.55
+
+    with pytest.raises(AssertionError):
+        SingleGridObserver(agents=agents, grid=grid, tie_breaking='min')
+
+
+def test_multi_grid_observer_matches_cell_counts():
+    np.random.seed(12)
+    agents = {
+        f'agent{i}': GridObservingAgent(
+            id=f'agent{i}',
+            encoding=np.random.randint(1, 5),
+            view_range=np.random.randint(1, 5),
+            blocking=bool(np.random.uniform() < 0.2)
+        ) for i in range(40)
+    }
+    grid = Grid(8, 8, overlapping={e: [1, 2, 3, 4] for e in [1, 2, 3, 4]})
+    PositionState(grid=grid, agents=agents).reset()
+    observer = MultiGridObserver(agents=agents, grid=grid)
+    for agent in agents.values():
+        local_grid, mask = grid.visibility.get_grid_and_mask(agent, agent.view_range)
+        expected = np.zeros(mask.shape + (observer.number_of_encodings,), dtype=int)
+        for r, c in np.ndindex(mask.shape):
+            if not mask[r, c]:
+                expected[r, c] = -2
+            elif local_grid[r, c] is None:
+                expected[r, c] = -1
+            else:
+                for other in local_grid[r, c].values():
+                    expected[r, c, other.encoding - 1] += 1
+        np.testing.assert_array_equal(observer.get_obs(agent)['grid'], expected)
+
+
+def test_get_obs_batch():
+    for grid_class in [Grid, SparseGrid]:
+        np.random.seed(4)
+        agents = {
+            f'agent{i}': GridObservingAgent(
+                id=f'agent{i}',
+                encoding=np.random.randint(1, 4),
+                view_range=2,
+                blocking=bool(np.random.uniform() < 0.2)
+            ) for i in range(20)
+        }
+        grid = grid_class(6, 7, overlapping={e: [1, 2, 3] for e in [1, 2, 3]})
+        PositionState(grid=grid, agents=agents).reset()
+        observers = [
+            SingleGridObserver(agents=agents, grid=grid, tie_breaking='max'),
+            SingleGridObserver(
+                agents=agents, grid=grid, tie_breaking='recent', observe_self=False
+            ),
+            MultiGridObserver(agents=agents, grid=grid),
+        ]
+        for observer in observers:
+            batch = observer.get_obs_batch(list(agents.values()))
+            assert len(batch['grid']) == 20
+            for n, agent in enumerate(agents.values()):
+                np.testing.assert_array_equal(batch['grid'][n], observer.get_obs(agent)['grid'])
+
+    agents['agent1'].view_range = 3
+    with pytest.raises(AssertionError):
+        observers[0].get_obs_batch(list(agents.values()))
+
+
+def test_get_obs_batch_default():
+    class PositionObserver(ObserverBaseComponent):
+        key = 'position'
+        supported_agent_type = GridWorldAgent
+
+        def get_obs(self, agent, **kwargs):
+            return {self.key: agent.position}
+
+    agents = {
+        'agent0': GridWorldAgent(id='agent0', encoding=1, initial_position=np.array([0, 1])),
+        'agent1': GridWorldAgent(id='agent1', encoding=1, initial_position=np.array([2, 3])),
+    }
+    grid = Grid(3, 4)
+    PositionState(grid=grid, agents=agents).reset()
+    observer = PositionObserver(agents=agents, grid=grid)
+    np.testing.assert_array_equal(
+        observer.get_obs_batch([agents['agent1'], agents['agent0']])['position'],
+        np.array([[2, 3], [0, 1]])
+    )
+
+
+def test_observer_reuse_buffers():
+    agents = {
+        'agent0': GridObservingAgent(
+            id='agent0', encoding=1, view_range=1, initial_position=np.array([1, 1])
+        ),
+        'agent1': GridObservingAgent(
+            id='agent1', encoding=2, view_range=1, initial_position=np.array([0, 0])
+        ),
+    }
+    grid = Grid(3, 3)
+    PositionState(grid=grid, agents=agents).reset()
+    for observer_class in [SingleGridObserver, MultiGridObserver]:
+        observer = observer_class(agents=agents, grid=grid)
+        assert not observer.reuse_buffers
+        assert observer.get_obs(agents['agent0'])['grid'] is not \
+            observer.get_obs(agents['agent0'])['grid']
+
+        observer = observer_class(agents=agents, grid=grid, reuse_buffers=True)
+        first = observer.get_obs(agents['agent0'])['grid']
+        expected = first.copy()
+        assert np.shares_memory(observer.get_obs(agents['agent0'])['grid'], first)
+        assert not np.shares_memory(observer.get_obs(agents['agent1'])['grid'], first)
+        np.testing.assert_array_equal(first, expected)
+
+        # The buffer is overwritten when the agent observes again
+        grid.remove(agents['agent1'], (0, 0))
+        grid.place(agents['agent1'], (0, 1))
+        observer.get_obs(agents['agent0'])
+        assert not np.array_equal(first, expected)
+
+        batch = observer.get_obs_batch(list(agents.values()))['grid']
+        assert observer.get_obs_batch(list(agents.values()))['grid'] is batch
+
+        grid.remove(agents['agent1'], (0, 1))
+        grid.place(agents['agent1'], (0, 0))
+
+    with pytest.raises(AssertionError):
+        SingleGridObserver(agents=agents, grid=grid, reuse_buffers=1)
+
+
+def test_observer_reuse_buffers_per_batch():
+    agents = {
+        'agent0': GridObservingAgent(
+            id='agent0', encoding=1, view_range=1, initial_position=np.array([0, 0])
+        ),
+        'agent1': GridObservingAgent(
+            id='agent1', encoding=1, view_range=1, initial_position=np.array([0, 3])
+        ),
+        'agent2': GridObservingAgent(
+            id='agent2', encoding=2, view_range=1, initial_position=np.array([3, 0])
+        ),
+        'agent3': GridObservingAgent(
+            id='agent3', encoding=2, view_range=1, initial_position=np.array([3, 3])
+        ),
+    }
+    grid = Grid(4, 4)
+    PositionState(grid=grid, agents=agents).reset()
+    team_a = [agents['agent0'], agents['agent1']]
+    team_b = [agents['agent2'], agents['agent3']]
+    for observer_class in [SingleGridObserver, MultiGridObserver, SparseGridObserver]:
+        observer = observer_class(agents=agents, grid=grid, reuse_buffers=True)
+        batch_a = observer.get_obs_batch(team_a)['grid']
+        expected_a = copy.deepcopy(batch_a)
+        batch_b = observer.get_obs_batch(team_b)['grid']
+
+        # Each batch of agents has its own buffer
+        if observer_class is SparseGridObserver:
+            assert batch_a['entries'] is not batch_b['entries']
+            np.testing.assert_array_equal(batch_a['entries'], expected_a['entries'])
+        else:
+            assert batch_a is not batch_b
+            np.testing.assert_array_equal(batch_a, expected_a)
+
+
+def test_observer_reuse_buffers_bounded_across_episodes():
+    np.random.seed(3)
+    agents = {
+        f'agent{i}': GridObservingAgent(id=f'agent{i}', encoding=1, view_range=1)
+        for i in range(6)
+    }
+    grid = Grid(4, 4)
+    position_state = PositionState(grid=grid, agents=agents)
+    for observer_class in [SingleGridObserver, MultiGridObserver, SparseGridObserver]:
+        observer = observer_class(agents=agents, grid=grid, reuse_buffers=True)
+        for _ in range(20):
+            position_state.reset()
+            batch = [
+                agent for agent in agents.values() if np.random.uniform() < 0.5
+            ] or [agents['agent0']]
+            observer.get_obs_batch(batch)
+            for agent in agents.values():
+                observer.get_obs(agent)
+            # One buffer per agent and the buffers of the current batch
+            assert len(observer._buffers) <= len(agents) * 2 + 2
+
+
+def test_incremental_observations():
+    np.random.seed(8)
+    agents = {
+        f'agent{i}': GridObservingAgent(
+            id=f'agent{i}',
+            encoding=np.random.randint(1, 4),
+            view_range=2,
+            blocking=bool(np.random.uniform() < 0.2)
+        ) for i in range(12)
+    }
+    grid = Grid(12, 12, overlapping={e: [1, 2, 3] for e in [1, 2, 3]})
+    PositionState(grid=grid, agents=agents).reset()
+    for observer_class in [SingleGridObserver, MultiGridObserver]:
+        kwargs = {'tie_breaking': 'max'} if observer_class is SingleGridObserver else {}
+        full = observer_class(agents=agents, grid=grid, **kwargs)
+        incremental = observer_class(agents=agents, grid=grid, incremental=True, **kwargs)
+        batched = observer_class(agents=agents, grid=grid, incremental=True, **kwargs)
+        assert not full.incremental
+        for _ in range(10):
+            expected = {agent.id: full.get_obs(agent)['grid'] for agent in agents.values()}
+            batch = batched.get_obs_batch(list(agents.values()))['grid']
+            for n, agent in enumerate(agents.values()):
+                np.testing.assert_array_equal(
+                    incremental.get_obs(agent)['grid'], expected[agent.id]
+                )
+                np.testing.assert_array_equal(batch[n], expected[agent.id])
+
+            # Move a few agents to random nearby cells
+            for agent in np.random.choice(list(agents.values()), 3, replace=False):
+                new_position = np.clip(agent.position + np.random.randint(-2, 3, 2), 0, 11)
+                if grid.query(agent, new_position):
+                    grid.remove(agent, agent.position)
+                    grid.place(agent, new_position)
+
+
+def test_incremental_observations_reuse_unchanged_windows():
+    agents = {
+        'agent0': GridObservingAgent(
+            id='agent0', encoding=1, view_range=1, initial_position=np.array([0, 0])
+        ),
+        'agent1': GridObservingAgent(
+            id='agent1', encoding=2, view_range=1, initial_position=np.array([4, 4])
+        ),
+    }
+    grid = Grid(5, 5)
+    PositionState(grid=grid, agents=agents).reset()
+    observer = SingleGridObserver(agents=agents, grid=grid, incremental=True)
+    observer.get_obs(agents['agent0'])
+    cached = observer._cached_obs['agent0']
+
+    # Moving an agent outside of agent0's window keeps the observation
+    grid.remove(agents['agent1'], (4, 4))
+    grid.place(agents['agent1'], (3, 4))
+    observer.get_obs(agents['agent0'])
+    assert observer._cached_obs['agent0'] is cached
+
+    # Moving into the window updates the observation
+    grid.remove(agents['agent1'], (3, 4))
+    grid.place(agents['agent1'], (1, 1))
+    np.testing.assert_array_equal(
+        observer.get_obs(agents['agent0'])['grid'],
+        np.array([
+            [-1, -1, -1],
+            [-1, 1, 0],
+            [-1, 0, 2]
+        ])
+    )
+    assert observer._cached_obs['agent0'] is not cached
+
+
+def test_sparse_grid_observer():
+    agents = {
+        'agent0': GridObservingAgent(
+            id='agent0', encoding=1, view_range=2, initial_position=np.array([2, 2])
+        ),
+        'agent1': GridWorldAgent(id='agent1', encoding=2, initial_position=np.array([0, 0])),
+        'agent2': GridWorldAgent(id='agent2', encoding=3, initial_position=np.array([2, 3])),
+        'agent3': GridWorldAgent(
+            id='agent3', encoding=4, initial_position=np.array([3, 1]), blocking=True
+        ),
+        'agent4': GridWorldAgent(id='agent4', encoding=5, initial_position=np.array([4, 0])),
+        'agent5': GridObservingAgent(
+            id='agent5', encoding=1, view_range=2, initial_position=np.array([0, 4])
+        ),
+    }
+    grid = Grid(5, 5)
+    PositionState(grid=grid, agents=agents).reset()
+    observer = SparseGridObserver(agents=agents, grid=grid, capacity=4)
+    assert observer.capacity == 4
+    assert agents['agent0'].observation_space['grid'] == Dict({
+        'count': Discrete(5),
+        'entries': Box(
+            np.tile([-2, -2, 0], (4, 1)), np.tile([2, 2, 5], (4, 1)), dtype=int
+        )
+    })
+
+    # agent4 is hidden behind agent3, and agent5 is farther than agent2 and agent3
+    obs = observer.get_obs(agents['agent0'])['grid']
+    assert obs in agents['agent0'].observation_space['grid']
+    assert obs['count'] == 4
+    np.testing.assert_array_equal(
+        obs['entries'],
+        np.array([
+            [0, 0, 1],
+            [0, 1, 3],
+            [1, -1, 4],
+            [-2, -2, 2],
+        ])
+    )
+
+    # Unused entries are zeros
+    obs = observer.get_obs(agents['agent5'])['grid']
+    assert obs['count'] == 3
+    np.testing.assert_array_equal(
+        obs['entries'], np.array([[0, 0, 1], [2, -2, 1], [2, -1, 3], [0, 0, 0]])
+    )
+
+    batch = observer.get_obs_batch([agents['agent5'], agents['agent0']])['grid']
+    np.testing.assert_array_equal(batch['count'], [3, 4])
+    np.testing.assert_array_equal(
+        batch['entries'][1], observer.get_obs(agents['agent0'])['grid']['entries']
+    )
+
+    with pytest.raises(AssertionError):
+        SparseGridObserver(agents=agents, grid=grid, capacity=0)
+
+
+def test_grid_observers_with_terrain():
+    terrain = np.array([
+        [0, 0, 0, 0, 0],
+        [0, 4, 0, 0, 0],
+        [0, 4, 0, 0, 0],
+        [0, 0, 0, 0, 0],
+    ])
+    agents = {
+        'agent0': GridObservingAgent(
+            id='agent0', encoding=1, view_range=2, initial_position=np.array([2, 0])
+        ),
+        'agent1': GridWorldAgent(id='agent1', encoding=2, initial_position=np.array([2, 1])),
+    }
+    grid = Grid(4, 5, agents=agents, terrain=terrain, terrain_blocking=[4], overlapping={2: [4]})
+    position_state = PositionState(grid=grid, agents=agents)
+    position_state.reset()
+
+    observer = SingleGridObserver(agents=agents, grid=grid, tie_breaking='recent')
+    assert agents['agent0'].observation_space['grid'] == Box(-2, 4, (5, 5), int)
+    np.testing.assert_array_equal(
+        observer.get_obs(agents['agent0'])['grid'],
+        np.array([
+            [-1, -1,  0, -2, -2],
+            [-1, -1,  0,  4, -2],
+            [-1, -1,  1,  2, -2],
+            [-1, -1,  0,  0, -2],
+            [-1, -1, -1, -1, -1],
+        ])
+    )
+
+    observer = MultiGridObserver(agents=agents, grid=grid)
+    assert agents['agent0'].observation_space['grid'] == Box(-2, 2, (5, 5, 4), int)
+    obs = observer.get_obs(agents['agent0'])['grid']
+    np.testing.assert_array_equal(obs[1:4, 3, 3], [1, 1, 0])
+    np.testing.assert_array_equal(obs[2, 3], [0, 1, 0, 1])
@@ -1,8 +1,10 @@
 
 import numpy as np
+import pytest
 
-from abmarl.sim.gridworld.grid import Grid
-from abmarl.sim.gridworld.state import PositionState, HealthState, StateBaseComponent
+from abmarl.sim.gridworld.grid import Grid, SparseGrid
+from abmarl.sim.gridworld.state import PositionState, HealthState, StateBaseComponent, \
+    _FreeCellIndex
 from abmarl.sim.gridworld.agent import HealthAgent, GridWorldAgent
 
 
@@ -26,6 +28,113 @@ def test_position_state():
     assert grid[2, 0] == {'agent2': agents['agent2']}
 
 
+def test_position_state_random_placement():
+    for grid in [Grid(4, 5), SparseGrid(4, 5)]:
+        agents = {
+            'agent0': GridWorldAgent(id='agent0', encoding=1, initial_position=np.array([0, 1])),
+            'agent1': GridWorldAgent(id='agent1', encoding=1, initial_position=np.array([3, 4])),
+            **{
+                f'agent{i}': GridWorldAgent(id=f'agent{i}', encoding=1)
+                for i in range(2, 20)
+            }
+        }
+        position_state = PositionState(grid=grid, agents=agents)
+        for _ in range(5):
+            position_state.reset()
+            np.testing.assert_equal(agents['agent0'].position, np.array([0, 1]))
+            np.testing.assert_equal(agents['agent1'].position, np.array([3, 4]))
+            positions = set(tuple(agent.position) for agent in agents.values())
+            assert len(positions) == 20
+            for agent in agents.values():
+                assert grid[tuple(agent.position)] == {agent.id: agent}
+
+        agents['agent20'] = GridWorldAgent(id='agent20', encoding=1)
+        with pytest.raises(AssertionError):
+            position_state.reset()
+
+
+def test_position_state_random_placement_with_terrain():
+    terrain = np.array([
+        [1, 1, 1],
+        [1, 0, 2],
+        [1, 2, 2],
+    ])
+    agents = {
+        'agent0': GridWorldAgent(id='agent0', encoding=3),
+        'agent1': GridWorldAgent(id='agent1', encoding=3),
+        'agent2': GridWorldAgent(id='agent2', encoding=3),
+    }
+    grid = Grid(3, 3, agents=agents, terrain=terrain, overlapping={3: [2], 2: [3]})
+    position_state = PositionState(grid=grid, agents=agents)
+    for _ in range(10):
+        position_state.reset()
+        positions = {tuple(agent.position) for agent in agents.values()}
+        assert len(positions) == 3
+        for position in positions:
+            assert terrain[position] != 1
+
+    agents['agent3'] = GridWorldAgent(id='agent3', encoding=3)
+    agents['agent4'] = GridWorldAgent(id='agent4', encoding=3)
+    with pytest.raises(AssertionError):
+        PositionState(grid=grid, agents=agents).reset()
+
+
+def test_position_state_random_placement_with_terrain_per_encoding():
+    terrain = np.array([
+        [1, 1, 1],
+        [1, 0, 2],
+        [1, 2, 2],
+    ])
+    agents = {
+        **{
+            f'agent{i}': GridWorldAgent(id=f'agent{i}', encoding=3) for i in range(3)
+        },
+        **{
+            f'agent{i}': GridWorldAgent(id=f'agent{i}', encoding=4) for i in range(3, 8)
+        },
+    }
+    grid = Grid(
+        3, 3, agents=agents, terrain=terrain, overlapping={3: [2], 2: [3], 4: [1], 1: [4]}
+    )
+    enterable = {3: 2, 4: 1}
+    position_state = PositionState(grid=grid, agents=agents)
+    for _ in range(10):
+        # No cell is enterable by both encodings except the center, but each
+        # encoding has enough cells of its own.
+        position_state.reset()
+        positions = {tuple(agent.position) for agent in agents.values()}
+        assert len(positions) == 8
+        for agent in agents.values():
+            assert terrain[tuple(agent.position)] in [0, enterable[agent.encoding]]
+        np.testing.assert_array_equal(
+            grid.encoding_counts.sum(axis=-1), grid.occupancy + (terrain > 0)
+        )
+
+
+def test_free_cell_index():
+    index = _FreeCellIndex(10)
+    assert index.size == 10
+    index.remove(np.array([3, 7, 7, 9]))
+    assert index.size == 7
+    assert set(index._cells[:index.size]) == {0, 1, 2, 4, 5, 6, 8}
+    np.testing.assert_array_equal(index._cells[index._lookup], np.arange(10))
+
+    # Removing cells that are not free does nothing
+    index.remove(np.array([3]))
+    assert index.size == 7
+
+    samples = index.sample(5)
+    assert len(set(samples)) == 5
+    assert set(samples) <= {0, 1, 2, 4, 5, 6, 8}
+    assert index.size == 2
+    assert set(index._cells[:index.size]) == {0, 1, 2, 4, 5, 6, 8} - set(samples)
+    np.testing.assert_array_equal(index._cells[index._lookup], np.arange(10))
+
+    index.reset()
+    assert index.size == 10
+    assert set(index.sample(10)) == set(range(10))
+
+
 def test_health_state():
     grid = Grid(3, 3)
     agents = {
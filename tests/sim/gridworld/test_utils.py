@@ -0,0 +1,449 @@
+import numpy as np
+import pytest
+
+from abmarl.sim.gridworld.agent import AttackingAgent, GridWorldAgent
+from abmarl.sim.gridworld.grid import Grid, SparseGrid
+from abmarl.sim.gridworld.state import PositionState
+import abmarl.sim.gridworld.utils as gu
+
+
+def ray_mask(agent, mask_range, agents):
+    """
+    Reference implementation that evaluates the rays cell by cell.
+    """
+    mask = np.ones((2 * mask_range + 1, 2 * mask_range + 1))
+    for other in agents.values():
+        if other.blocking:
+            r_diff, c_diff = other.position - agent.position
+            # Ensure the other agent within the view range
+            if -mask_range <= r_diff <= mask_range and \
+                    -mask_range <= c_diff <= mask_range:
+                if c_diff > 0 and r_diff == 0: # Other is to the right of agent
+                    upper = lambda t: (r_diff + 0.5) / (c_diff - 0.5) * t
+                    lower = lambda t: (r_diff - 0.5) / (c_diff - 0.5) * t
+                    for c in range(c_diff, mask_range+1):
+                        for r in range(-mask_range, mask_range+1):
+                            if c == c_diff and r == r_diff: continue # don't mask the other
+                            if lower(c) < r < upper(c):
+                                mask[r + mask_range, c + mask_range] = 0
+                elif c_diff > 0 and r_diff > 0: # Other is below-right of agent
+                    upper = lambda t: (r_diff + 0.5) / (c_diff - 0.5) * t
+                    lower = lambda t: (r_diff - 0.5) / (c_diff + 0.5) * t
+                    for c in range(c_diff, mask_range+1):
+                        for r in range(r_diff, mask_range+1):
+                            if c == c_diff and r == r_diff: continue # Don't mask the other
+                            if lower(c) < r < upper(c):
+                                mask[r + mask_range, c + mask_range] = 0
+                elif c_diff == 0 and r_diff > 0: # Other is below the agent
+                    left = lambda t: (c_diff - 0.5) / (r_diff - 0.5) * t
+                    right = lambda t: (c_diff + 0.5) / (r_diff - 0.5) * t
+                    for c in range(-mask_range, mask_range+1):
+                        for r in range(r_diff, mask_range+1):
+                            if c == c_diff and r == r_diff: continue # don't mask the other
+                            if left(r) < c < right(r):
+                                mask[r + mask_range, c + mask_range] = 0
+                elif c_diff < 0 and r_diff > 0: # Other is below-left of agent
+                    upper = lambda t: (r_diff + 0.5) / (c_diff + 0.5) * t
+                    lower = lambda t: (r_diff - 0.5) / (c_diff - 0.5) * t
+                    for c in range(c_diff, -mask_range-1, -1):
+                        for r in range(r_diff, mask_range+1):
+                            if c == c_diff and r == r_diff: continue # don't mask the other
+                            if lower(c) < r < upper(c):
+                                mask[r + mask_range, c + mask_range] = 0
+                elif c_diff < 0 and r_diff == 0: # Other is left of agent
+                    upper = lambda t: (r_diff + 0.5) / (c_diff + 0.5) * t
+                    lower = lambda t: (r_diff - 0.5) / (c_diff + 0.5) * t
+                    for c in range(c_diff, -mask_range-1, -1):
+                        for r in range(-mask_range, mask_range+1):
+                            if c == c_diff and r == r_diff: continue # don't mask the other
+                            if lower(c) < r < upper(c):
+                                mask[r + mask_range, c + mask_range] = 0
+                elif c_diff < 0 and r_diff < 0: # Other is above-left of agent
+                    upper = lambda t: (r_diff + 0.5) / (c_diff - 0.5) * t
+                    lower = lambda t: (r_diff - 0.5) / (c_diff + 0.5) * t
+                    for c in range(c_diff, -mask_range - 1, -1):
+                        for r in range(r_diff, -mask_range - 1, -1):
+                            if c == c_diff and r == r_diff: continue # don't mask the other
+                            if lower(c) < r < upper(c):
+                                mask[r + mask_range, c + mask_range] = 0
+                elif c_diff == 0 and r_diff < 0: # Other is above the agent
+                    left = lambda t: (c_diff - 0.5) / (r_diff + 0.5) * t
+                    right = lambda t: (c_diff + 0.5) / (r_diff + 0.5) * t
+                    for c in range(-mask_range, mask_range+1):
+                        for r in range(r_diff, -mask_range - 1, -1):
+                            if c == c_diff and r == r_diff: continue # don't mask the other
+                            if left(r) < c < right(r):
+                                mask[r + mask_range, c + mask_range] = 0
+                elif c_diff > 0 and r_diff < 0: # Other is above-right of agent
+                    upper = lambda t: (r_diff + 0.5) / (c_diff + 0.5) * t
+                    lower = lambda t: (r_diff - 0.5) / (c_diff - 0.5) * t
+                    for c in range(c_diff, mask_range+1):
+                        for r in range(r_diff, -mask_range - 1, -1):
+                            if c == c_diff and r == r_diff: continue # don't mask the other
+                            if lower(c) < r < upper(c):
+                                mask[r + mask_range, c + mask_range] = 0
+
+    return mask
+
+
+def random_agents(rows, cols, number_of_agents, blocking_probability):
+    positions = np.random.choice(rows * cols, number_of_agents, replace=False)
+    return {
+        f'agent{i}': GridWorldAgent(
+            id=f'agent{i}',
+            encoding=1,
+            blocking=bool(np.random.uniform() < blocking_probability),
+            initial_position=np.array(np.unravel_index(position, (rows, cols)))
+        ) for i, position in enumerate(positions)
+    }
+
+
+@pytest.mark.parametrize('mask_range', [0, 1, 2, 4, 7])
+def test_create_grid_and_mask_matches_rays(mask_range):
+    np.random.seed(7)
+    for _ in range(4):
+        agents = random_agents(12, 12, 60, 0.5)
+        grid = Grid(12, 12)
+        PositionState(grid=grid, agents=agents).reset()
+        for agent in agents.values():
+            local_grid, mask = gu.create_grid_and_mask(agent, grid, mask_range)
+            np.testing.assert_array_equal(mask, ray_mask(agent, mask_range, agents))
+            assert mask.dtype == ray_mask(agent, mask_range, agents).dtype
+
+
+def test_compute_shadows():
+    shadows = gu.compute_shadows(np.array([0, 1]), np.array([1, 1]), 2)
+    assert shadows.shape == (2, 5, 5)
+    np.testing.assert_array_equal(
+        shadows[0],
+        np.array([
+            [False, False, False, False, False],
+            [False, False, False, False,  True],
+            [False, False, False, False,  True],
+            [False, False, False, False,  True],
+            [False, False, False, False, False],
+        ])
+    )
+    np.testing.assert_array_equal(
+        shadows[1],
+        np.array([
+            [False, False, False, False, False],
+            [False, False, False, False, False],
+            [False, False, False, False, False],
+            [False, False, False, False,  True],
+            [False, False, False,  True,  True],
+        ])
+    )
+
+
+def test_shadow_stencils():
+    stencils = gu.get_shadow_stencils(3)
+    assert stencils.shape == (7, 7, 7, 7)
+    assert not stencils.flags.writeable
+    assert not stencils[3, 3].any()
+    for r in range(-3, 4):
+        for c in range(-3, 4):
+            if r == 0 and c == 0:
+                continue
+            np.testing.assert_array_equal(
+                stencils[r + 3, c + 3], gu.compute_shadows(np.array([r]), np.array([c]), 3)[0]
+            )
+    assert gu.get_shadow_stencils(3) is stencils
+
+
+def test_static_visibility_matches_dynamic_blockers():
+    np.random.seed(11)
+    dynamic_agents = random_agents(10, 9, 45, 0.6)
+    static_agents = {
+        agent.id: GridWorldAgent(
+            id=agent.id,
+            encoding=1,
+            blocking=agent.blocking,
+            static=agent.blocking,
+            initial_position=agent.initial_position
+        ) for agent in dynamic_agents.values()
+    }
+    dynamic_grid = Grid(10, 9, agents=dynamic_agents)
+    static_grid = Grid(10, 9, agents=static_agents)
+    assert dynamic_grid.static_visibility is None
+    assert isinstance(static_grid.static_visibility, gu.StaticVisibility)
+    PositionState(grid=dynamic_grid, agents=dynamic_agents).reset()
+    PositionState(grid=static_grid, agents=static_agents).reset()
+    for mask_range in [1, 3, 12]:
+        for agent_id in dynamic_agents:
+            _, dynamic_mask = gu.create_grid_and_mask(
+                dynamic_agents[agent_id], dynamic_grid, mask_range
+            )
+            _, static_mask = gu.create_grid_and_mask(
+                static_agents[agent_id], static_grid, mask_range
+            )
+            np.testing.assert_array_equal(dynamic_mask, static_mask)
+
+
+
+def test_sparse_grid_counts_static_blockers():
+    np.random.seed(12)
+    layout = random_agents(10, 9, 45, 0.6)
+
+    def static_agents():
+        return {
+            agent.id: GridWorldAgent(
+                id=agent.id,
+                encoding=1,
+                blocking=agent.blocking,
+                static=agent.blocking,
+                initial_position=agent.initial_position
+            ) for agent in layout.values()
+        }
+
+    dense_agents, sparse_agents = static_agents(), static_agents()
+    dense_grid = Grid(10, 9, agents=dense_agents)
+    sparse_grid = SparseGrid(10, 9, agents=sparse_agents)
+    assert isinstance(dense_grid.static_visibility, gu.StaticVisibility)
+    assert sparse_grid.static_visibility is None
+    PositionState(grid=dense_grid, agents=dense_agents).reset()
+    PositionState(grid=sparse_grid, agents=sparse_agents).reset()
+    for mask_range in [1, 3]:
+        for agent_id in dense_agents:
+            _, dense_mask = gu.create_grid_and_mask(
+                dense_agents[agent_id], dense_grid, mask_range
+            )
+            _, sparse_mask = gu.create_grid_and_mask(
+                sparse_agents[agent_id], sparse_grid, mask_range
+            )
+            np.testing.assert_array_equal(dense_mask, sparse_mask)
+
+    with pytest.raises(AssertionError):
+        SparseGrid(10, 9, static_visibility_cache='visibility')
+
+
+def test_static_visibility_cache(tmp_path):
+    blocking = np.zeros((5, 6), dtype=bool)
+    blocking[2, 3] = True
+    blocking[0, 1] = True
+    prefix = str(tmp_path / 'map.txt')
+    visibility = gu.StaticVisibility(blocking, cache_prefix=prefix)
+    table = visibility.get_table(2)
+    assert table.shape == (5, 6, 5, 5)
+    assert len(list(tmp_path.glob('map.txt.visibility_2_*.npy'))) == 1
+    assert isinstance(table, np.memmap)
+    np.testing.assert_array_equal(
+        visibility.get_mask((2, 1), 2),
+        ~gu.get_shadow_stencils(2)[2, 4]
+    )
+
+    cached = gu.StaticVisibility(blocking, cache_prefix=prefix)
+    np.testing.assert_array_equal(cached.get_table(2), table)
+    assert len(list(tmp_path.glob('map.txt.visibility_*.npy'))) == 1
+
+    blocking[4, 4] = True
+    gu.StaticVisibility(blocking, cache_prefix=prefix).get_table(2)
+    assert len(list(tmp_path.glob('map.txt.visibility_2_*.npy'))) == 2
+
+
+def test_mask_ignores_blockers_removed_from_grid():
+    agents = {
+        'agent0': GridWorldAgent(id='agent0', encoding=1, initial_position=np.array([2, 0])),
+        'agent1': GridWorldAgent(
+            id='agent1', encoding=2, initial_position=np.array([2, 1]), blocking=True
+        ),
+    }
+    grid = Grid(5, 5)
+    PositionState(grid=grid, agents=agents).reset()
+    _, mask = gu.create_grid_and_mask(agents['agent0'], grid, 2)
+    assert not mask.all()
+    grid.remove(agents['agent1'], agents['agent1'].position)
+    _, mask = gu.create_grid_and_mask(agents['agent0'], grid, 2)
+    assert mask.all()
+
+    # The agents argument is deprecated because the blocking comes from the grid.
+    with pytest.warns(DeprecationWarning):
+        _, mask = gu.create_grid_and_mask(agents['agent0'], grid, 2, agents)
+    assert mask.all()
+
+
+def test_visibility_service_matches_create_grid_and_mask():
+    np.random.seed(11)
+    agents = random_agents(10, 10, 40, 0.5)
+    grid = Grid(10, 10)
+    PositionState(grid=grid, agents=agents).reset()
+    for agent in agents.values():
+        # The larger range is cached first, so the smaller ranges are cropped from it.
+        for mask_range in [4, 2, 0, 3]:
+            local_grid, mask = grid.visibility.get_grid_and_mask(agent, mask_range)
+            expected_grid, expected_mask = gu.create_grid_and_mask(
+                agent, grid, mask_range
+            )
+            np.testing.assert_array_equal(mask, expected_mask)
+            np.testing.assert_array_equal(local_grid, expected_grid)
+
+
+def test_visibility_service_caches_max_range():
+    agents = {
+        'agent0': AttackingAgent(
+            id='agent0', encoding=1, initial_position=np.array([3, 3]), attack_range=3,
+            attack_strength=1, attack_accuracy=1
+        ),
+        'agent1': GridWorldAgent(id='agent1', encoding=2, initial_position=np.array([0, 0])),
+        'agent2': GridWorldAgent(
+            id='agent2', encoding=2, initial_position=np.array([3, 4]), blocking=True
+        ),
+    }
+    grid = Grid(7, 7)
+    PositionState(grid=grid, agents=agents).reset()
+
+    # The mask is computed at the attack range even if a smaller range is requested first.
+    mask = grid.visibility.get_mask(agents['agent0'], 1)
+    np.testing.assert_array_equal(mask, gu.create_mask(agents['agent0'], grid, 1))
+    cached = grid.visibility._cache['agent0'][3]
+    assert cached.shape == (7, 7)
+    mask = grid.visibility.get_mask(agents['agent0'], 3)
+    assert np.shares_memory(mask, cached)
+    np.testing.assert_array_equal(mask, gu.create_mask(agents['agent0'], grid, 3))
+
+    # Agents without ranges are masked at the largest range requested for them.
+    grid.visibility.get_mask(agents['agent1'], 2)
+    grid.remove(agents['agent1'], (0, 0))
+    grid.place(agents['agent1'], (0, 1))
+    grid.visibility.get_mask(agents['agent1'], 1)
+    assert grid.visibility._cache['agent1'][2] == 2
+
+
+def test_visibility_service_invalidation():
+    agents = {
+        'agent0': GridWorldAgent(id='agent0', encoding=1, initial_position=np.array([2, 0])),
+        'agent1': GridWorldAgent(
+            id='agent1', encoding=2, initial_position=np.array([2, 1]), blocking=True
+        ),
+    }
+    grid = Grid(5, 5)
+    PositionState(grid=grid, agents=agents).reset()
+    _, mask = grid.visibility.get_grid_and_mask(agents['agent0'], 2)
+    assert np.shares_memory(grid.visibility.get_grid_and_mask(agents['agent0'], 2)[1], mask)
+    assert not mask.flags.writeable
+    assert not mask.all()
+
+    # Removing the blocker invalidates the cached mask
+    grid.remove(agents['agent1'], agents['agent1'].position)
+    _, mask = grid.visibility.get_grid_and_mask(agents['agent0'], 2)
+    assert mask.all()
+
+    # Moving the agent invalidates the cached mask
+    grid.place(agents['agent1'], (2, 2))
+    grid.remove(agents['agent0'], agents['agent0'].position)
+    grid.place(agents['agent0'], (2, 3))
+    local_grid, mask = grid.visibility.get_grid_and_mask(agents['agent0'], 2)
+    assert not mask[2, 0]
+    assert 'agent0' in local_grid[2, 2]
+
+
+def rays_from_window(blocking, mask_range):
+    offsets = np.argwhere(blocking) - mask_range
+    offsets = offsets[np.any(offsets != 0, axis=1)]
+    mask = np.ones(blocking.shape)
+    if len(offsets):
+        mask[gu.get_shadow_stencils(mask_range)[
+            offsets[:, 0] + mask_range, offsets[:, 1] + mask_range
+        ].any(axis=0)] = 0
+    return mask
+
+
+def test_shadowcast_without_blockers():
+    for mask_range in [0, 1, 3]:
+        blocking = np.zeros((2 * mask_range + 1, 2 * mask_range + 1), dtype=bool)
+        np.testing.assert_array_equal(
+            gu.shadowcast_mask(blocking, mask_range),
+            np.ones((2 * mask_range + 1, 2 * mask_range + 1))
+        )
+
+
+def test_shadowcast_differs_from_rays():
+    # A blocker next to the agent. Both algorithms hide the cells directly behind
+    # it, but the rays pass through the corners of the blocker, so they also hide
+    # the cells diagonally behind it.
+    blocking = np.zeros((7, 7), dtype=bool)
+    blocking[3, 4] = True
+    rays = rays_from_window(blocking, 3)
+    shadowcast = gu.shadowcast_mask(blocking, 3)
+    assert not rays[3, 5] and not shadowcast[3, 5]
+    assert not rays[3, 6] and not shadowcast[3, 6]
+    assert not rays[2, 5] and not rays[4, 5]
+    assert shadowcast[2, 5] and shadowcast[4, 5]
+
+    # A diagonal blocker. Shadowcasting hides a cell only if its center is
+    # outside the visible sector, so cells next to the shadow stay visible.
+    blocking = np.zeros((7, 7), dtype=bool)
+    blocking[2, 4] = True
+    rays = rays_from_window(blocking, 3)
+    shadowcast = gu.shadowcast_mask(blocking, 3)
+    assert not rays[1, 5] and not shadowcast[1, 5]
+    assert not rays[0, 6] and not shadowcast[0, 6]
+    assert not rays[1, 4] and not rays[2, 5]
+    assert shadowcast[1, 4] and shadowcast[2, 5]
+
+    # Blockers on the diagonals. The rays close the gaps between the blockers,
+    # but shadowcasting lets the agent see through them.
+    blocking = np.zeros((7, 7), dtype=bool)
+    blocking[2, 2] = blocking[2, 4] = blocking[4, 2] = blocking[4, 4] = True
+    rays = rays_from_window(blocking, 3)
+    shadowcast = gu.shadowcast_mask(blocking, 3)
+    assert rays[1, 3] and shadowcast[1, 3]
+    assert not rays[1, 2] and not rays[1, 4]
+    assert shadowcast[1, 2] and shadowcast[1, 4]
+
+
+def test_shadowcast_sees_at_least_as_much_as_rays():
+    np.random.seed(5)
+    for mask_range in [1, 2, 4]:
+        for _ in range(200):
+            blocking = np.random.uniform(
+                size=(2 * mask_range + 1, 2 * mask_range + 1)
+            ) < np.random.uniform(0, 0.4)
+            rays = rays_from_window(blocking, mask_range)
+            shadowcast = gu.shadowcast_mask(blocking, mask_range)
+            assert np.all(shadowcast >= rays)
+
+
+def test_shadowcast_is_symmetric():
+    np.random.seed(3)
+    agents = random_agents(9, 9, 50, 0.4)
+    grid = Grid(9, 9, agents=agents, visibility_algorithm='shadowcast')
+    PositionState(grid=grid, agents=agents).reset()
+    floor = [agent for agent in agents.values() if not agent.blocking]
+    masks = {agent.id: gu.create_mask(agent, grid, 3) for agent in floor}
+    for agent in floor:
+        for other in floor:
+            r, c = other.position - agent.position
+            if abs(r) <= 3 and abs(c) <= 3:
+                assert masks[agent.id][r + 3, c + 3] == masks[other.id][3 - r, 3 - c]
+
+
+def test_grid_visibility_algorithm():
+    agents = {
+        'agent0': GridWorldAgent(id='agent0', encoding=1, initial_position=np.array([2, 2])),
+        'wall0': GridWorldAgent(
+            id='wall0', encoding=2, initial_position=np.array([2, 3]), blocking=True,
+            static=True
+        ),
+        'wall1': GridWorldAgent(
+            id='wall1', encoding=2, initial_position=np.array([0, 0]), blocking=True
+        ),
+    }
+    grid = Grid(5, 5, agents=agents)
+    assert grid.visibility_algorithm == 'rays'
+    assert grid.static_visibility is not None
+
+    # Static blockers are cast with the other blockers when shadowcasting
+    grid = Grid(5, 5, agents=agents, visibility_algorithm='shadowcast')
+    assert grid.visibility_algorithm == 'shadowcast'
+    assert grid.static_visibility is None
+    PositionState(grid=grid, agents=agents).reset()
+    blocking = np.zeros((5, 5), dtype=bool)
+    blocking[2, 3] = blocking[0, 0] = True
+    np.testing.assert_array_equal(
+        grid.visibility.get_grid_and_mask(agents['agent0'], 2)[1],
+        gu.shadowcast_mask(blocking, 2)
+    )
+
+    with pytest.raises(AssertionError):
+        Grid(5, 5, visibility_algorithm='cones')
@@ -1,10 +1,16 @@
 
 from gym.spaces import Discrete, Box
 import numpy as np
+import pytest
 
 from abmarl.sim.gridworld.actor import MoveActor, ActorBaseComponent
+from abmarl.sim.gridworld.agent import GridObservingAgent, GridWorldAgent
+from abmarl.sim.gridworld.grid import Grid
+from abmarl.sim.gridworld.observer import ObserverBaseComponent, SingleGridObserver, \
+    MultiGridObserver
 from abmarl.sim.gridworld.state import PositionState
-from abmarl.sim.gridworld.wrapper import RavelActionWrapper, ActorWrapper
+from abmarl.sim.gridworld.wrapper import RavelActionWrapper, ActorWrapper, ObserverWrapper, \
+    PoolingObserverWrapper, DownsampleObserverWrapper
 
 from .helpers import grid, moving_agents as agents
 
@@ -69,3 +75,133 @@ def test_ravel_action_wrapper_process_action():
     np.testing.assert_array_equal(agents['agent2'].position, np.array([0, 1]))
     assert not ravel_action_wrapper.process_action(agents['agent3'], action_sample['agent3'])
     np.testing.assert_array_equal(agents['agent3'].position, np.array([3, 1]))
+
+
+def _observing_setup():
+    observing_grid = Grid(7, 7)
+    observing_agents = {
+        'agent0': GridObservingAgent(
+            id='agent0', initial_position=np.array([3, 3]), encoding=1, view_range=3
+        ),
+        'agent1': GridObservingAgent(
+            id='agent1', initial_position=np.array([0, 6]), encoding=2, view_range=3
+        ),
+        'agent2': GridWorldAgent(id='agent2', initial_position=np.array([0, 0]), encoding=3),
+        'agent3': GridWorldAgent(id='agent3', initial_position=np.array([6, 4]), encoding=4),
+        'agent4': GridWorldAgent(id='agent4', initial_position=np.array([4, 3]), encoding=5),
+    }
+    PositionState(grid=observing_grid, agents=observing_agents).reset()
+    return observing_grid, observing_agents
+
+
+def test_pooling_observer_wrapper_properties():
+    observing_grid, observing_agents = _observing_setup()
+    observer = SingleGridObserver(grid=observing_grid, agents=observing_agents)
+    wrapper = PoolingObserverWrapper(observer, full_range=1, pool_size=2)
+    assert isinstance(wrapper, ObserverWrapper)
+    assert isinstance(wrapper, ObserverBaseComponent)
+    assert wrapper.wrapped_component == observer
+    assert wrapper.unwrapped == observer
+    assert wrapper.key == observer.key
+    assert wrapper.supported_agent_type == observer.supported_agent_type
+    assert not wrapper.reuse_buffers
+    wrapper.reuse_buffers = True
+    assert observer.reuse_buffers
+    assert wrapper._buffers is observer._buffers
+    assert wrapper.from_space['agent0'] == Box(-2, 5, (7, 7), int)
+    assert observing_agents['agent0'].observation_space['grid'] == Box(-2, 5, (5, 5), int)
+    assert wrapper.from_space['agent1'] == Box(-2, 5, (7, 7), int)
+    assert observing_agents['agent1'].observation_space['grid'] == Box(-2, 5, (5, 5), int)
+
+
+def test_pooling_observer_wrapper_get_obs():
+    observing_grid, observing_agents = _observing_setup()
+    observer = SingleGridObserver(grid=observing_grid, agents=observing_agents)
+    wrapper = PoolingObserverWrapper(observer, full_range=1, pool_size=2)
+    np.testing.assert_array_equal(
+        wrapper.get_obs(observing_agents['agent0'])['grid'],
+        np.array([
+            [3, 0, 0, 0, 2],
+            [0, 0, 0, 0, 0],
+            [0, 0, 1, 0, 0],
+            [0, 0, 5, 0, 0],
+            [0, 0, 0, 4, 0]
+        ])
+    )
+    np.testing.assert_array_equal(
+        wrapper.get_obs(observing_agents['agent1'])['grid'],
+        np.array([
+            [-1, -1, -1, -1, -1],
+            [-1, -1, -1, -1, -1],
+            [ 0,  0,  2, -1, -1],
+            [ 0,  0,  0, -1, -1],
+            [ 1,  0,  0, -1, -1]
+        ])
+    )
+    np.testing.assert_array_equal(
+        wrapper.get_obs_batch(list(observing_agents.values())[:2])['grid'],
+        np.stack([
+            wrapper.get_obs(observing_agents['agent0'])['grid'],
+            wrapper.get_obs(observing_agents['agent1'])['grid'],
+        ])
+    )
+
+
+def test_pooling_observer_wrapper_multi_grid():
+    observing_grid, observing_agents = _observing_setup()
+    observer = MultiGridObserver(grid=observing_grid, agents=observing_agents)
+    wrapper = PoolingObserverWrapper(observer, full_range=0, pool_size=3)
+    assert observing_agents['agent0'].observation_space['grid'] == Box(-2, 5, (3, 3, 5), int)
+    unwrapped = observer.get_obs(observing_agents['agent0'])['grid']
+    wrapped = wrapper.get_obs(observing_agents['agent0'])['grid']
+    for i, rows in enumerate([slice(0, 3), slice(3, 4), slice(4, 7)]):
+        for j, cols in enumerate([slice(0, 3), slice(3, 4), slice(4, 7)]):
+            np.testing.assert_array_equal(
+                wrapped[i, j], unwrapped[rows, cols].max(axis=(0, 1))
+            )
+
+
+def test_downsample_observer_wrapper():
+    observing_grid, observing_agents = _observing_setup()
+    observer = SingleGridObserver(grid=observing_grid, agents=observing_agents)
+    wrapper = DownsampleObserverWrapper(observer, crop_range=2, stride=2)
+    assert isinstance(wrapper, ObserverWrapper)
+    assert observing_agents['agent0'].observation_space['grid'] == Box(-2, 5, (3, 3), int)
+    assert observing_agents['agent1'].observation_space['grid'] == Box(-2, 5, (3, 3), int)
+    np.testing.assert_array_equal(
+        wrapper.get_obs(observing_agents['agent0'])['grid'],
+        np.array([
+            [0, 0, 0],
+            [0, 1, 0],
+            [0, 0, 0]
+        ])
+    )
+    unwrapped = observer.get_obs(observing_agents['agent1'])['grid']
+    np.testing.assert_array_equal(
+        wrapper.get_obs(observing_agents['agent1'])['grid'], unwrapped[1:6:2, 1:6:2]
+    )
+    np.testing.assert_array_equal(
+        wrapper.get_obs_batch(list(observing_agents.values())[:2])['grid'],
+        np.stack([
+            wrapper.get_obs(observing_agents['agent0'])['grid'],
+            wrapper.get_obs(observing_agents['agent1'])['grid'],
+        ])
+    )
+
+    cropped = DownsampleObserverWrapper(
+        SingleGridObserver(grid=observing_grid, agents=observing_agents)
+    )
+    assert observing_agents['agent0'].observation_space['grid'] == Box(-2, 5, (7, 7), int)
+    np.testing.assert_array_equal(
+        cropped.get_obs(observing_agents['agent0'])['grid'],
+        cropped.wrapped_component.get_obs(observing_agents['agent0'])['grid']
+    )
+
+    with pytest.raises(AssertionError):
+        DownsampleObserverWrapper(
+            SingleGridObserver(grid=observing_grid, agents=observing_agents), crop_range=4
+        )
+    with pytest.raises(AssertionError):
+        PoolingObserverWrapper(
+            SingleGridObserver(grid=observing_grid, agents=observing_agents), pool_size=0
+        )